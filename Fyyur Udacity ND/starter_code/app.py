@@ -2,185 +2,436 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import hashlib
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timezone
+from flask import Flask, Blueprint, current_app, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, jsonify, session
+import forms
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
-from models import *
+from sqlalchemy import exc
+from models import db, Venue, Artist, Show
+from filters import format_datetime, configure_datetime_cache
+import queries
+import autocomplete
+import cache
+import counters
+import importer
+import export
+import instrumentation
+import metrics
+import slowqueries
+import replicas
+import database
 
 
-# Filters.
+#----------------------------------------------------------------------------#
+# App.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format, locale='en_US')
-
+main = Blueprint('main', __name__)
+
+
+class LazyMoment(object):
+    """The `moment` template global of Flask-Moment, imported on first use.
+
+    Flask-Moment pulls in distutils when it is imported, which is most of
+    the import time of the app; no page uses it yet.
+    """
+
+    def _moment(self):
+        from flask_moment import _moment
+        return _moment
+
+    def __call__(self, *args, **kwargs):
+        return self._moment()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._moment(), name)
+
+
+def create_app(config=None):
+    # config: settings applied over those of config.py
+    app = Flask(__name__)
+    app.config.from_object('config')
+    if config:
+        app.config.update(config)
+    # set by manage.py and the bulk scripts
+    command_line = app.config.get('COMMAND_LINE', False)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          database.engine_options(app.config, command_line))
+    db.init_app(app)
+    app.jinja_env.globals['moment'] = LazyMoment()
+    # Flask-Migrate, and Alembic behind it, for `flask db`, whichever of
+    # app.py and manage.py FLASK_APP names
+    from flask_migrate import Migrate
+    Migrate(app, db)
+
+    configure_datetime_cache(app.config.get('DATETIME_FORMAT_CACHE_SIZE', 4096))
+    app.jinja_env.filters['datetime'] = format_datetime
+
+    cache.configure(app.config.get('PAGE_CACHE_SIZE', 1024),
+                    app.config.get('PAGE_CACHE_TTL', 300),
+                    app.config.get('CACHE_BACKEND', 'local'),
+                    app.config.get('CACHE_ADDRESS'))
+
+    with app.app_context():
+        engines = dict(primary=db.engine, **replicas.init_app(app, db))
+    database.init_app(app, *engines.values())
+    instrumentation.init_app(app, *engines.values())
+    metrics.init_app(app, engines)
+    slowqueries.init_app(app, *engines.values())
+
+    # flask counters rollover / flask counters check
+    app.cli.add_command(counters.cli)
+    # flask import venues|artists|shows PATH
+    app.cli.add_command(importer.cli)
+    # flask export venues|artists|shows
+    app.cli.add_command(export.cli)
+    # flask slow-queries report
+    app.cli.add_command(slowqueries.cli)
+
+    app.register_blueprint(main)
+
+    if not app.debug:
+        file_handler = FileHandler('error.log')
+        file_handler.setFormatter(
+            Formatter(
+                '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        app.logger.setLevel(logging.INFO)
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.info('errors')
+    return app
+
+
+def stream_template(template_name, **context):
+    # render a template piece by piece instead of into one string
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(20)
+    return stream
 
-app.jinja_env.filters['datetime'] = format_datetime
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 
-@app.route('/')
+@main.route('/')
 def index():
     return render_template('pages/home.html')
 
 
+def search_match_fields():
+    # searches match the name, plus any of city, state and genres sent as
+    # repeated "match" form fields
+    return [field for field in request.form.getlist('match')
+            if field in queries.SEARCH_MATCH_FIELDS]
+
+
+def cached_page(key, render):
+    # render() returns (html, expires_at). Pending flash messages would be
+    # baked into the html, so requests that have some skip the cache, as do
+    # those of a client that just wrote, which must see its change.
+    if session.get('_flashes') or replicas.pinned():
+        return render()[0]
+    return cache.pages.get_or_build(key, replicas.bounded(render))
+
+
+def detail_view(key, load):
+    # view-model dict of a detail page, 404 if the entity does not exist
+    def build():
+        data = load()
+        if data is None:
+            abort(404)
+        return data, data['next_show_at']
+    if replicas.pinned():
+        return build()[0]
+    return cache.views.get_or_build(key, replicas.bounded(build))
+
+
+@main.route('/cache/stats')
+def cache_stats():
+    return jsonify({name: store.stats() for name, store in cache.CACHES.items()})
+
+
+@main.route('/metrics')
+def metrics_page():
+    # Prometheus text format, for this worker process
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    return Response(metrics.render(current_app.extensions.get('replicas')),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@main.before_app_first_request
+def load_autocomplete():
+    # indexes loaded before the worker forked (wsgi.py) are kept
+    for name, index in sorted(autocomplete.INDEXES.items()):
+        if not index.loaded:
+            index.load()
+            current_app.logger.info('autocomplete %s index: %s', name, index.stats())
+
+
+@main.route('/api/autocomplete')
+def autocomplete_names():
+    # typeahead for the search boxes: /api/autocomplete?type=venue&q=mu
+    index = autocomplete.INDEXES.get(request.args.get('type'))
+    if index is None:
+        abort(400)
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify({"results": index.search(request.args.get('q', ''), limit)})
+
+
+@main.route('/export/<entity>.<format>')
+@replicas.reads
+def export_entity(entity, format):
+    # /export/venues.ndjson, /export/shows.csv?since=<id or ISO timestamp>;
+    # gzipped on the fly for clients that accept it
+    if entity not in export.ENTITIES or format not in export.FORMATS:
+        abort(404)
+    since = request.args.get('since')
+    if since:
+        try:
+            since = export.parse_since(since)
+        except ValueError:
+            abort(400)
+    else:
+        since = None
+    gzip = request.accept_encodings['gzip'] > 0
+    response = Response(stream_with_context(export.export(entity, format, since, gzip)),
+                        mimetype=export.FORMATS[format])
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (entity, format)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+#  API
+#  ----------------------------------------------------------------
+
+def api_value(value):
+    # datetimes as ISO 8601 rather than the HTTP dates jsonify writes
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def api_fields(allowed):
+    # ?fields=id,name picks the keys of each object; all of them by default
+    fields = request.args.get('fields')
+    if not fields:
+        return list(allowed)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not fields or any(field not in allowed for field in fields):
+        abort(400)
+    return fields
+
+
+def api_limit():
+    limit = request.args.get('limit', queries.API_PAGE_SIZE, type=int)
+    if limit < 1:
+        abort(400)
+    return min(limit, queries.API_MAX_PAGE_SIZE)
+
+
+def api_response(version, build):
+    # version is (parts, last_modified) from one of the queries.*_version
+    # helpers, None when the resource does not exist. The ETag and
+    # Last-Modified headers come from it alone, so a request they match is
+    # answered with a 304 before build() loads anything.
+    if version is None:
+        abort(404)
+    parts, last_modified = version
+    etag = hashlib.sha1(repr((
+        request.path, sorted(request.args.items(multi=True)), parts
+    )).encode('utf-8')).hexdigest()
+    if last_modified is not None:
+        # stored as naive local time, sent as UTC, to the second
+        last_modified = last_modified.astimezone(timezone.utc).replace(
+            tzinfo=None, microsecond=0)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        if since is not None and since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        not_modified = since is not None and last_modified is not None \
+            and last_modified <= since
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(json.dumps(build(), default=api_value),
+                            mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # cache, but revalidate every time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def api_select(data, fields):
+    return {field: data[field] for field in fields}
+
+
+@main.route('/api/v1/venues')
+@replicas.reads
+def api_venues():
+    # ?after=<id of the last venue of the previous page>&limit=&fields=
+    try:
+        after = request.args.get('after')
+        after = int(after) if after else None
+    except ValueError:
+        abort(400)
+    fields = api_fields(queries.VENUE_LIST_FIELDS)
+    limit = api_limit()
+    return api_response(queries.venue_list_version(after, limit),
+                        lambda: queries.venue_list(fields, after, limit))
+
+
+@main.route('/api/v1/venues/<int:venue_id>')
+@replicas.reads
+def api_venue(venue_id):
+    fields = api_fields(queries.VENUE_DETAIL_FIELDS)
+    return api_response(queries.venue_version(venue_id), lambda: api_select(
+        detail_view(('venue', venue_id), lambda: queries.venue_detail(venue_id)), fields))
+
+
+@main.route('/api/v1/artists/<int:artist_id>')
+@replicas.reads
+def api_artist(artist_id):
+    fields = api_fields(queries.ARTIST_DETAIL_FIELDS)
+    return api_response(queries.artist_version(artist_id), lambda: api_select(
+        detail_view(('artist', artist_id), lambda: queries.artist_detail(artist_id)), fields))
+
+
+@main.route('/api/v1/shows')
+@replicas.reads
+def api_shows():
+    # ?after=<cursor>&limit=&fields=, in start_time order like /shows
+    try:
+        after = request.args.get('after')
+        after = queries.decode_cursor(after) if after else None
+    except ValueError:
+        abort(400)
+    fields = api_fields(queries.SHOW_FIELDS)
+    limit = api_limit()
+
+    def build():
+        page = queries.show_list(after, limit)
+        page['data'] = [api_select(show, fields) for show in page['data']]
+        return page
+    return api_response(queries.show_list_version(after, limit), build)
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@main.route('/venues')
+@replicas.reads
 def venues():
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
-    venues = Venue.query.all()
-    data = []
-    places = set()
-    for venue in venues:
-        places.add((venue.city, venue.state))
-
-    for place in places:
-        data.append({
-            "city": place[0],
-            "state": place[1],
-            "venues": []
-        })
-
-    for venue in venues:
-        num_upcoming_shows = 0
-        shows = Show.query.filter_by(venue_id=venue.id).all()
-        cur_date = datetime.now()
-        for show in shows:
-            if show.start_time >= cur_date:
-                num_upcoming_shows += 1
-        for place in data:
-            if venue.state == place['state'] and venue.city == place['city']:
-                place['venues'].append({
-                    'id': venue.id,
-                    'name': venue.name,
-                    "num_upcoming_shows": num_upcoming_shows
-                })
-
-    return render_template('pages/venues.html', areas=data)
-
-
-@app.route('/venues/search', methods=['POST'])
+    def render():
+        data = queries.venue_areas()
+        return render_template('pages/venues.html', areas=data), queries.next_show_start()
+    return cached_page(('venues',), render)
+
+
+@main.route('/venues/search', methods=['POST'])
+@replicas.reads
 def search_venues():
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+    # case-insensitive partial match on the name, best matches first.
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
     search_term = request.form.get('search_term', '')
-    venues = db.session.query(Venue).filter(
-        Venue.name.ilike(f'%{search_term}%')).all()
-    data = []
-    for venue in venues:
-        data.append({
-            "id": venue.id,
-            "name": venue.name,
-
-        })
-
-    response = {
-        "count": len(venues),
-        "data": data
-    }
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+    response = queries.search_venues(search_term, search_match_fields())
+    return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                           limit=queries.SEARCH_RESULTS_LIMIT)
 
 
-@app.route('/venues/<int:venue_id>')
+@main.route('/venues/<int:venue_id>')
+@replicas.reads
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
-    # TODO: replace with real venue data from the venues table, using venue_id
-    venue = Venue.query.get(venue_id)
-    shows = Show.query.filter_by(venue_id=venue_id).all()
-    upcoming_shows = []
-    past_shows = []
-    cur_time = datetime.now()
-    for show in shows:
-        data = {
-            "artist_id": show.artist_id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": format_datetime(str(show.start_time))
-        }
-        if show.start_time >= cur_time:
-            upcoming_shows.append(data)
-        else:
-            past_shows.append(data)
-    data = {
-        "id": venue.id,
-        "name": venue.name,
-        "genres": venue.genres,
-        "address": venue.address,
-        "city": venue.city,
-        "state": venue.state,
-        "phone": venue.phone,
-        "website": venue.website,
-        "facebook_link": venue.facebook_link,
-        "seeking_talent": venue.seeking_talent,
-        "seeking_description": venue.seeking_description,
-        "image_link": venue.image_link,
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
-    }
+    key = ('venue', venue_id)
+
+    def render():
+        data = detail_view(key, lambda: queries.venue_detail(venue_id))
+        return render_template('pages/show_venue.html', venue=data), data['next_show_at']
+    return cached_page(key, render)
+
+
+def show_page_args():
+    # query string of the show fragment endpoints: ?when=past&after=<start_time,id>
+    when = request.args.get('when', 'upcoming')
+    if when not in ('upcoming', 'past'):
+        abort(400)
+    after = request.args.get('after')
+    if after:
+        try:
+            after = queries.decode_cursor(after)
+        except ValueError:
+            abort(400)
+    return when, after or None
+
+
+@main.route('/venues/<int:venue_id>/shows')
+@replicas.reads
+def venue_shows(venue_id):
+    # next page of a venue's upcoming or past shows, as an html fragment
+    when, after = show_page_args()
+    shows, next_cursor = queries.venue_shows_page(venue_id, when, after)
+    return render_template('fragments/venue_shows.html', shows=shows, when=when,
+                           next_cursor=next_cursor, venue_id=venue_id)
+
 
-    return render_template('pages/show_venue.html', venue=data)
 #  Create Venue
 #  ----------------------------------------------------------------
 
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
-    form = VenueForm()
+    form = forms.VenueForm()
 
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
     # TODO: insert form data as a new Venue record in the db, instead
     error = False
     try:
         # TODO checked: modify data to be the data object returned from db insertion
-        new_venue = Venue(name=request.form.get('name'),
-                          city=request.form.get('city'),
-                          state=request.form.get('state'),
-                          address=request.form.get('address'),
-                          phone=request.form.get('phone'),
-                          image_link=request.form.get('image_link'),
-                          genres=request.form.getlist('genres'),
-                          facebook_link=request.form.get('facebook_link'),
-                          seeking_description=request.form.get(
-            'seeking_description'),
-            website=request.form.get('website'),
-            seeking_talent=request.form.get('seeking_talent'))
-        if request.form.get('seeking_talent') == 'y':
-            new_venue.seeking_talent = True
-
-        db.session.add(new_venue)
-        db.session.commit()
+        with database.transaction():
+            new_venue = Venue(name=request.form.get('name'),
+                              city=request.form.get('city'),
+                              state=request.form.get('state'),
+                              address=request.form.get('address'),
+                              phone=request.form.get('phone'),
+                              image_link=request.form.get('image_link'),
+                              genres=request.form.getlist('genres'),
+                              facebook_link=request.form.get('facebook_link'),
+                              seeking_description=request.form.get(
+                'seeking_description'),
+                website=request.form.get('website'),
+                seeking_talent=request.form.get('seeking_talent'))
+            if request.form.get('seeking_talent') == 'y':
+                new_venue.seeking_talent = True
+
+            db.session.add(new_venue)
+            db.session.flush()
+            venue_id, venue_name = new_venue.id, new_venue.name
+        autocomplete.venues.add(venue_id, venue_name)
+        cache.invalidate(('venues',))
 
     except:
         error = True
-        db.session.rollback()
 
     finally:
-        db.session.close()
         if error:
          # TODO checked: on unsuccessful db insert, flash an error instead.# e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
             flash('An error occurred. Venue ' +
@@ -193,27 +444,26 @@ def create_venue_submission():
     return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
     # TODO: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
     error = False
     try:
-        venue = Venue.query.get(venue_id)
-        db.session.delete(venue)
-        db.session.commit()
+        with database.transaction():
+            venue = Venue.query.get(venue_id)
+            name = venue.name
+            db.session.delete(venue)
+        autocomplete.venues.remove(int(venue_id))
+        cache.invalidate(('venue', int(venue_id)), ('venues',))
 
     except:
         error = True
-        db.session.rollback()
-
-    finally:
 
-        db.session.close()
     if error:
-        flash('an error occured and Venue ' + venue.name + ' has a show')
+        flash('an error occured and Venue ' + name + ' has a show')
     if not error:
-        flash('Venue ' + venue.name + ' was deleted')
+        flash('Venue ' + name + ' was deleted')
     return render_template('pages/home.html')
 
     # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
@@ -224,84 +474,58 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 
 
-@ app.route('/artists')
+@ main.route('/artists')
+@replicas.reads
 def artists():
     # TODO: replace with real data returned from querying the database
-    artists = Artist.query.all()
-    data = []
-    for artist in artists:
-        data.append(artist)
+    def render():
+        artists = db.session.execute(queries.artist_list_select()).all()
+        data = []
+        for artist in artists:
+            data.append(artist)
+        return render_template('pages/artists.html', artists=data), None
+    return cached_page(('artists',), render)
 
-    return render_template('pages/artists.html', artists=data)
 
-
-@ app.route('/artists/search', methods=['POST'])
+@ main.route('/artists/search', methods=['POST'])
+@replicas.reads
 def search_artists():
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+    # case-insensitive partial match on the name, best matches first
     search_term = request.form.get('search_term', '')
-    artists = db.session.query(Artist).filter(
-        Artist.name.ilike(f'%{search_term}%')).all()
-    data = []
-    for artist in artists:
-        data.append({
-            "id": artist.id,
-            "name": artist.name
-
-        })
-
-    response = {
-        "count": len(artists),
-        "data": data
-    }
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+    response = queries.search_artists(search_term, search_match_fields())
+    return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                           limit=queries.SEARCH_RESULTS_LIMIT)
 
 
-@ app.route('/artists/<int:artist_id>')
+@ main.route('/artists/<int:artist_id>')
+@replicas.reads
 def show_artist(artist_id):
-    # shows the venue page with the given venue_id
-    # TODO: replace with real venue data from the venues table, using venue_id
-    artist = Artist.query.get(artist_id)
-    shows = Show.query.filter_by(artist_id=artist_id).all()
-    past_shows = []
-    upcoming_shows = []
-    current_time = datetime.now()
-
-    for show in shows:
-        data = {
-            "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
-            "venue_image_link": show.venue.image_link,
-            "start_time": format_datetime(str(show.start_time))
-        }
-        if show.start_time > current_time:
-            upcoming_shows.append(data)
-        else:
-            past_shows.append(data)
-
-    data = {
-        "id": artist.id,
-        "name": artist.name,
-        "genres": artist.genres,
-        "city": artist.city,
-        "state": artist.state,
-        "phone": artist.phone,
-        "facebook_link": artist.facebook_link,
-        "image_link": artist.image_link,
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
-    }
+    # shows the artist page with the given artist_id
+    key = ('artist', artist_id)
+
+    def render():
+        data = detail_view(key, lambda: queries.artist_detail(artist_id))
+        return render_template('pages/show_artist.html', artist=data), data['next_show_at']
+    return cached_page(key, render)
+
+
+@ main.route('/artists/<int:artist_id>/shows')
+@replicas.reads
+def artist_shows(artist_id):
+    # next page of an artist's upcoming or past shows, as an html fragment
+    when, after = show_page_args()
+    shows, next_cursor = queries.artist_shows_page(artist_id, when, after)
+    return render_template('fragments/artist_shows.html', shows=shows, when=when,
+                           next_cursor=next_cursor, artist_id=artist_id)
 
-    return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
 
 
-@ app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@ main.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-    form = ArtistForm()
+    form = forms.ArtistForm()
     artist = Artist.query.get(artist_id)
     artist = {
         "id": artist.id,
@@ -320,38 +544,43 @@ def edit_artist(artist_id):
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
-@ app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@ main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     # TODO: take values from the form submitted, and update existing
     # artist record with ID <artist_id> using the new attributes
+    form = forms.ArtistForm()
+    name = form.name.data
     try:
-        form = ArtistForm()
-        artist = Artist.query.get(artist_id)
-        artist.name = form.name.data
-        artist.genres = form.genres.data
-        artist.city = form.city.data
-        artist.state = form.state.data
-        artist.phone = form.phone.data
-        artist.facebook_link = form.facebook_link.data
-        artist.website = form.website.data
-        artist.image_link = form.image_link.data
-        artist.seeking_venue = form.seeking_venue.data
-        artist.seeking_description = form.seeking_description.data
-
-        db.session.commit()
-        flash(f'Artist {artist.name} edited successfully')
+        with database.transaction():
+            artist = Artist.query.get(artist_id)
+            artist.name = form.name.data
+            artist.genres = form.genres.data
+            artist.city = form.city.data
+            artist.state = form.state.data
+            artist.phone = form.phone.data
+            artist.facebook_link = form.facebook_link.data
+            artist.website = form.website.data
+            artist.image_link = form.image_link.data
+            artist.seeking_venue = form.seeking_venue.data
+            artist.seeking_description = form.seeking_description.data
+            # venue pages show the artist's name and image next to its shows
+            venue_ids = queries.venue_ids_for_artist(artist_id)
+            Venue.query.filter(Venue.id.in_(venue_ids)).update(
+                {Venue.updated_at: datetime.now()}, synchronize_session=False)
+
+        autocomplete.artists.update(artist_id, name)
+        cache.invalidate(('artist', artist_id), ('artists',),
+                         *[('venue', venue) for venue in venue_ids])
+        flash(f'Artist {name} edited successfully')
     except:
-        db.session.rollback()
-        flash(f'Artist {artist.name} edit failed')
-    finally:
-        db.session.close()
+        flash(f'Artist {name} edit failed')
 
-    return redirect(url_for('show_artist', artist_id=artist_id, form=form))
+    return redirect(url_for('.show_artist', artist_id=artist_id, form=form))
 
 
-@ app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@ main.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-    form = VenueForm()
+    form = forms.VenueForm()
 
     # TODO: populate form with values from venue with ID <venue_id>
 
@@ -373,155 +602,169 @@ def edit_venue(venue_id):
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@ app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@ main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     # TODO: take values from the form submitted, and update existing
+    form = forms.VenueForm()
+    name = form.name.data
     try:
-        form = VenueForm()
-        venue = Venue.query.get(venue_id)
-        venue.name = form.name.data
-        venue.genres = form.genres.data
-        venue.address = form.address.data
-        venue.city = form.city.data
-        venue.state = form.state.data
-        venue.phone = form.phone.data
-        venue.facebook_link = form.facebook_link.data
-        venue.website = form.website.data
-        venue.image_link = form.image_link.data
-        venue.seeking_talent = form.seeking_talent.data
-        venue.seeking_description = form.seeking_description.data
-
-        db.session.commit()
-        flash(f'Venue {venue.name} edited successfully')
+        with database.transaction():
+            venue = Venue.query.get(venue_id)
+            venue.name = form.name.data
+            venue.genres = form.genres.data
+            venue.address = form.address.data
+            venue.city = form.city.data
+            venue.state = form.state.data
+            venue.phone = form.phone.data
+            venue.facebook_link = form.facebook_link.data
+            venue.website = form.website.data
+            venue.image_link = form.image_link.data
+            venue.seeking_talent = form.seeking_talent.data
+            venue.seeking_description = form.seeking_description.data
+            # artist pages show the venue's name and image next to its shows
+            artist_ids = queries.artist_ids_for_venue(venue_id)
+            Artist.query.filter(Artist.id.in_(artist_ids)).update(
+                {Artist.updated_at: datetime.now()}, synchronize_session=False)
+
+        autocomplete.venues.update(venue_id, name)
+        cache.invalidate(('venue', venue_id), ('venues',),
+                         *[('artist', artist) for artist in artist_ids])
+        flash(f'Venue {name} edited successfully')
     except:
-        db.session.rollback()
-        flash(f'Venue {venue.name} edit failed')
-    finally:
-        db.session.close()
+        flash(f'Venue {name} edit failed')
 
     # venue record with ID <venue_id> using the new attributes
-    return redirect(url_for('show_venue', venue_id=venue_id, form=form))
+    return redirect(url_for('.show_venue', venue_id=venue_id, form=form))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
 
-@ app.route('/artists/create', methods=['GET'])
+@ main.route('/artists/create', methods=['GET'])
 def create_artist_form():
-    form = ArtistForm()
+    form = forms.ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
-@ app.route('/artists/create', methods=['POST'])
+@ main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     # called upon submitting the new artist listing form
     # TODO: insert form data as a new Venue record in the db, instead
     try:
         # TODO: modify data to be the data object returned from db insertion
-        new_artist = Artist(name=request.form.get('name'),
-                            city=request.form.get('city'),
-                            state=request.form.get('state'),
-                            phone=request.form.get('phone'),
-                            image_link=request.form.get('image_link'),
-                            genres=request.form.getlist('genres'),
-                            facebook_link=request.form.get('facebook_link'),
-                            seeking_description=request.form.get(
-            'seeking_description'),
-            website=request.form.get('website'),
-            seeking_venue=request.form.get('seeking_venue'))
-        if request.form.get('seeking_venue') == 'y':
-            new_artist.seeking_venue = True
-        db.session.add(new_artist)
-        db.session.commit()
+        with database.transaction():
+            new_artist = Artist(name=request.form.get('name'),
+                                city=request.form.get('city'),
+                                state=request.form.get('state'),
+                                phone=request.form.get('phone'),
+                                image_link=request.form.get('image_link'),
+                                genres=request.form.getlist('genres'),
+                                facebook_link=request.form.get('facebook_link'),
+                                seeking_description=request.form.get(
+                'seeking_description'),
+                website=request.form.get('website'),
+                seeking_venue=request.form.get('seeking_venue'))
+            if request.form.get('seeking_venue') == 'y':
+                new_artist.seeking_venue = True
+            db.session.add(new_artist)
+            db.session.flush()
+            artist_id, artist_name = new_artist.id, new_artist.name
+        autocomplete.artists.add(artist_id, artist_name)
+        cache.invalidate(('artists',))
         # on successful db insert, flash success
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
 
     except:
 
-        db.session.rollback()
         # TODO: on unsuccessful db insert, flash an error instead.# e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
         flash('An error occurred. Artist ' +
               request.form['name'] + ' could not be listed.')
 
-    finally:
-        db.session.close()
-
     return render_template('pages/home.html')
 
 
-@app.route('/artists/<artist_id>', methods=['DELETE'])
+@main.route('/artists/<artist_id>', methods=['DELETE'])
 def delete_artist(artist_id):
     # TODO: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
     error = False
     try:
-        artist = Artist.query.get(artist_id)
-        db.session.delete(artist)
-        db.session.commit()
+        with database.transaction():
+            artist = Artist.query.get(artist_id)
+            name = artist.name
+            db.session.delete(artist)
+        autocomplete.artists.remove(int(artist_id))
+        cache.invalidate(('artist', int(artist_id)), ('artists',))
 
     except:
         error = True
-        db.session.rollback()
-
-    finally:
 
-        db.session.close()
     if error:
-        flash('an error occured and Venue ' + artist.name + ' has a show')
+        flash('an error occured and Venue ' + name + ' has a show')
     if not error:
-        flash('Venue ' + artist.name + ' was deleted')
+        flash('Venue ' + name + ' was deleted')
     return render_template('pages/home.html')
 
 #  Shows
 #  ----------------------------------------------------------------
 
 
-@ app.route('/shows')
+def show_list_args():
+    # ?limit=<n> cuts the listing into pages and ?after=<start_time,id> picks
+    # up where the previous page stopped
+    after = request.args.get('after')
+    if after:
+        try:
+            after = queries.decode_cursor(after)
+        except ValueError:
+            abort(400)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        abort(400)
+    return after or None, limit
+
+
+@ main.route('/shows')
+@replicas.reads
 def shows():
-    # displays list of shows at /shows
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
-    shows = Show.query.all()
-    data = []
-    for show in shows:
-        data.append({
-            "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
-            "artist_id": show.artist_id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time":  format_datetime(str(show.start_time)),
-        })
-    return render_template('pages/shows.html', shows=data)
-
-
-@ app.route('/shows/create')
+    # displays list of shows at /shows, streamed to the client as it renders
+    after, limit = show_list_args()
+    # iter_shows fills in page['next_cursor'] once the loop in the template
+    # has consumed the page, so the template reads it after the loop
+    page = {'next_cursor': None}
+    data = queries.iter_shows(after, limit, page)
+    return Response(stream_with_context(
+        stream_template('pages/shows.html', shows=data, page=page, limit=limit)))
+
+
+@ main.route('/shows/create')
 def create_shows():
     # renders form. do not touch.
-    form = ShowForm()
+    form = forms.ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@ app.route('/shows/create', methods=['POST'])
+@ main.route('/shows/create', methods=['POST'])
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     # TODO: insert form data as a new Show record in the db, instead
     error = False
     try:
 
-        new_show = Show(artist_id=request.form.get('artist_id'), venue_id=request.form.get(
-            'venue_id'), start_time=request.form.get('start_time'))
-        # on successful db insert, flash success
+        with database.transaction():
+            new_show = Show(artist_id=request.form.get('artist_id'), venue_id=request.form.get(
+                'venue_id'), start_time=request.form.get('start_time'))
+            # on successful db insert, flash success
 
-        db.session.add(new_show)
-        db.session.commit()
+            db.session.add(new_show)
+            db.session.flush()
+            counters.record_show(new_show.id)
+        cache.invalidate(('venue', int(request.form.get('venue_id'))), ('venues',),
+                         ('artist', int(request.form.get('artist_id'))))
     except:
         error = True
-        db.session.rollback()
         # TODO: on unsuccessful db insert, flash an error instead.
 
-    finally:
-        db.session.close()
     if error:
         flash('An error occurred. Show could not be listed.')
     elif not error:
@@ -529,65 +772,79 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
-@ app.route('/shows/search', methods=['POST'])
-# def search_shows():
-#     # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-#     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-#     # search for "band" should return "The Wild Sax Band".
-#     search_term = request.form.get('search_term', '')
-#     show = Show.query.all()
-#     artist = Artist.query.all()
-#     shows = db.session.query(Show).filter(
-#         Artist.name.ilike(f'%{search_term}%')).all()
-#     data = []
-#     for show in shows:
-#         data.append({
-#             "id": show.artist_id,
-#         })
-#     response = {
-#         "count": len(shows),
-#         "data": data
-#     }
-#     return render_template('pages/search_shows.html', results=response, search_term=request.form.get('search_term', ''), artist=artist)
-# @app.route('/shows/<show_id>', methods=['DELETE'])
-# def delete_show(show_id):
-#     # TODO: Complete this endpoint for taking a venue_id, and using
-#     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-#     error = False
-#     try:
-#         show = Show.query.get(show_id)
-#         db.session.delete(show)
-#         db.session.commit()
-#     except:
-#         error = True
-#         db.session.rollback()
-#     finally:
-#         db.session.close()
-#     if error:
-#         flash('an error occured and the show was not deleted')
-#     if not error:
-#         flash('Show was deleted')
-#     return render_template('pages/home.html')
-@ app.errorhandler(404)
+@ main.route('/shows/search', methods=['GET', 'POST'])
+@replicas.reads
+def search_shows():
+    # case-insensitive partial match on the artist or venue name, with
+    # optional city, from and to (YYYY-MM-DD) filters. The search box posts
+    # the form, the "later results" links repeat it as a GET with ?after=.
+    # search for "band" should return the shows of "The Wild Sax Band".
+    search_term, city, start, end, after = show_search_args()
+    response = queries.search_shows(search_term, city, start, end, after)
+    return render_show_search(response, search_term)
+
+
+def show_search_args():
+    # (search_term, city, start, end, after) of a show search
+    search_term = request.values.get('search_term', '').strip()
+    city = request.values.get('city', '').strip()
+    try:
+        start = parse_date(request.values.get('from'))
+        end = parse_date(request.values.get('to'))
+        after = request.values.get('after')
+        after = queries.decode_cursor(after) if after else None
+    except ValueError:
+        abort(400)
+    return search_term, city, start, end, after
+
+
+def render_show_search(response, search_term):
+    # the "later results" links repeat the search with these parameters
+    params = {key: request.values.get(key) for key in ('search_term', 'city', 'from', 'to')
+              if request.values.get(key)}
+    return render_template('pages/search_shows.html', results=response,
+                           search_term=search_term, params=params)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+@main.route('/shows/<show_id>', methods=['DELETE'])
+def delete_show(show_id):
+    error = False
+    try:
+        with database.transaction():
+            show = Show.query.get(show_id)
+            venue_id, artist_id = show.venue_id, show.artist_id
+            db.session.delete(show)
+            db.session.flush()
+            counters.forget_show(venue_id, artist_id)
+        cache.invalidate(('venue', venue_id), ('venues',), ('artist', artist_id))
+    except:
+        error = True
+    if error:
+        flash('an error occured and the show was not deleted')
+    if not error:
+        flash('Show was deleted')
+    return render_template('pages/home.html')
+
+
+@ main.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@ app.errorhandler(500)
+@ main.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+@ main.app_errorhandler(exc.TimeoutError)
+def pool_timeout_error(error):
+    # no database connection came free within DB_POOL_TIMEOUT
+    return render_template('errors/500.html'), 503, {'Retry-After': '1'}
+
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -595,11 +852,11 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
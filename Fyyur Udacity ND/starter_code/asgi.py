@@ -0,0 +1,17 @@
+from wsgi import application as wsgi_application
+from async_views import AsyncApp
+
+
+#----------------------------------------------------------------------------#
+# ASGI.
+#
+# uvicorn asgi:application
+# gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+#
+# The optional async deployment: the app of wsgi.py, preloaded the same
+# way, with the async read pages of async_views.py in front of it. Every
+# worker is one process with one event loop; WEB_CONCURRENCY still sets
+# how many, GUNICORN_THREADS does not apply.
+#----------------------------------------------------------------------------#
+
+application = AsyncApp(wsgi_application)
@@ -0,0 +1,361 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import abort, current_app, render_template, request, session
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import search_match_fields, show_list_args, show_search_args, render_show_search
+from models import Venue, Artist, Show
+import cache
+import database
+import instrumentation
+import metrics
+import queries
+import replicas
+
+
+#----------------------------------------------------------------------------#
+# Async views.
+#
+# The optional ASGI mode (asgi.py). The read pages registered here with
+# @async_view run as coroutines on SQLAlchemy's asyncio engine (asyncpg),
+# and the statements of a page that do not depend on each other go out
+# concurrently, each on a connection of its own. While a request waits on
+# Postgres the event loop serves the others, so the requests in flight are
+# bounded by the async pool (ASYNC_POOL_SIZE + ASYNC_MAX_OVERFLOW) rather
+# than by the number of threads.
+#
+# Every other request, the forms and other writes, the API, the exports
+# and the unpaged /shows stream, goes to the Flask app as WSGI, run on
+# ASGI_WSGI_THREADS threads. Async views run in a Flask request context of
+# their own, so url_for, the session, the page cache, the request hooks and
+# the error handlers behave as on the WSGI side. They must not use
+# db.session: its scope is the thread, which every task of the loop shares.
+#
+# They read from the primary: replica routing (replicas.py) is WSGI-only.
+# As on the WSGI side, a client that just wrote skips the caches, which may
+# hold pages the WSGI app built from a replica before the write reached it.
+#----------------------------------------------------------------------------#
+
+# Flask endpoint -> (view, predicate or None)
+VIEWS = {}
+
+
+def async_view(endpoint, when=None):
+    # registers the async variant of a Flask endpoint; the requests for
+    # which when() is false go to the WSGI app instead
+    def register(view):
+        VIEWS[endpoint] = (view, when)
+        return view
+    return register
+
+
+def create_engine(app):
+    # the database of Flask-SQLAlchemy through asyncpg, unless
+    # ASYNC_DATABASE_URI names another
+    uri = app.config.get('ASYNC_DATABASE_URI') or make_url(
+        app.config['SQLALCHEMY_DATABASE_URI']).set(drivername='postgresql+asyncpg')
+    engine = create_async_engine(uri, **database.async_engine_options(app.config))
+    if app.config.get('SQL_INSTRUMENTATION'):
+        instrumentation.listen(engine.sync_engine)
+    if app.config.get('METRICS_ENABLED', True):
+        metrics.watch_pool(engine.sync_engine, 'async')
+    return engine
+
+
+async def rows(statement):
+    async with current_app.extensions['async_engine'].connect() as conn:
+        return (await conn.execute(statement)).all()
+
+
+async def first(statement):
+    async with current_app.extensions['async_engine'].connect() as conn:
+        return (await conn.execute(statement)).first()
+
+
+async def scalar(statement):
+    async with current_app.extensions['async_engine'].connect() as conn:
+        return (await conn.execute(statement)).scalar()
+
+
+async def cached(store, key, build):
+    # Cache.get_or_build for a coroutine build()
+    version, value = store.lookup(key)
+    if value is None:
+        value, expires_at = await build()
+        store.store(key, version, value, expires_at)
+    return value
+
+
+async def cached_page(key, render):
+    # pending flash messages would be baked into the html, and a client that
+    # just wrote must see its change, as in app.py
+    if session.get('_flashes') or replicas.pinned():
+        return (await render())[0]
+    return await cached(cache.pages, key, render)
+
+
+async def detail_view(key, load):
+    async def build():
+        data = await load()
+        if data is None:
+            abort(404)
+        return data, data['next_show_at']
+    if replicas.pinned():
+        return (await build())[0]
+    return await cached(cache.views, key, build)
+
+
+async def detail(row_select, shows_select, shows_from, owner_column, detail_from, owner_id):
+    # the row and both pages of shows at once. The counts come with the row
+    # unless they are stale, and only then cost a statement of their own.
+    now = datetime.now()
+    owner, upcoming, past = await asyncio.gather(
+        first(row_select(owner_id)),
+        rows(shows_select(owner_id, 'upcoming', now=now)),
+        rows(shows_select(owner_id, 'past', now=now)))
+    if owner is None:
+        return None
+    counts = queries.stored_counts(owner, now)
+    if counts is None:
+        counts = tuple(await first(queries.show_counts_select(owner_column, owner_id, now)))
+    return detail_from(owner, counts, shows_from(upcoming), shows_from(past))
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@async_view('main.venues')
+async def venues():
+    async def render():
+        now = datetime.now()
+        areas, next_start = await asyncio.gather(
+            rows(queries.venue_areas_select(now)), scalar(queries.next_show_start_select(now)))
+        return render_template('pages/venues.html',
+                               areas=queries.venue_areas_from(areas)), next_start
+    return await cached_page(('venues',), render)
+
+
+@async_view('main.search_venues')
+async def search_venues():
+    search_term = request.form.get('search_term', '')
+    response = await search(Venue, search_term)
+    return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                           limit=queries.SEARCH_RESULTS_LIMIT)
+
+
+@async_view('main.show_venue')
+async def show_venue(venue_id):
+    key = ('venue', venue_id)
+
+    async def render():
+        data = await detail_view(key, lambda: detail(
+            queries.venue_row_select, queries.venue_shows_select, queries.venue_shows_from,
+            Show.venue_id, queries.venue_detail_from, venue_id))
+        return render_template('pages/show_venue.html', venue=data), data['next_show_at']
+    return await cached_page(key, render)
+
+
+#  Artists
+#  ----------------------------------------------------------------
+
+@async_view('main.artists')
+async def artists():
+    async def render():
+        data = await rows(queries.artist_list_select())
+        return render_template('pages/artists.html', artists=data), None
+    return await cached_page(('artists',), render)
+
+
+@async_view('main.search_artists')
+async def search_artists():
+    search_term = request.form.get('search_term', '')
+    response = await search(Artist, search_term)
+    return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                           limit=queries.SEARCH_RESULTS_LIMIT)
+
+
+@async_view('main.show_artist')
+async def show_artist(artist_id):
+    key = ('artist', artist_id)
+
+    async def render():
+        data = await detail_view(key, lambda: detail(
+            queries.artist_row_select, queries.artist_shows_select, queries.artist_shows_from,
+            Show.artist_id, queries.artist_detail_from, artist_id))
+        return render_template('pages/show_artist.html', artist=data), data['next_show_at']
+    return await cached_page(key, render)
+
+
+async def search(model, search_term):
+    total, matches = queries.search_selects(model, search_term, search_match_fields())
+    total, matches = await asyncio.gather(scalar(total), rows(matches))
+    return queries.search_from(total, matches)
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+# the whole listing is streamed from a server-side cursor by the WSGI app;
+# pages of it are served here
+@async_view('main.shows', when=lambda: request.args.get('limit', type=int) is not None)
+async def shows():
+    after, limit = show_list_args()
+    data, next_cursor = queries.show_page_from(
+        await rows(queries.show_list_select(after, limit)), limit)
+    return render_template('pages/shows.html', shows=data, page={'next_cursor': next_cursor},
+                           limit=limit)
+
+
+@async_view('main.search_shows')
+async def search_shows():
+    search_term, city, start, end, after = show_search_args()
+    total, page = queries.search_shows_selects(search_term, city, start, end, after)
+    total, page = await asyncio.gather(scalar(total), rows(page))
+    return render_show_search(queries.search_shows_from(total, page), search_term)
+
+
+#----------------------------------------------------------------------------#
+# ASGI.
+#----------------------------------------------------------------------------#
+
+
+class AsyncApp(object):
+    """ASGI application: the async views, and the Flask app for the rest."""
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = app.extensions['async_engine'] = create_engine(app)
+        self.threads = ThreadPoolExecutor(app.config.get('ASGI_WSGI_THREADS', 4),
+                                          thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        environ = build_environ(scope, await read_body(receive))
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        view, when = VIEWS.get(endpoint, (None, None))
+        if view is None:
+            return await self.call_wsgi(environ, send)
+
+        ctx = self.app.request_context(environ)
+        ctx.push()
+        if when is not None and not when():
+            ctx.pop()
+            return await self.call_wsgi(environ, send)
+        error = None
+        try:
+            # Flask.full_dispatch_request, with the view awaited
+            try:
+                self.app.try_trigger_before_first_request_functions()
+                rv = self.app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = self.app.handle_user_exception(e)
+            response = self.app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            response = self.app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+        await send({'type': 'http.response.start', 'status': response.status_code,
+                    'headers': encode_headers(response.headers.to_wsgi_list())})
+        await send({'type': 'http.response.body',
+                    'body': b'' if scope['method'] == 'HEAD' else response.get_data()})
+
+    async def call_wsgi(self, environ, send):
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+        await loop.run_in_executor(self.threads, run_wsgi, self.app, environ,
+                                   send_from_thread)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                self.threads.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(body)
+
+
+def build_environ(scope, body):
+    # the WSGI environ of an ASGI http request
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('',))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers]
+
+
+def run_wsgi(app, environ, send):
+    # runs on a thread of the pool: calls the WSGI app and sends its
+    # response chunk by chunk, so streamed responses stay streamed
+    start = {}
+
+    def start_response(status, headers, exc_info=None):
+        start.update(type='http.response.start', status=int(status.split(' ', 1)[0]),
+                     headers=encode_headers(headers))
+    body = app(environ, start_response)
+    try:
+        send(start)
+        for chunk in body:
+            if chunk:
+                send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    send({'type': 'http.response.body'})
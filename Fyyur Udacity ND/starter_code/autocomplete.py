@@ -0,0 +1,218 @@
+import sys
+import threading
+from bisect import bisect_left, insort
+
+from models import db, Venue, Artist
+import cache
+
+
+#----------------------------------------------------------------------------#
+# Autocomplete.
+#
+# In-process name indexes behind /api/autocomplete. Each index is loaded from
+# the database once, the first time it is used, and is then kept up to date
+# by the create/edit/delete controllers, so lookups never touch the database.
+#
+# A write handled by another worker (or by `flask import`) reaches this one
+# through the cache: every change bumps the version of the index's key,
+# ('autocomplete', 'venue') or ('autocomplete', 'artist'), and a lookup that
+# finds the version moved since the index was loaded reloads it. The worker
+# that made the change has applied it already and keeps its index, unless
+# another wrote in between.
+#----------------------------------------------------------------------------#
+
+NGRAM = 3
+
+# most word-prefix entries a single lookup walks through
+SCAN_LIMIT = 500
+
+
+def normalize(name):
+    return ' '.join((name or '').lower().split())
+
+
+def ngrams(text):
+    return set(text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1))
+
+
+class NameIndex(object):
+
+    def __init__(self, model, name):
+        self.model = model
+        self.version_key = ('autocomplete', name)
+        self.version = None  # of version_key when the index was loaded
+        self.names = {}      # id -> name as stored
+        self.texts = {}      # id -> normalized name
+        self.sorted = []     # sorted (normalized name, id)
+        self.prefixes = []   # sorted (word, id) for every word of every name
+        self.grams = {}      # trigram -> set of ids whose name contains it
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        # the version is read first: a change committed during the load
+        # bumps it past the one recorded, and the next lookup reloads
+        version = cache.version(self.version_key)
+        self.load_rows(db.session.query(self.model.id, self.model.name).yield_per(1000))
+        self.version = version
+
+    def stale(self):
+        # whether another worker changed a name since the load; while the
+        # cache cannot tell, the index is kept
+        version = cache.version(self.version_key)
+        return version is not None and version != self.version
+
+    def changed(self):
+        # tells the other workers of a change applied to this index
+        versions = cache.invalidate(self.version_key)
+        with self.lock:
+            if versions and self.version is not None and versions[0] == self.version + 1:
+                self.version = versions[0]
+
+    def load_rows(self, rows):
+        # rows: iterable of (id, name)
+        with self.lock:
+            self.names = {}
+            self.texts = {}
+            self.sorted = []
+            self.prefixes = []
+            self.grams = {}
+            for entity_id, name in rows:
+                self._add(entity_id, name, append=True)
+            self.sorted.sort()
+            self.prefixes.sort()
+            self.loaded = True
+
+    def _add(self, entity_id, name, append=False):
+        # append=True defers sorting to the caller (bulk load)
+        text = normalize(name)
+        self.names[entity_id] = name
+        self.texts[entity_id] = text
+        entries = [(self.sorted, (text, entity_id))]
+        entries.extend((self.prefixes, (word, entity_id)) for word in set(text.split()))
+        for entries_list, entry in entries:
+            if append:
+                entries_list.append(entry)
+            else:
+                insort(entries_list, entry)
+        for gram in ngrams(text):
+            self.grams.setdefault(gram, set()).add(entity_id)
+
+    def _remove(self, entity_id):
+        self.names.pop(entity_id, None)
+        text = self.texts.pop(entity_id, None)
+        if text is None:
+            return
+        entries = [(self.sorted, (text, entity_id))]
+        entries.extend((self.prefixes, (word, entity_id)) for word in set(text.split()))
+        for entries_list, entry in entries:
+            i = bisect_left(entries_list, entry)
+            if i < len(entries_list) and entries_list[i] == entry:
+                del entries_list[i]
+        for gram in ngrams(text):
+            ids = self.grams.get(gram)
+            if ids is not None:
+                ids.discard(entity_id)
+                if not ids:
+                    del self.grams[gram]
+
+    # the write side is a no-op until the index is loaded: the load reads
+    # the committed rows, changes included
+
+    def add(self, entity_id, name):
+        with self.lock:
+            if self.loaded:
+                self._remove(entity_id)
+                self._add(entity_id, name)
+        self.changed()
+
+    update = add
+
+    def remove(self, entity_id):
+        with self.lock:
+            if self.loaded:
+                self._remove(entity_id)
+        self.changed()
+
+    def search(self, query, limit=10):
+        # names starting with the query come first, then names with a word
+        # starting with it, then names containing it anywhere. Every stage
+        # stops as soon as it has enough results.
+        if not self.loaded or self.stale():
+            self.load()
+        query = normalize(query)
+        if not query:
+            return []
+        with self.lock:
+            found = []
+            seen = set()
+
+            def collect(entity_id):
+                if entity_id not in seen:
+                    seen.add(entity_id)
+                    found.append(entity_id)
+                return len(found) >= limit
+
+            i = bisect_left(self.sorted, (query,))
+            while i < len(self.sorted) and self.sorted[i][0].startswith(query):
+                if collect(self.sorted[i][1]):
+                    break
+                i += 1
+
+            # for a multi-word query most words starting with its first word
+            # do not match, so this stage only looks at the first SCAN_LIMIT;
+            # the trigram stage below still finds the rest
+            first_word = query.split()[0]
+            start = bisect_left(self.prefixes, (first_word,))
+            end = min(len(self.prefixes), start + SCAN_LIMIT)
+            for i in range(start, end):
+                word, entity_id = self.prefixes[i]
+                if len(found) >= limit or not word.startswith(first_word):
+                    break
+                if (' ' + query) in (' ' + self.texts[entity_id]):
+                    collect(entity_id)
+
+            if len(found) < limit and len(query) >= NGRAM:
+                # every match contains each trigram of the query, so the
+                # rarest one gives the smallest set of ids to check
+                rarest = min(ngrams(query), key=lambda g: len(self.grams.get(g, ())))
+                for entity_id in self.grams.get(rarest, ()):
+                    if query in self.texts[entity_id] and collect(entity_id):
+                        break
+
+            return [{"id": entity_id, "name": self.names[entity_id]} for entity_id in found]
+
+    def memory_bytes(self):
+        # approximate: containers plus the keys and values they hold
+        with self.lock:
+            size = sum(sys.getsizeof(container) for container in (
+                self.names, self.texts, self.sorted, self.prefixes, self.grams))
+            for entity_id, name in self.names.items():
+                size += sys.getsizeof(entity_id) + sys.getsizeof(name)
+            for text in self.texts.values():
+                size += sys.getsizeof(text)
+            for entry in self.sorted:
+                size += sys.getsizeof(entry)
+            for entry in self.prefixes:
+                size += sys.getsizeof(entry) + sys.getsizeof(entry[0])
+            for gram, ids in self.grams.items():
+                size += sys.getsizeof(gram) + sys.getsizeof(ids)
+            return size
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "entries": len(self.names),
+            "words": len(self.prefixes),
+            "ngrams": len(self.grams),
+            "memory_bytes": self.memory_bytes()
+        }
+
+
+venues = NameIndex(Venue, 'venue')
+artists = NameIndex(Artist, 'artist')
+
+INDEXES = {
+    'venue': venues,
+    'artist': artists,
+}
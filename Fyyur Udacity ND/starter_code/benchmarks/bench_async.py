@@ -0,0 +1,179 @@
+"""Compare how the WSGI and the ASGI deployments scale with concurrency.
+
+For each mode of ``--modes`` and each number of clients of ``--clients``,
+starts the app under gunicorn, ``--workers`` processes of either kind, and
+runs load_test.py against it for ``--duration`` seconds with the read-only
+``--mix``, whose pages all have an async variant. It then prints the
+throughput, latency and errors of every run side by side.
+
+A WSGI worker handles at most ``--threads`` requests at once, an ASGI
+worker as many as its async pool has connections for. The difference
+shows once requests spend their time waiting on the database:
+``--db-latency-ms`` puts a proxy in front of Postgres that delays each of
+its replies by that much, the way a database on another host does. The
+page cache is off unless ``--cache`` is given, so every request reaches
+the database.
+
+    python benchmarks/bench_async.py --clients 4,16,64 --db-latency-ms 5
+    python benchmarks/bench_async.py --modes asgi --clients 64 -o asgi.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+from sqlalchemy.engine import make_url
+
+from support import APP_DIR, commit
+
+import config
+
+MODES = {
+    'wsgi': '{python} -m gunicorn -c gunicorn.conf.py --bind 127.0.0.1:{{port}} '
+            '--workers {workers} --threads {threads} wsgi:application',
+    'asgi': '{python} -m gunicorn -c gunicorn.conf.py --bind 127.0.0.1:{{port}} '
+            '--workers {workers} -k uvicorn.workers.UvicornWorker asgi:application',
+}
+
+DEFAULT_MIX = 'venue=35,artist=35,shows=15,search=15'
+
+
+class LatencyProxy(threading.Thread):
+    """TCP proxy to Postgres that holds back every reply for ``delay`` seconds."""
+
+    def __init__(self, target, delay):
+        # target: path of a unix socket, or (host, port)
+        threading.Thread.__init__(self, daemon=True)
+        self.target = target
+        self.delay = delay
+        self.port = None
+        self.ready = threading.Event()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        server = await asyncio.start_server(self.connect, '127.0.0.1', 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def connect(self, client_reader, client_writer):
+        if isinstance(self.target, str):
+            reader, writer = await asyncio.open_unix_connection(self.target)
+        else:
+            reader, writer = await asyncio.open_connection(*self.target)
+        await asyncio.gather(self.pipe(client_reader, writer, 0),
+                             self.pipe(reader, client_writer, self.delay))
+
+    async def pipe(self, reader, writer, delay):
+        # replies are written ``delay`` after they arrive, in order, without
+        # holding up the ones behind them
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                loop.call_later(delay, writer.write, data)
+        except ConnectionError:
+            pass
+        finally:
+            loop.call_later(delay, writer.close)
+
+
+def proxied_url(url, delay):
+    # starts a LatencyProxy to the database of ``url``; returns the URL
+    # that goes through it
+    url = make_url(url)
+    socket_dir = url.query.get('host')
+    if socket_dir:
+        target = os.path.join(socket_dir, '.s.PGSQL.%d' % (url.port or 5432))
+    else:
+        target = (url.host or 'localhost', url.port or 5432)
+    proxy = LatencyProxy(target, delay)
+    proxy.start()
+    proxy.ready.wait()
+    url = url.set(host='127.0.0.1', port=proxy.port,
+                  query={key: value for key, value in url.query.items() if key != 'host'})
+    return url.render_as_string(hide_password=False)
+
+
+def run(mode, clients, args, env):
+    # one load_test.py run; returns its statistics over all endpoints
+    server = MODES[mode].format(python=sys.executable, workers=args.workers,
+                                threads=args.threads)
+    with tempfile.NamedTemporaryFile(suffix='.json') as output:
+        subprocess.call([sys.executable, '-W', 'ignore', 'benchmarks/load_test.py',
+                         '--server', server, '--port', str(args.port),
+                         '--clients', str(clients), '--duration', str(args.duration),
+                         '--warmup', str(args.warmup), '--mix', args.mix,
+                         '--interval', str(args.duration), '--output', output.name],
+                        cwd=APP_DIR, env=env,
+                        stderr=None if args.verbose else subprocess.DEVNULL)
+        with open(output.name) as f:
+            text = f.read()
+    if not text:
+        raise SystemExit('load_test.py failed for %s with %d clients' % (mode, clients))
+    return json.loads(text)['endpoints'].get('all', {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--clients', default='1,4,16,64',
+                        help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4, help='per WSGI worker')
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--db-latency-ms', type=float, default=0)
+    parser.add_argument('--cache', action='store_true', help='leave the page cache on')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='show the report of every load_test.py run')
+    parser.add_argument('--output', '-o', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not args.cache:
+        env['PAGE_CACHE_SIZE'] = '0'
+    if args.db_latency_ms:
+        env['DATABASE_URL'] = proxied_url(config.SQLALCHEMY_DATABASE_URI,
+                                          args.db_latency_ms / 1000.0)
+
+    results = {
+        'commit': commit(),
+        'created': datetime.now().isoformat(),
+        'workers': args.workers,
+        'threads': args.threads,
+        'db_latency_ms': args.db_latency_ms,
+        'cache': args.cache,
+        'mix': args.mix,
+        'runs': [],
+    }
+    print('%-5s %8s %9s %9s %9s %7s' % ('mode', 'clients', 'req/s', 'p50 ms', 'p99 ms',
+                                         'errors'))
+    for clients in [int(count) for count in args.clients.split(',')]:
+        for mode in args.modes.split(','):
+            stats = run(mode, clients, args, env)
+            results['runs'].append(dict(stats, mode=mode, clients=clients))
+            print('%-5s %8d %9.1f %9.1f %9.1f %7d' % (
+                mode, clients, stats.get('per_second', 0), stats.get('p50_ms', 0),
+                stats.get('p99_ms', 0), stats.get('errors', 0)))
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
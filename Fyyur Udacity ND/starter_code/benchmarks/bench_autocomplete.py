@@ -0,0 +1,83 @@
+"""Benchmark the in-process autocomplete index.
+
+Loads an ``autocomplete.NameIndex`` with generated names, then reports the
+build time, lookup latency percentiles for a mix of one to six character
+queries, the latency of incremental updates and the memory the index holds
+(both its own estimate and what tracemalloc saw while building it). No
+database is needed.
+
+    python benchmarks/bench_autocomplete.py --names 100000 --lookups 20000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+import support  # noqa: F401
+import autocomplete
+
+WORDS = ['the', 'blue', 'echo', 'lounge', 'musical', 'hop', 'park', 'square',
+         'live', 'music', 'coffee', 'dueling', 'pianos', 'bar', 'velvet',
+         'garage', 'cellar', 'neon', 'wild', 'sax', 'band', 'guns', 'petals',
+         'matt', 'quevado', 'harbor', 'theatre', 'union', 'pier', 'vault']
+
+
+def name(rng, i):
+    return ' '.join(rng.choice(WORDS).capitalize()
+                    for _ in range(rng.randint(2, 4))) + ' %d' % i
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--names', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--updates', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rows = [(i, name(rng, i)) for i in range(1, args.names + 1)]
+    index = autocomplete.NameIndex(model=None)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index.load_rows(rows)
+    build = time.perf_counter() - start
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queries = []
+    for _ in range(args.lookups):
+        text = autocomplete.normalize(rng.choice(rows)[1])
+        start_at = rng.randrange(len(text))
+        queries.append(text[start_at:start_at + rng.randint(1, 6)])
+    lookups = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        lookups.append(time.perf_counter() - start)
+
+    updates = []
+    for i in range(args.updates):
+        entity_id = rng.randint(1, args.names)
+        start = time.perf_counter()
+        index.update(entity_id, name(rng, entity_id))
+        updates.append(time.perf_counter() - start)
+
+    stats = index.stats()
+    print('names            %d' % stats['entries'])
+    print('build            %.0f ms' % (build * 1000))
+    for pct in (50, 95, 99):
+        print('lookup p%-2d       %.3f ms' % (pct, percentile(lookups, pct) * 1000))
+    print('lookup max       %.3f ms' % (max(lookups) * 1000))
+    print('update p99       %.3f ms' % (percentile(updates, 99) * 1000))
+    print('memory estimate  %.1f MB' % (stats['memory_bytes'] / 1e6))
+    print('memory traced    %.1f MB' % (traced / 1e6))
+
+
+if __name__ == '__main__':
+    main()
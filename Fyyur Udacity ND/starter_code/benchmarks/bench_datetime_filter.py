@@ -0,0 +1,79 @@
+"""Microbenchmark for the ``datetime`` template filter.
+
+Formats the same set of show times with the old filter (str() of the
+datetime, dateutil re-parse, babel pattern parse on every call) and with
+``filters.format_datetime``, with and without its memoization. No database
+is needed.
+
+    python benchmarks/bench_datetime_filter.py --rows 10000 --distinct 500
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+import support  # noqa: F401
+import filters
+
+
+def legacy_format_datetime(value, format='medium'):
+    # the filter app.py used before filters.py existed
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en_US')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='number of show times formatted per run')
+    parser.add_argument('--distinct', type=int, default=500,
+                        help='number of distinct show times among the rows')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    start = datetime(2021, 1, 1, 20, 0)
+    slots = [start + timedelta(hours=random.randint(0, 24 * 365))
+             for _ in range(args.distinct)]
+    values = [random.choice(slots) for _ in range(args.rows)]
+
+    for fmt in ('full', 'medium', 'short', 'long', 'yyyy-MM-dd HH:mm'):
+        expected = [legacy_format_datetime(str(v), fmt) for v in values[:100]]
+        actual = [filters.format_datetime(v, fmt) for v in values[:100]]
+        assert expected == actual, 'outputs differ for the %r format' % fmt
+
+    def legacy():
+        for value in values:
+            legacy_format_datetime(str(value), 'full')
+
+    def compiled():
+        filters.configure_datetime_cache(0)
+        for value in values:
+            filters.format_datetime(value, 'full')
+
+    def memoized():
+        filters.configure_datetime_cache(4096)
+        for value in values:
+            filters.format_datetime(value, 'full')
+
+    def from_string():
+        filters.configure_datetime_cache(4096)
+        for value in values:
+            filters.format_datetime(str(value), 'full')
+
+    print('%-12s %12s %12s' % ('filter', 'total ms', 'us/row'))
+    for name, func in [('legacy', legacy), ('compiled', compiled),
+                       ('memoized', memoized), ('from string', from_string)]:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('%-12s %12.1f %12.2f' % (name, best * 1000, best * 1e6 / args.rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark the bulk import in rows per second.
+
+Writes ``--rows`` generated venues, artists and shows to CSV and NDJSON
+files in a temporary directory (one row in every hundred invalid), imports
+them with ``importer.import_file`` using COPY and multi-row INSERT, and
+prints rows per second and the peak memory of each run. The imported rows
+are deleted again afterwards.
+
+    python benchmarks/bench_import.py --rows 100000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import support  # noqa: F401
+
+from app import create_app
+from models import db, Venue, Artist, Show
+import importer
+
+# a bulk script: no statement timeout
+app = create_app({'COMMAND_LINE': True})
+
+MARKER = 'Import Bench'
+STATES = ['CA', 'NY', 'TX', 'IL', 'WA']
+GENRES = ['Jazz', 'Blues', 'Folk', 'Rock n Roll', 'Soul']
+
+
+def venue_row(i):
+    return {
+        'name': '%s Venue %d' % (MARKER, i), 'city': 'Springfield',
+        'state': random.choice(STATES) if i % 100 else 'XX',
+        'address': '%d Main St' % i, 'phone': '555-555-%04d' % (i % 10000),
+        'image_link': '', 'genres': random.sample(GENRES, 2),
+        'facebook_link': 'https://www.facebook.com/venue%d' % i,
+        'website': 'https://venue%d.example.com' % i,
+        'seeking_talent': i % 2 == 0, 'seeking_description': 'Looking for\tbands',
+    }
+
+
+def artist_row(i):
+    return {
+        'name': '%s Artist %d' % (MARKER, i) if i % 100 else '', 'city': 'Springfield',
+        'state': random.choice(STATES), 'phone': '555-555-%04d' % (i % 10000),
+        'image_link': '', 'genres': random.sample(GENRES, 1),
+        'facebook_link': 'https://www.facebook.com/artist%d' % i,
+        'website': 'https://artist%d.example.com' % i,
+        'seeking_venue': i % 3 == 0, 'seeking_description': '',
+    }
+
+
+def show_row(i, venue_ids, artist_ids, now):
+    start = now + timedelta(hours=random.randint(-5000, 5000))
+    return {
+        'venue_id': random.choice(venue_ids) if i % 100 else 0,
+        'artist_id': random.choice(artist_ids),
+        'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def write_file(path, rows, format):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = None
+        for row in rows:
+            if format == 'ndjson':
+                f.write(json.dumps(row) + '\n')
+                continue
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(dict((key, ','.join(value) if isinstance(value, list)
+                                  else ('y' if value else '') if isinstance(value, bool)
+                                  else value) for key, value in row.items()))
+
+
+def run(entity, path, method, batch_size):
+    with open(os.devnull, 'w') as rejects:
+        start = time.perf_counter()
+        imported, rejected = importer.import_file(
+            entity, path, rejects=rejects, batch_size=batch_size, method=method)
+        elapsed = time.perf_counter() - start
+    print('%-8s %-7s %-7s %8d ok %6d rejected %8.0f rows/s  peak rss %d MB' % (
+        entity, os.path.splitext(path)[1][1:], method, imported, rejected,
+        (imported + rejected) / elapsed,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+
+
+def cleanup():
+    venue_ids = db.session.query(Venue.id).filter(Venue.name.like(MARKER + '%'))
+    artist_ids = db.session.query(Artist.id).filter(Artist.name.like(MARKER + '%'))
+    Show.query.filter(Show.venue_id.in_(venue_ids.subquery())).delete(synchronize_session=False)
+    Show.query.filter(Show.artist_id.in_(artist_ids.subquery())).delete(synchronize_session=False)
+    Venue.query.filter(Venue.name.like(MARKER + '%')).delete(synchronize_session=False)
+    Artist.query.filter(Artist.name.like(MARKER + '%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+    args = parser.parse_args()
+
+    now = datetime.now()
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        try:
+            for method in ('copy', 'insert'):
+                for format in ('csv', 'ndjson'):
+                    for entity, make_row in (('venues', venue_row), ('artists', artist_row)):
+                        path = os.path.join(directory, '%s.%s' % (entity, format))
+                        write_file(path, (make_row(i) for i in range(args.rows)), format)
+                        run(entity, path, method, args.batch_size)
+                    venue_ids = [row[0] for row in db.session.query(Venue.id).filter(
+                        Venue.name.like(MARKER + '%'))]
+                    artist_ids = [row[0] for row in db.session.query(Artist.id).filter(
+                        Artist.name.like(MARKER + '%'))]
+                    path = os.path.join(directory, 'shows.%s' % format)
+                    write_file(path, (show_row(i, venue_ids, artist_ids, now)
+                                      for i in range(args.rows)), format)
+                    run('shows', path, method, args.batch_size)
+                    cleanup()
+        finally:
+            db.session.rollback()
+            cleanup()
+
+
+if __name__ == '__main__':
+    main()
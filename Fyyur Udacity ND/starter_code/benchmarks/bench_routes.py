@@ -0,0 +1,195 @@
+"""Benchmark every read route of app.py and record the results as JSON.
+
+Requests each route ``--requests`` times through the Flask test client
+after ``--warmup`` unmeasured requests and records its latency (min, median,
+95th percentile, mean), the number of statements it sends and the peak
+memory Python allocates while handling it, measured in one extra request
+under tracemalloc so that tracing does not slow the timed ones. Detail
+routes use the venue and artist with the most shows. The page cache is off
+unless ``--cache`` is given, so the numbers are those of the database path.
+
+The results go to ``--output`` together with the commit and the size of the
+database. With ``--compare`` they are checked against an earlier results
+file, and the script exits with status 1 when a route got slower or used
+more memory by more than ``--threshold``, or sends more statements.
+
+    python benchmarks/generate_data.py --reset
+    python benchmarks/bench_routes.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_routes.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import func
+
+from support import StatementCounter, commit
+from check_query_plans import busiest
+
+from app import create_app
+from models import db, Venue, Artist, Show
+import cache
+
+app = create_app()
+
+# (method, url, form data)
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/venues', None),
+    ('GET', '/venues/%(venue_id)d', None),
+    ('GET', '/venues/%(venue_id)d/shows?when=past', None),
+    ('GET', '/venues/%(venue_id)d/shows?when=upcoming', None),
+    ('GET', '/venues/%(venue_id)d/edit', None),
+    ('GET', '/venues/create', None),
+    ('POST', '/venues/search', {'search_term': 'hall'}),
+    ('GET', '/artists', None),
+    ('GET', '/artists/%(artist_id)d', None),
+    ('GET', '/artists/%(artist_id)d/shows?when=past', None),
+    ('GET', '/artists/%(artist_id)d/edit', None),
+    ('GET', '/artists/create', None),
+    ('POST', '/artists/search', {'search_term': 'band'}),
+    ('GET', '/shows?limit=50', None),
+    ('GET', '/shows/create', None),
+    ('POST', '/shows/search', {'search_term': 'band', 'from': '2020-01-01'}),
+    ('GET', '/api/autocomplete?type=venue&q=mu', None),
+    ('GET', '/api/v1/venues?after=%(venue_id)d', None),
+    ('GET', '/api/v1/venues/%(venue_id)d', None),
+    ('GET', '/api/v1/artists/%(artist_id)d', None),
+    ('GET', '/api/v1/shows?limit=50', None),
+    ('GET', '/export/shows.ndjson?since=%(recent_show_id)d', None),
+    ('GET', '/cache/stats', None),
+    ('GET', '/metrics', None),
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def request(client, method, url, form):
+    response = client.open(url, method=method, data=form)
+    response.get_data()
+    db.session.remove()
+    return response
+
+
+def measure(client, method, url, form, requests, warmup):
+    for _ in range(warmup):
+        request(client, method, url, form)
+    timings = []
+    counter = StatementCounter(db.engine)
+    for _ in range(requests):
+        with counter:
+            start = time.perf_counter()
+            response = request(client, method, url, form)
+            timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    try:
+        request(client, method, url, form)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'url': url,
+        'status': response.status_code,
+        'statements': counter.count,
+        'min_ms': round(min(timings), 3),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'peak_kb': round(peak / 1024.0, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    # prints a line per route to stderr; returns the number of regressions
+    regressions = 0
+    for route, now in sorted(results['routes'].items()):
+        then = baseline['routes'].get(route)
+        if then is None:
+            print('new  %-50s' % route, file=sys.stderr)
+            continue
+        problems = []
+        if now['p50_ms'] > then['p50_ms'] * (1 + threshold):
+            problems.append('p50 %.1f -> %.1f ms' % (then['p50_ms'], now['p50_ms']))
+        if now['peak_kb'] > then['peak_kb'] * (1 + threshold):
+            problems.append('peak %.0f -> %.0f KB' % (then['peak_kb'], now['peak_kb']))
+        if now['statements'] > then['statements']:
+            problems.append('statements %d -> %d' % (then['statements'], now['statements']))
+        regressions += bool(problems)
+        print('%-4s %-50s p50 %+6.1f%%  peak %+6.1f%%  statements %+d  %s' % (
+            'SLOW' if problems else 'ok', route,
+            _change(then['p50_ms'], now['p50_ms']), _change(then['peak_kb'], now['peak_kb']),
+            now['statements'] - then['statements'], '; '.join(problems)), file=sys.stderr)
+    return regressions
+
+
+def _change(old, new):
+    return (new - old) * 100.0 / old if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--cache', action='store_true',
+                        help='leave the page cache on')
+    parser.add_argument('--output', '-o', default='-',
+                        help='where to write the results; defaults to stdout')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results of an earlier run to check these against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown or memory growth that counts as a regression')
+    args = parser.parse_args()
+
+    if not args.cache:
+        cache.configure(0, 0)
+    results = {
+        'commit': commit(),
+        'created': datetime.now().isoformat(),
+        'requests': args.requests,
+        'cache': args.cache,
+        'routes': {},
+    }
+    with app.app_context():
+        results['rows'] = dict(
+            (model.__tablename__, db.session.query(func.count(model.id)).scalar())
+            for model in (Venue, Artist, Show))
+        ids = {'venue_id': busiest(Show.venue_id) or 1,
+               'artist_id': busiest(Show.artist_id) or 1,
+               'recent_show_id': max(0, (db.session.query(func.max(Show.id)).scalar()
+                                         or 0) - 1000)}
+        db.session.remove()
+
+        client = app.test_client()
+        for method, pattern, form in ROUTES:
+            route = '%s %s' % (method, pattern)
+            result = results['routes'][route] = measure(
+                client, method, pattern % ids, form, args.requests, args.warmup)
+            print('%-50s status=%d statements=%-3d p50=%8.1f ms  p95=%8.1f ms  '
+                  'peak=%8.0f KB' % (route, result['status'], result['statements'],
+                                     result['p50_ms'], result['p95_ms'],
+                                     result['peak_kb']), file=sys.stderr)
+
+    text = json.dumps(results, indent=2, sort_keys=True) + '\n'
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('compared with %s' % (baseline.get('commit') or args.compare), file=sys.stderr)
+        return 1 if compare(results, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Benchmark the venue and artist name search on a large synthetic table.
+
+Inserts ``--rows`` venues and artists (a million by default) with generated
+names, runs the statements behind ``queries.search_venues`` and
+``queries.search_artists`` through EXPLAIN ANALYZE and prints the scans each
+plan uses and how long it took, once as planned and once with index scans
+disabled. That shows the pg_trgm indexes replacing sequential scans.
+Everything is rolled back at the end.
+
+    python benchmarks/bench_search.py --rows 1000000 --terms lounge "blue ech" 48213
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from support import StatementCounter, explain, scans
+
+from app import create_app
+from models import db
+import queries
+
+app = create_app()
+
+WORDS = ['Blue', 'Echo', 'Lounge', 'Hall', 'Velvet', 'Room', 'Garage',
+         'Cellar', 'Neon', 'Cafe', 'Jazz', 'Club', 'Union', 'Pier', 'Sound',
+         'Stage', 'Attic', 'Vault', 'Harbor', 'Theatre']
+
+SEED_SQL = '''
+INSERT INTO "%(table)s" (name, city, state, genres, %(flag)s)
+SELECT w[1 + (random() * 19)::int] || ' ' || w[1 + (random() * 19)::int]
+       || ' ' || g,
+       'Springfield', 'IL', ARRAY['Jazz'], false
+FROM generate_series(1, :rows) AS g,
+     (SELECT ARRAY[%(words)s] AS w) AS words
+'''
+
+
+def seed(rows):
+    words = ', '.join("'%s'" % word for word in WORDS)
+    for table, flag in (('Venue', 'seeking_talent'), ('Artist', 'seeking_venue')):
+        db.session.execute(text(SEED_SQL % {
+            'table': table, 'flag': flag, 'words': words}), {'rows': rows})
+        db.session.execute(text('ANALYZE "%s"' % table))
+
+
+def explain_search(search, term, use_indexes):
+    enabled = 'on' if use_indexes else 'off'
+    for setting in ('enable_indexscan', 'enable_bitmapscan'):
+        db.session.execute(text('SET LOCAL %s = %s' % (setting, enabled)))
+    counter = StatementCounter(db.engine)
+    with counter:
+        search(term)
+    results = []
+    for statement, parameters in counter.statements:
+        plan = explain(db.session, statement, parameters)
+        results.append((scans(plan), plan['Execution Time']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--terms', nargs='+',
+                        default=['lounge', 'blue ech', '48213'])
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            start = time.perf_counter()
+            seed(args.rows)
+            print('seeded %d venues and artists in %.1fs' % (
+                args.rows, time.perf_counter() - start))
+            for name, search in (('venue', queries.search_venues),
+                                 ('artist', queries.search_artists)):
+                for term in args.terms:
+                    for use_indexes in (True, False):
+                        for found, elapsed in explain_search(search, term, use_indexes):
+                            print('%-7s %-10r %-10s %10.1f ms  %s' % (
+                                name, term,
+                                'indexes' if use_indexes else 'no-index',
+                                elapsed,
+                                ', '.join('%s on %s' % scan for scan in found)))
+        finally:
+            db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
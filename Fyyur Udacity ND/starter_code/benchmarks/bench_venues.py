@@ -0,0 +1,121 @@
+"""Benchmark the /venues area listing.
+
+Compares the old per-venue implementation of ``venues()`` with
+``queries.venue_areas`` for a growing number of venues and prints the number
+of statements and the wall time of each. Rows are inserted inside a
+transaction that is rolled back at the end, so the configured database is
+left untouched.
+
+    python benchmarks/bench_venues.py --sizes 100 1000 10000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from support import StatementCounter
+
+from app import create_app
+from models import db, Venue, Artist, Show
+import queries
+
+app = create_app()
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'),
+          ('Seattle', 'WA'), ('Chicago', 'IL'), ('Boston', 'MA')]
+
+
+def legacy_venue_areas():
+    # the implementation of venues() this benchmark is measured against
+    venues = Venue.query.all()
+    data = []
+    places = set()
+    for venue in venues:
+        places.add((venue.city, venue.state))
+    for place in places:
+        data.append({"city": place[0], "state": place[1], "venues": []})
+    for venue in venues:
+        num_upcoming_shows = 0
+        shows = Show.query.filter_by(venue_id=venue.id).all()
+        cur_date = datetime.now()
+        for show in shows:
+            if show.start_time >= cur_date:
+                num_upcoming_shows += 1
+        for place in data:
+            if venue.state == place['state'] and venue.city == place['city']:
+                place['venues'].append({
+                    'id': venue.id,
+                    'name': venue.name,
+                    "num_upcoming_shows": num_upcoming_shows
+                })
+    return data
+
+
+def seed(num_venues, shows_per_venue):
+    venue_rows = []
+    for i in range(num_venues):
+        city, state = random.choice(CITIES)
+        venue_rows.append({
+            'name': 'Bench Venue %d' % i, 'city': city, 'state': state,
+            'genres': ['Jazz'], 'seeking_talent': False,
+        })
+    db.session.execute(Venue.__table__.insert(), venue_rows)
+    venue_ids = [row[0] for row in db.session.query(Venue.id).filter(
+        Venue.name.like('Bench Venue %'))]
+
+    artist_id = db.session.execute(
+        Artist.__table__.insert().values(
+            name='Bench Artist', seeking_venue=False
+        ).returning(Artist.id)).scalar()
+    now = datetime.now()
+    show_rows = []
+    for venue_id in venue_ids:
+        for _ in range(shows_per_venue):
+            show_rows.append({
+                'venue_id': venue_id, 'artist_id': artist_id,
+                'start_time': now + timedelta(days=random.randint(-365, 365)),
+            })
+    if show_rows:
+        db.session.execute(Show.__table__.insert(), show_rows)
+
+
+def measure(func, counter, repeat):
+    best = None
+    for _ in range(repeat):
+        with counter:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return counter.count, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--shows-per-venue', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy-above', type=int, default=20000,
+                        help='do not run the old implementation above this size')
+    args = parser.parse_args()
+    random.seed(0)
+
+    print('%8s  %-8s %10s %12s' % ('venues', 'impl', 'queries', 'ms'))
+    with app.app_context():
+        counter = StatementCounter(db.engine)
+        for size in args.sizes:
+            try:
+                seed(size, args.shows_per_venue)
+                implementations = [('grouped', queries.venue_areas)]
+                if size <= args.skip_legacy_above:
+                    implementations.insert(0, ('legacy', legacy_venue_areas))
+                for name, func in implementations:
+                    count, best = measure(func, counter, args.repeat)
+                    print('%8d  %-8s %10d %12.1f' % (size, name, count, best * 1000))
+            finally:
+                db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
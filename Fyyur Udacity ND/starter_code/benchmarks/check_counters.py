@@ -0,0 +1,99 @@
+"""Check that creating and deleting shows keeps the show counters exact.
+
+Seeds a venue and an artist, then through the Flask test client creates a
+show that starts ``--wait`` seconds later and one five days later, and
+waits for the first to start. Without a rollover in between, it deletes
+the later show: the rows then count a show as upcoming that has started,
+which the delete must not make permanent. After each step, and after a
+rollover, the counters of the two rows must match those `flask counters
+check` recomputes from Show. It exits with a non-zero status when they do
+not. The seeded rows are deleted again afterwards.
+
+    python benchmarks/check_counters.py
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+import support  # noqa: F401
+
+from app import create_app
+from models import db, Venue, Artist, Show
+import counters
+
+app = create_app()
+
+
+def seed():
+    venue = Venue(name='Counter Check Venue', genres=['Jazz'], address=None,
+                  city='Austin', state='TX', phone=None, website=None,
+                  facebook_link=None, image_link=None, seeking_talent=False,
+                  seeking_description=None)
+    artist = Artist(name='Counter Check Artist', genres=['Jazz'], city='Austin',
+                    state='TX', phone=None, image_link=None, website=None,
+                    facebook_link=None, seeking_venue=False,
+                    seeking_description=None)
+    db.session.add_all([venue, artist])
+    db.session.commit()
+    return venue.id, artist.id
+
+
+def cleanup(venue_id, artist_id):
+    Show.query.filter_by(venue_id=venue_id).delete()
+    Venue.query.filter_by(id=venue_id).delete()
+    Artist.query.filter_by(id=artist_id).delete()
+    db.session.commit()
+
+
+def check(name, venue_id, artist_id):
+    # prints the drift of the two rows; returns whether there was none
+    drift = [(table, entity_id, stored, actual)
+             for table, entity_id, stored, actual in counters.check()
+             if (table, entity_id) in (('Venue', venue_id), ('Artist', artist_id))]
+    db.session.remove()
+    print('%-4s %s' % ('FAIL' if drift else 'ok', name), file=sys.stderr)
+    for table, entity_id, stored, actual in drift:
+        print('     %s %d: stored %r, actual %r' % (table, entity_id, stored, actual),
+              file=sys.stderr)
+    return not drift
+
+
+def create_show(client, venue_id, artist_id, start_time):
+    client.post('/shows/create', data={
+        'venue_id': venue_id, 'artist_id': artist_id,
+        'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')})
+    return Show.query.filter_by(venue_id=venue_id, start_time=start_time).one().id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wait', type=float, default=2,
+                        help='seconds until the first show starts')
+    args = parser.parse_args()
+
+    failures = 0
+    with app.app_context():
+        venue_id, artist_id = seed()
+        try:
+            client = app.test_client()
+            now = datetime.now().replace(microsecond=0)
+            create_show(client, venue_id, artist_id,
+                        now + timedelta(seconds=args.wait + 1))
+            later = create_show(client, venue_id, artist_id, now + timedelta(days=5))
+            failures += not check('create two upcoming shows', venue_id, artist_id)
+
+            time.sleep(args.wait + 1.5)
+            client.delete('/shows/%d' % later)
+            failures += not check('delete the later show after the first started, '
+                                  'before a rollover', venue_id, artist_id)
+
+            counters.rollover()
+            failures += not check('rollover', venue_id, artist_id)
+        finally:
+            cleanup(venue_id, artist_id)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Regression check for the number of statements each page issues.
+
+Creates one venue and one artist with ``--shows`` shows between them,
+requests their detail pages through the Flask test client and fails with a
+non-zero exit status when a page issues more statements than its budget.
+The seeded rows are deleted again afterwards.
+
+    python benchmarks/check_query_counts.py --shows 2000
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from support import StatementCounter
+
+from app import create_app
+from models import db, Venue, Artist, Show
+import counters
+
+app = create_app()
+
+# maximum number of statements per request, independent of the show count
+BUDGETS = {
+    '/venues/%(venue_id)d': 4,
+    '/venues/%(venue_id)d/shows?when=past': 1,
+    '/artists/%(artist_id)d': 4,
+    '/artists/%(artist_id)d/shows?when=past': 1,
+}
+
+
+def seed(num_shows):
+    venue = Venue(name='Query Budget Venue', genres=['Jazz'], address=None,
+                  city='Austin', state='TX', phone=None, website=None,
+                  facebook_link=None, image_link=None, seeking_talent=False,
+                  seeking_description=None)
+    artist = Artist(name='Query Budget Artist', genres=['Jazz'], city='Austin',
+                    state='TX', phone=None, image_link=None, website=None,
+                    facebook_link=None, seeking_venue=False,
+                    seeking_description=None)
+    db.session.add_all([venue, artist])
+    db.session.flush()
+    now = datetime.now()
+    db.session.execute(Show.__table__.insert(), [{
+        'venue_id': venue.id, 'artist_id': artist.id,
+        'start_time': now + timedelta(days=i - num_shows // 2),
+    } for i in range(num_shows)])
+    counters.recount([venue.id], [artist.id])
+    db.session.commit()
+    return venue.id, artist.id
+
+
+def cleanup(venue_id, artist_id):
+    Show.query.filter_by(venue_id=venue_id).delete()
+    Venue.query.filter_by(id=venue_id).delete()
+    Artist.query.filter_by(id=artist_id).delete()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shows', type=int, default=1000)
+    args = parser.parse_args()
+
+    failures = 0
+    with app.app_context():
+        venue_id, artist_id = seed(args.shows)
+        ids = {'venue_id': venue_id, 'artist_id': artist_id}
+        try:
+            client = app.test_client()
+            # the first request loads the autocomplete indexes
+            client.get('/')
+            counter = StatementCounter(db.engine)
+            for pattern, budget in sorted(BUDGETS.items()):
+                url = pattern % ids
+                with counter:
+                    response = client.get(url)
+                ok = response.status_code == 200 and counter.count <= budget
+                failures += not ok
+                print('%-4s %-20s status=%d statements=%d budget=%d' % (
+                    'ok' if ok else 'FAIL', url, response.status_code,
+                    counter.count, budget))
+        finally:
+            cleanup(venue_id, artist_id)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Check that no route falls back to a sequential scan on a large table.
+
+Requests every read route of app.py through the Flask test client, captures
+the statements each one sends, runs EXPLAIN on them and fails with a
+non-zero exit status when a plan sequentially scans a table with more than
+``--min-rows`` rows. Run it against a local database seeded with realistic
+volumes. Routes that list a whole table are expected to scan it and are
+marked as such below.
+
+    python benchmarks/check_query_plans.py --min-rows 10000
+"""
+import argparse
+import sys
+
+from sqlalchemy import func, text
+
+from support import StatementCounter, explain, plan_nodes
+
+from app import create_app
+from models import db, Venue, Artist, Show
+
+# (method, url, form data, tables the route may scan in full). /venues lists
+# every venue with its stored upcoming show counter, so it reads Venue alone.
+ROUTES = [
+    ('GET', '/venues', None, {'Venue'}),
+    ('GET', '/venues/%(venue_id)d', None, set()),
+    ('GET', '/venues/%(venue_id)d/shows?when=past', None, set()),
+    ('GET', '/venues/%(venue_id)d/shows?when=upcoming', None, set()),
+    ('GET', '/venues/%(venue_id)d/edit', None, set()),
+    ('GET', '/artists', None, {'Artist'}),
+    ('GET', '/artists/%(artist_id)d', None, set()),
+    ('GET', '/artists/%(artist_id)d/shows?when=past', None, set()),
+    ('GET', '/artists/%(artist_id)d/edit', None, set()),
+    ('GET', '/shows?limit=50', None, set()),
+    ('POST', '/venues/search', {'search_term': 'hall'}, set()),
+    ('POST', '/artists/search', {'search_term': 'band'}, set()),
+    ('POST', '/shows/search', {'search_term': 'band', 'from': '2020-01-01'}, set()),
+    ('GET', '/api/autocomplete?type=venue&q=mu', None, set()),
+    ('GET', '/api/v1/venues?after=%(venue_id)d', None, set()),
+    ('GET', '/api/v1/venues/%(venue_id)d', None, set()),
+    ('GET', '/api/v1/artists/%(artist_id)d', None, set()),
+    ('GET', '/api/v1/shows?limit=50', None, set()),
+]
+
+
+def large_tables(min_rows):
+    rows = db.session.execute(text(
+        "SELECT relname, reltuples FROM pg_class "
+        "WHERE relkind = 'r' AND relname IN ('Venue', 'Artist', 'Show')"))
+    return {name for name, tuples in rows if tuples >= min_rows}
+
+
+def busiest(column):
+    # the venue / artist with the most shows gives the worst-case plans
+    return db.session.query(column).group_by(column).order_by(
+        func.count(Show.id).desc()).limit(1).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-rows', type=int, default=10000,
+                        help='tables with at least this many rows count as large')
+    parser.add_argument('--analyze', action='store_true',
+                        help='ANALYZE the tables first so the planner has fresh statistics')
+    args = parser.parse_args()
+
+    failures = 0
+    app = create_app()
+    with app.app_context():
+        if args.analyze:
+            for model in (Venue, Artist, Show):
+                db.session.execute(text('ANALYZE "%s"' % model.__tablename__))
+            db.session.commit()
+        large = large_tables(args.min_rows)
+        ids = {'venue_id': busiest(Show.venue_id) or 1,
+               'artist_id': busiest(Show.artist_id) or 1}
+        print('large tables: %s' % (', '.join(sorted(large)) or 'none'))
+
+        client = app.test_client()
+        # the first request loads the autocomplete indexes, which reads
+        # Venue and Artist in full once per process
+        client.get('/')
+        counter = StatementCounter(db.engine)
+        for method, pattern, form, full_scans in ROUTES:
+            url = pattern % ids
+            with counter:
+                response = client.open(url, method=method, data=form)
+                response.get_data()
+            problems = []
+            for statement, parameters in counter.statements:
+                plan = explain(db.session, statement, parameters, analyze=False)
+                for node in plan_nodes(plan):
+                    table = node.get('Relation Name')
+                    if node['Node Type'] == 'Seq Scan' and table in large \
+                            and table not in full_scans:
+                        problems.append('%s: %s' % (table, ' '.join(statement.split())[:120]))
+            db.session.rollback()
+            failed = bool(problems) or response.status_code != 200
+            failures += failed
+            print('%-4s %-6s %-40s status=%d statements=%d' % (
+                'FAIL' if failed else 'ok', method, url,
+                response.status_code, counter.count))
+            for problem in problems:
+                print('       seq scan on %s' % problem)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Check that reads go to the replicas and writes to the primary.
+
+Runs the app with one replica, ``--replica-url``, which defaults to the
+primary's own database: a stand-in that is not a replica at all but has an
+engine of its own, so the statements each engine sends can be told apart.
+Point it at a real streaming replica to check one. The script seeds a
+venue, then checks through the Flask test client that
+
+- the venue page reads from the replica;
+- editing the venue writes to the primary, and the page the edit redirects
+  to, as every read of that client for READ_YOUR_WRITES_SECONDS, is read
+  from the primary too;
+- a replica that lags or cannot be reached is left out, and the pages are
+  read from the primary instead.
+
+It exits with a non-zero status when one of them does not hold. The seeded
+rows are deleted again afterwards.
+
+    python benchmarks/check_replicas.py
+    python benchmarks/check_replicas.py --replica-url postgresql://replica-host/fyyur
+"""
+import argparse
+import sys
+
+from support import StatementCounter
+
+from app import create_app
+from models import db, Venue
+import cache
+import config
+
+# a port nothing listens on
+UNREACHABLE = 'postgresql://127.0.0.1:9/fyyur'
+
+
+def make_app(replica_url):
+    # the script runs the health checks itself, so that the checking
+    # thread does not undo the states it sets up
+    app = create_app({'SQLALCHEMY_BINDS': {'replica0': replica_url},
+                      'REPLICA_BINDS': ['replica0'], 'REPLICA_CHECK_INTERVAL': 3600})
+    # every request reaches the database
+    cache.configure(0, 0)
+    return app
+
+
+def seed():
+    venue = Venue(name='Replica Check Venue', genres=['Jazz'], address='1 Main St',
+                  city='Austin', state='TX', phone=None, website=None,
+                  facebook_link=None, image_link=None, seeking_talent=False,
+                  seeking_description=None)
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def cleanup(venue_id):
+    Venue.query.filter_by(id=venue_id).delete()
+    db.session.commit()
+
+
+def request(app, client, method, url, data=None):
+    # (status, statements on the primary, statements on the replica)
+    replica = app.extensions['replicas'].replicas[0]
+    with StatementCounter(db.get_engine(app)) as primary, \
+            StatementCounter(replica.engine) as secondary:
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        db.session.remove()
+    return response.status_code, primary.count, secondary.count
+
+
+def check(name, ok, result):
+    # result: what request() returned
+    print('%-4s %-55s status=%d primary=%d replica=%d' % (
+        ('ok' if ok else 'FAIL', name) + tuple(result)), file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--replica-url', default=config.SQLALCHEMY_DATABASE_URI)
+    args = parser.parse_args()
+
+    app = make_app(args.replica_url)
+    replica_set = app.extensions['replicas']
+    replica = replica_set.replicas[0]
+    failures = 0
+    with app.app_context():
+        venue_id = seed()
+        db.session.remove()
+        try:
+            replica_set.check(replica)
+            if not replica.healthy:
+                print('FAIL replica %s is not healthy (lag %s)' % (
+                    args.replica_url, replica.lag), file=sys.stderr)
+                return 1
+            page = '/venues/%d' % venue_id
+            client = app.test_client()
+            # the first request loads the autocomplete indexes
+            client.get('/')
+
+            result = request(app, client, 'GET', page)
+            failures += not check('GET %s reads from the replica' % page,
+                                  result[0] == 200 and result[1] == 0 and result[2] > 0,
+                                  result)
+            result = request(app, client, 'POST', '/venues/search',
+                             {'search_term': 'Replica Check'})
+            failures += not check('POST /venues/search reads from the replica',
+                                  result[0] == 200 and result[1] == 0 and result[2] > 0,
+                                  result)
+
+            form = {'name': 'Replica Check Venue', 'genres': 'Jazz', 'address': '2 Main St',
+                    'city': 'Austin', 'state': 'TX'}
+            result = request(app, client, 'POST', page + '/edit', form)
+            failures += not check('POST %s/edit writes to the primary' % page,
+                                  result[0] == 302 and result[1] > 0 and result[2] == 0,
+                                  result)
+            result = request(app, client, 'GET', page)
+            failures += not check('GET %s after the edit reads from the primary' % page,
+                                  result[0] == 200 and result[1] > 0 and result[2] == 0,
+                                  result)
+            if Venue.query.get(venue_id).address != '2 Main St':
+                failures += 1
+                print('FAIL the edit was not saved', file=sys.stderr)
+            db.session.remove()
+
+            # once the read-your-writes window is over
+            with client.session_transaction() as session:
+                session.pop('db_primary_until', None)
+            result = request(app, client, 'GET', page)
+            failures += not check('GET %s after the window reads from the replica' % page,
+                                  result[0] == 200 and result[1] == 0 and result[2] > 0,
+                                  result)
+
+            max_lag = replica_set.max_lag
+            replica_set.max_lag = -1
+            replica_set.check(replica)
+            replica_set.max_lag = max_lag
+            result = request(app, client, 'GET', page)
+            failures += not check('GET %s with the replica lagging reads from the primary'
+                                  % page, result[0] == 200 and result[1] > 0 and
+                                  result[2] == 0, result)
+        finally:
+            cleanup(venue_id)
+            db.session.remove()
+
+    app = make_app(UNREACHABLE)
+    replica_set = app.extensions['replicas']
+    with app.app_context():
+        replica_set.check(replica_set.replicas[0])
+        client = app.test_client()
+        client.get('/')
+        status, primary, _ = request(app, client, 'GET', '/venues')
+        ok = not replica_set.replicas[0].healthy and status == 200 and primary > 0
+        failures += not check('GET /venues with the replica down reads from the primary',
+                              ok, (status, primary, 0))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
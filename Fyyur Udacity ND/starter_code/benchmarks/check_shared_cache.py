@@ -0,0 +1,171 @@
+"""Check the shared page cache of cache_server.py across two workers.
+
+Starts a cache server on a background thread (cache_server.serve_in_thread)
+and two instances of the app with CACHE_BACKEND = 'socket': one in this
+process, used through the Flask test client, and one in a child process,
+served over HTTP, as two gunicorn workers would be. The script seeds a
+venue, then checks that
+
+- a page one worker built is served from the cache by the other;
+- an edit made through one worker retires the page the other cached, and
+  the other's autocomplete index has the new name;
+- with the server down, pages are built from the database, and a server
+  that hangs costs one socket timeout, not one per lookup.
+
+It exits with a non-zero status when one of them does not hold. The seeded
+rows are deleted again afterwards.
+
+    python benchmarks/check_shared_cache.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+from support import APP_DIR, StatementCounter
+
+from app import create_app
+from models import db, Venue
+from cache_server import serve_in_thread
+import cache
+
+# the second worker: serves the app on the port given, with the cache
+# server at the address given
+WORKER = '''
+import sys
+from werkzeug.serving import make_server
+from app import create_app
+app = create_app({'CACHE_BACKEND': 'socket', 'CACHE_ADDRESS': sys.argv[2]})
+make_server('127.0.0.1', int(sys.argv[1]), app, threaded=True).serve_forever()
+'''
+
+# requests timed against a server that accepts connections but never answers
+HUNG_REQUESTS = 10
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def seed():
+    venue = Venue(name='Shared Cache Venue', genres=['Jazz'], address='1 Main St',
+                  city='Austin', state='TX', phone=None, website=None,
+                  facebook_link=None, image_link=None, seeking_talent=False,
+                  seeking_description=None)
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def cleanup(venue_id):
+    Venue.query.filter_by(id=venue_id).delete()
+    db.session.commit()
+
+
+def start_worker(port, address):
+    worker = subprocess.Popen([sys.executable, '-W', 'ignore', '-c', WORKER, str(port), address],
+                              cwd=APP_DIR, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            fetch(port, '/')
+            return worker
+        except OSError:
+            time.sleep(0.2)
+    worker.kill()
+    raise SystemExit('the second worker did not start')
+
+
+def fetch(port, path):
+    with urllib.request.urlopen('http://127.0.0.1:%d%s' % (port, path)) as response:
+        return response.read().decode('utf-8')
+
+
+def request(client, method, url, data=None):
+    # (status, statements, html)
+    with StatementCounter(db.engine) as counter:
+        response = client.open(url, method=method, data=data)
+        html = response.get_data(as_text=True)
+        db.session.remove()
+    return response.status_code, counter.count, html
+
+
+def check(name, ok, detail=''):
+    print('%-4s %-60s %s' % ('ok' if ok else 'FAIL', name, detail), file=sys.stderr)
+    return ok
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, 'cache.sock')
+    server = serve_in_thread(address)
+    app = create_app({'CACHE_BACKEND': 'socket', 'CACHE_ADDRESS': address})
+    port = free_port()
+    worker = start_worker(port, address)
+    failures = 0
+    with app.app_context():
+        venue_id = seed()
+        page = '/venues/%d' % venue_id
+        try:
+            client = app.test_client()
+            client.get('/')
+
+            fetch(port, page)
+            status, statements, _ = request(client, 'GET', page)
+            failures += not check('a page the other worker built is a hit',
+                                  status == 200 and statements == 0,
+                                  'statements=%d' % statements)
+
+            form = {'name': 'Shared Cache Venue Renamed', 'genres': 'Jazz',
+                    'address': '1 Main St', 'city': 'Austin', 'state': 'TX'}
+            request(client, 'POST', page + '/edit', form)
+            failures += not check('an edit here retires the page of the other worker',
+                                  'Shared Cache Venue Renamed' in fetch(port, page))
+            names = fetch(port, '/api/autocomplete?type=venue&q=%s' % urllib.parse.quote(
+                'Shared Cache Venue Renamed'))
+            failures += not check('an edit here reaches the autocomplete of the other worker',
+                                  'Shared Cache Venue Renamed' in names)
+
+            server.shutdown()
+            server.server_close()
+            os.unlink(address)
+            # the lookup fails over the connection the server dropped
+            status, statements, html = request(client, 'GET', page)
+            failures += not check('with the server down, pages are built',
+                                  status == 200 and statements > 0 and
+                                  'Shared Cache Venue Renamed' in html,
+                                  'status=%d statements=%d' % (status, statements))
+
+            # a server that accepts connections but never answers
+            hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            hung.bind(address)
+            hung.listen(64)
+            backend = cache.pages.backend
+            backend.down_until = 0
+            start = time.perf_counter()
+            for _ in range(HUNG_REQUESTS):
+                request(client, 'GET', page)
+            elapsed = time.perf_counter() - start
+            failures += not check('a hung server costs one timeout, not one per lookup',
+                                  elapsed < HUNG_REQUESTS * backend.timeout,
+                                  '%d requests in %.2fs' % (HUNG_REQUESTS, elapsed))
+            hung.close()
+        finally:
+            worker.kill()
+            worker.wait()
+            cleanup(venue_id)
+            db.session.remove()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
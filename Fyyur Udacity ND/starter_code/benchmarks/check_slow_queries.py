@@ -0,0 +1,83 @@
+"""Exercise the slow-query capture against a local database.
+
+Turns SLOW_QUERY_CAPTURE on with a zero threshold and a sample rate of 1,
+requests a few read routes through the Flask test client, then requests
+them again with index scans disabled on every connection, so that the
+second run captures different plans for the same statements. Each run
+writes its own log in a temporary directory, and the two are compared
+with `flask slow-queries report --baseline`, which must flag the changes.
+
+    python benchmarks/check_slow_queries.py
+"""
+import os
+import sys
+import tempfile
+
+from sqlalchemy import event
+
+import support  # noqa: F401
+
+from app import create_app
+from models import db, Show
+
+ROUTES = [
+    '/venues/%(venue_id)d',
+    '/artists/%(artist_id)d',
+    '/shows?limit=50',
+    '/api/v1/venues/%(venue_id)d',
+]
+
+
+def run(client, ids):
+    for pattern in ROUTES:
+        response = client.get(pattern % ids)
+        response.get_data()
+        if response.status_code != 200:
+            raise SystemExit('%s returned %d' % (pattern % ids, response.status_code))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    baseline = os.path.join(directory, 'baseline.ndjson')
+    current = os.path.join(directory, 'current.ndjson')
+    app = create_app({
+        'SLOW_QUERY_CAPTURE': True,
+        'SLOW_QUERY_THRESHOLD_MS': 0,
+        'SLOW_QUERY_SAMPLE_RATE': 1.0,
+        'SLOW_QUERY_LOG': baseline,
+        # every request reaches the database
+        'PAGE_CACHE_SIZE': 0,
+    })
+
+    with app.app_context():
+        engine = db.engine
+        ids = {'venue_id': db.session.query(Show.venue_id).limit(1).scalar(),
+               'artist_id': db.session.query(Show.artist_id).limit(1).scalar()}
+    client = app.test_client()
+    client.get('/')
+    run(client, ids)
+
+    app.extensions['slow_queries'].path = current
+    engine.dispose()
+
+    @event.listens_for(engine, 'connect')
+    def disable_index_scans(dbapi_connection, record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET enable_indexscan = off')
+        cursor.execute('SET enable_bitmapscan = off')
+        cursor.close()
+        # a rollback at checkin would undo the settings otherwise
+        dbapi_connection.commit()
+
+    run(client, ids)
+
+    result = app.test_cli_runner().invoke(args=[
+        'slow-queries', 'report', '--log', current, '--baseline', baseline,
+        '--top', '5', '--fail-on-change'])
+    print(result.output)
+    print('logs in %s' % directory)
+    return 0 if result.exit_code == 1 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Fill the configured database with a synthetic, reproducible dataset.
+
+Generates ``--venues`` venues, ``--artists`` artists and ``--shows`` shows
+from ``--seed`` and loads them with COPY. Shows are spread unevenly, the way
+real bookings are: with ``--skew`` above 1 a few venues and artists get most
+of the shows and the long tail gets a handful or none, and a few cities hold
+most of the venues. Start times cover ``--years`` years on either side of
+now, ``--past`` of them in the past. The show counters are recomputed and the
+tables analyzed at the end, so the data is ready to benchmark.
+
+The same seed gives the same rows (start times are relative to the day the
+script runs), so results from different commits are comparable. ``--reset``
+empties the three tables first; without it the rows are added to whatever
+is there.
+
+    python benchmarks/generate_data.py --venues 100000 --artists 50000 \\
+        --shows 5000000 --reset
+"""
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+import support  # noqa: F401
+
+from sqlalchemy import func, text
+
+from app import create_app
+from models import db, Venue, Artist, Show
+from importer import copy_value
+import counters
+
+# a bulk script: no statement timeout
+app = create_app({'COMMAND_LINE': True})
+
+BATCH_SIZE = 100000
+
+CITIES = [
+    ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Austin', 'TX'),
+    ('Nashville', 'TN'), ('San Francisco', 'CA'), ('Seattle', 'WA'), ('Boston', 'MA'),
+    ('New Orleans', 'LA'), ('Atlanta', 'GA'), ('Denver', 'CO'), ('Portland', 'OR'),
+    ('Philadelphia', 'PA'), ('Minneapolis', 'MN'), ('Detroit', 'MI'), ('Miami', 'FL'),
+    ('Memphis', 'TN'), ('Kansas City', 'MO'), ('Phoenix', 'AZ'), ('Pittsburgh', 'PA'),
+    ('Baltimore', 'MD'), ('Cleveland', 'OH'), ('Salt Lake City', 'UT'), ('Omaha', 'NE'),
+    ('Albuquerque', 'NM'), ('Boise', 'ID'), ('Burlington', 'VT'), ('Anchorage', 'AK'),
+]
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+    'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+    'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+]
+ADJECTIVES = [
+    'Velvet', 'Blue', 'Golden', 'Electric', 'Midnight', 'Crimson', 'Silver', 'Wild',
+    'Lucky', 'Rusty', 'Neon', 'Broken', 'Hollow', 'Little', 'Grand', 'Copper',
+]
+NOUNS = [
+    'Moon', 'Fox', 'Anchor', 'Lantern', 'Owl', 'Rose', 'Horse', 'Crow', 'Harbor',
+    'Garden', 'Tiger', 'Comet', 'Mirror', 'Bridge', 'Echo', 'Engine',
+]
+PLACES = ['Hall', 'Room', 'Tavern', 'Lounge', 'Theatre', 'Club', 'Bar', 'Ballroom']
+STREETS = ['Main St', 'Oak Ave', 'Market St', 'Broadway', 'Elm St', '2nd Ave', 'Pine St']
+
+
+def pick(rng, items, skew):
+    # items[0] is the most likely, items[-1] the least; skew 1 is uniform
+    return items[int(len(items) * rng.random() ** skew)]
+
+
+def venue_row(rng, i, skew, now):
+    city, state = pick(rng, CITIES, skew)
+    name = 'The %s %s %s' % (rng.choice(ADJECTIVES), rng.choice(NOUNS), rng.choice(PLACES))
+    seeking = rng.random() < 0.3
+    return {
+        'name': '%s %d' % (name, i), 'city': city, 'state': state,
+        'address': '%d %s' % (rng.randint(1, 9999), rng.choice(STREETS)),
+        'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(200, 999), i % 10000),
+        'image_link': 'https://images.example.com/venues/%d.jpg' % i,
+        'facebook_link': 'https://www.facebook.com/venue%d' % i,
+        'website': 'https://venue%d.example.com' % i,
+        'genres': rng.sample(GENRES, rng.randint(1, 3)),
+        'seeking_talent': seeking,
+        'seeking_description': 'Looking for local bands on weekends' if seeking else None,
+        'updated_at': now,
+    }
+
+
+def artist_row(rng, i, skew, now):
+    city, state = pick(rng, CITIES, skew)
+    name = '%s %s' % (rng.choice(ADJECTIVES), rng.choice(NOUNS))
+    if rng.random() < 0.5:
+        name = 'The %ss' % name
+    seeking = rng.random() < 0.4
+    return {
+        'name': '%s %d' % (name, i), 'city': city, 'state': state,
+        'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(200, 999), i % 10000),
+        'image_link': 'https://images.example.com/artists/%d.jpg' % i,
+        'facebook_link': 'https://www.facebook.com/artist%d' % i,
+        'website': 'https://artist%d.example.com' % i,
+        'genres': rng.sample(GENRES, rng.randint(1, 2)),
+        'seeking_venue': seeking,
+        'seeking_description': 'Touring the west coast next year' if seeking else None,
+        'updated_at': now,
+    }
+
+
+def show_row(rng, venue_ids, artist_ids, skew, years, past, now):
+    days = rng.random() * 365 * years
+    if rng.random() < past:
+        days = -days
+    start = (now + timedelta(days=days)).replace(
+        hour=rng.randint(18, 23), minute=0, second=0, microsecond=0)
+    return {
+        'venue_id': pick(rng, venue_ids, skew),
+        'artist_id': pick(rng, artist_ids, skew),
+        'start_time': start,
+        'updated_at': now,
+    }
+
+
+def copy_rows(model, rows):
+    columns = None
+    buf = io.StringIO()
+    for row in rows:
+        if columns is None:
+            columns = list(row)
+        buf.write('\t'.join(copy_value(row[column]) for column in columns))
+        buf.write('\n')
+    if columns is None:
+        return
+    buf.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY "%s" (%s) FROM STDIN' % (
+        model.__tablename__, ', '.join(columns)), buf)
+
+
+def load(model, total, make_row):
+    # make_row(i) -> row dict; returns the id of the first row loaded
+    start = time.perf_counter()
+    first_id = (db.session.query(func.max(model.id)).scalar() or 0) + 1
+    for offset in range(0, total, BATCH_SIZE):
+        copy_rows(model, (make_row(i) for i in range(offset, min(offset + BATCH_SIZE, total))))
+        db.session.commit()
+    print('%-7s %9d rows  %6.1f s' % (model.__tablename__, total,
+                                       time.perf_counter() - start))
+    return first_id
+
+
+def ids_from(model, first_id):
+    return [row[0] for row in db.session.query(model.id).filter(
+        model.id >= first_id).order_by(model.id)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--venues', type=int, default=100000)
+    parser.add_argument('--artists', type=int, default=50000)
+    parser.add_argument('--shows', type=int, default=5000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skew', type=float, default=3.0,
+                        help='1 spreads shows evenly; higher values concentrate them')
+    parser.add_argument('--years', type=float, default=2.0)
+    parser.add_argument('--past', type=float, default=0.8,
+                        help='fraction of the shows that are in the past')
+    parser.add_argument('--reset', action='store_true',
+                        help='delete every venue, artist and show first')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    with app.app_context():
+        if args.reset:
+            db.session.execute(text('TRUNCATE "Show", "Venue", "Artist" RESTART IDENTITY'))
+            db.session.commit()
+        venue_ids = ids_from(Venue, load(
+            Venue, args.venues, lambda i: venue_row(rng, i, args.skew, now)))
+        artist_ids = ids_from(Artist, load(
+            Artist, args.artists, lambda i: artist_row(rng, i, args.skew, now)))
+        # the busiest venues and artists are scattered over the id range
+        # rather than being the first ones inserted
+        popular_venues = list(venue_ids)
+        popular_artists = list(artist_ids)
+        rng.shuffle(popular_venues)
+        rng.shuffle(popular_artists)
+        if popular_venues and popular_artists:
+            load(Show, args.shows, lambda i: show_row(
+                rng, popular_venues, popular_artists, args.skew, args.years,
+                args.past, now))
+
+        start = time.perf_counter()
+        counters.recount(venue_ids, artist_ids, now)
+        db.session.commit()
+        for model in (Venue, Artist, Show):
+            db.session.execute(text('ANALYZE "%s"' % model.__tablename__))
+        db.session.commit()
+        print('counters and statistics  %6.1f s' % (time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
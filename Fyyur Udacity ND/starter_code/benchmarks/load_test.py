@@ -0,0 +1,436 @@
+"""Replay a mix of traffic against a running app with concurrent clients.
+
+Starts the app with ``--server`` (the Flask development server by default)
+or uses the one already listening at ``--url``, then runs ``--clients``
+threads that each send requests back to back for ``--duration`` seconds,
+picking the endpoint of every request from ``--mix``. Statistics start
+after ``--warmup`` seconds. At the end it prints the throughput, error
+count and p50/p95/p99 latency of each endpoint.
+
+Every ``--interval`` seconds the server's /metrics page is scraped for the
+DB pool and the memory of the server and its workers is sampled (when its
+pid is known: the server was started here or ``--pid`` was given). The run fails, exit status 1,
+when:
+
+* the pool ran out: every connection it may open was checked out, or
+  requests waited more than ``--max-checkout-ms`` on average for one;
+* that memory grew by more than ``--max-growth`` MB between the end of the
+  warmup and the end of the run, which over a long soak run points at a
+  leak;
+* more than ``--max-errors`` of the requests failed.
+
+Created shows start in 2099 and are deleted again, with their counters
+recomputed, when the run ends. The results, per-endpoint statistics and
+samples, can be written as JSON with ``--output``.
+
+    python benchmarks/load_test.py --clients 16 --duration 60
+    python benchmarks/load_test.py --server "gunicorn -c gunicorn.conf.py \
+        --bind 127.0.0.1:{port} wsgi:application"
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --pid 1234 \\
+        --duration 3600 --mix venue=40,artist=40,search=20
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from sqlalchemy import func
+
+from support import APP_DIR
+
+from app import create_app
+from models import db, Venue, Artist, Show
+from check_query_plans import busiest
+import counters
+
+# a bulk script: no statement timeout
+app = create_app({'COMMAND_LINE': True})
+
+DEFAULT_MIX = 'venues=5,venue=25,artists=5,artist=20,shows=10,search=15,api=15,create=5'
+
+# created shows start in this year, so that they can be told apart
+CREATED_YEAR = 2099
+
+SEARCH_TERMS = ['hall', 'the', 'moon', 'club', 'band', 'fox', 'blue', 'room']
+
+
+def venues(rng, ids):
+    return 'GET', '/venues', None
+
+
+def venue(rng, ids):
+    return 'GET', '/venues/%d' % rng.choice(ids['venues']), None
+
+
+def artists(rng, ids):
+    return 'GET', '/artists', None
+
+
+def artist(rng, ids):
+    return 'GET', '/artists/%d' % rng.choice(ids['artists']), None
+
+
+def shows(rng, ids):
+    return 'GET', '/shows?limit=50', None
+
+
+def search(rng, ids):
+    path = rng.choice(['/venues/search', '/artists/search', '/shows/search'])
+    return 'POST', path, {'search_term': rng.choice(SEARCH_TERMS)}
+
+
+def api(rng, ids):
+    if rng.random() < 0.5:
+        return 'GET', '/api/v1/venues/%d' % rng.choice(ids['venues']), None
+    return 'GET', '/api/v1/artists/%d' % rng.choice(ids['artists']), None
+
+
+def create(rng, ids):
+    start = datetime(CREATED_YEAR, 1, 1) + timedelta(hours=rng.randint(0, 24 * 300))
+    return 'POST', '/shows/create', {
+        'venue_id': rng.choice(ids['venues']), 'artist_id': rng.choice(ids['artists']),
+        'start_time': start.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+ENDPOINTS = {
+    'venues': venues,
+    'venue': venue,
+    'artists': artists,
+    'artist': artist,
+    'shows': shows,
+    'search': search,
+    'api': api,
+    'create': create,
+}
+
+
+class Latencies(object):
+    """Latency histogram with 2% wide buckets, so soak runs keep no samples."""
+
+    growth = math.log(1.02)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.errors = 0
+
+    def add(self, ms):
+        bucket = int(math.log(max(ms, 0.01)) / self.growth)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.errors += other.errors
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the percentile
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return math.exp((bucket + 1) * self.growth)
+        return 0.0
+
+
+class Client(threading.Thread):
+
+    def __init__(self, url, mix, ids, seed, stop, measuring):
+        threading.Thread.__init__(self, daemon=True)
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.mix = mix
+        self.ids = ids
+        self.rng = random.Random(seed)
+        self.stop = stop
+        self.measuring = measuring
+        self.latencies = {name: Latencies() for name, weight in mix}
+
+    def run(self):
+        names = [name for name, weight in self.mix]
+        weights = [weight for name, weight in self.mix]
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        while not self.stop.is_set():
+            name = self.rng.choices(names, weights)[0]
+            method, path, form = ENDPOINTS[name](self.rng, self.ids)
+            body = urlencode(form) if form else None
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                response.read()
+                failed = response.status >= 500
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            if self.measuring.is_set():
+                latencies = self.latencies[name]
+                latencies.add(elapsed)
+                latencies.errors += failed
+        conn.close()
+
+
+def _memory_kb(pid):
+    # proportional set size where the kernel reports it: pages shared by
+    # several processes, such as those of preforked workers, are divided
+    # between them instead of being counted once per process
+    for path, field in (('/proc/%d/smaps_rollup', 'Pss:'), ('/proc/%d/status', 'VmRSS:')):
+        try:
+            with open(path % pid) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+    return None
+
+
+def _children(pid):
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            return [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def memory_mb(pid):
+    # memory of the server and its worker processes; Linux only, None
+    # elsewhere
+    total = _memory_kb(pid)
+    if total is None:
+        return None
+    for child in _children(pid):
+        total += _memory_kb(child) or 0
+    return total / 1024.0
+
+
+def scrape(url):
+    # the pool numbers of /metrics: {name or name{labels}: value}
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    try:
+        conn.request('GET', '/metrics')
+        text = conn.getresponse().read().decode('utf-8')
+    except (OSError, http.client.HTTPException):
+        return {}
+    finally:
+        conn.close()
+    values = {}
+    for line in text.splitlines():
+        if line.startswith(('fyyur_db_pool_', 'fyyur_requests_in_flight')):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+def sample(url, pid, started):
+    metrics = scrape(url)
+    return {
+        'seconds': round(time.time() - started, 1),
+        'memory_mb': memory_mb(pid) if pid else None,
+        'checked_out': metrics.get('fyyur_db_pool_connections{state="checked_out"}'),
+        'checkout_count': metrics.get('fyyur_db_pool_checkout_seconds_count'),
+        'checkout_seconds': metrics.get('fyyur_db_pool_checkout_seconds_sum'),
+        'in_flight': sum(value for name, value in metrics.items()
+                         if name.startswith('fyyur_requests_in_flight')),
+    }
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise SystemExit('unknown endpoint %r; choose from %s' % (
+                name, ', '.join(sorted(ENDPOINTS))))
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def pick_ids(limit=1000):
+    # a random sample plus the busiest venue and artist
+    ids = {}
+    for key, model, column in (('venues', Venue, Show.venue_id),
+                               ('artists', Artist, Show.artist_id)):
+        ids[key] = [row[0] for row in db.session.query(model.id).order_by(
+            func.random()).limit(limit)]
+        top = busiest(column)
+        if top:
+            ids[key].append(top)
+    db.session.remove()
+    return ids
+
+
+def remove_created_shows():
+    created = Show.query.filter(Show.start_time >= datetime(CREATED_YEAR, 1, 1))
+    rows = created.with_entities(Show.venue_id, Show.artist_id).all()
+    created.delete(synchronize_session=False)
+    counters.recount({row[0] for row in rows}, {row[1] for row in rows})
+    db.session.commit()
+    return len(rows)
+
+
+def start_server(command, url):
+    env = dict(os.environ, FLASK_APP='app.py')
+    server = subprocess.Popen(shlex.split(command), cwd=APP_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    parts = urlsplit(url)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('the server exited with status %d' % server.returncode)
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('the server did not answer within a minute')
+
+
+def report(clients, samples, args, elapsed, capacity):
+    # prints the summary to stderr; returns (results, problems)
+    total = {name: Latencies() for name, weight in args.mix}
+    for client in clients:
+        for name, latencies in client.latencies.items():
+            total[name].merge(latencies)
+    everything = Latencies()
+    endpoints = {}
+    print('%-8s %9s %8s %7s %9s %9s %9s' % (
+        'endpoint', 'requests', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'),
+        file=sys.stderr)
+    for name, latencies in sorted(total.items()) + [('all', everything)]:
+        if name != 'all':
+            everything.merge(latencies)
+        if not latencies.count:
+            continue
+        stats = endpoints[name] = {
+            'requests': latencies.count,
+            'per_second': round(latencies.count / elapsed, 2),
+            'errors': latencies.errors,
+            'p50_ms': round(latencies.percentile(0.5), 2),
+            'p95_ms': round(latencies.percentile(0.95), 2),
+            'p99_ms': round(latencies.percentile(0.99), 2),
+        }
+        print('%-8s %9d %8.1f %7d %9.1f %9.1f %9.1f' % (
+            name, stats['requests'], stats['per_second'], stats['errors'],
+            stats['p50_ms'], stats['p95_ms'], stats['p99_ms']), file=sys.stderr)
+
+    problems = []
+    if everything.count and everything.errors > args.max_errors * everything.count:
+        problems.append('%d of %d requests failed' % (everything.errors, everything.count))
+    checked_out = [s['checked_out'] for s in samples if s['checked_out'] is not None]
+    if checked_out and max(checked_out) >= capacity:
+        problems.append('pool exhausted: %d of %d connections checked out' % (
+            max(checked_out), capacity))
+    counted = [s for s in samples if s['checkout_count'] is not None]
+    if len(counted) > 1 and counted[-1]['checkout_count'] > counted[0]['checkout_count']:
+        wait = (counted[-1]['checkout_seconds'] - counted[0]['checkout_seconds']) * 1000 / (
+            counted[-1]['checkout_count'] - counted[0]['checkout_count'])
+        print('pool checkout wait %.2f ms on average, at most %d of %d connections '
+              'checked out' % (wait, max(checked_out or [0]), capacity), file=sys.stderr)
+        if wait > args.max_checkout_ms:
+            problems.append('requests waited %.1f ms on average for a connection' % wait)
+    memory = [s['memory_mb'] for s in samples if s['memory_mb'] is not None]
+    if len(memory) > 1:
+        print('server memory %.0f MB -> %.0f MB (peak %.0f MB)' % (
+            memory[0], memory[-1], max(memory)), file=sys.stderr)
+        if memory[-1] - memory[0] > args.max_growth:
+            problems.append('server memory grew by %.0f MB' % (memory[-1] - memory[0]))
+    for problem in problems:
+        print('FAIL %s' % problem, file=sys.stderr)
+    return {'endpoints': endpoints, 'samples': samples, 'problems': problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--warmup', type=float, default=10, help='seconds')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='endpoint=weight,... from: %s' % ', '.join(sorted(ENDPOINTS)))
+    parser.add_argument('--url', help='a server that is already running')
+    parser.add_argument('--pid', type=int, help='its pid, to sample its memory')
+    parser.add_argument('--port', type=int, default=5055,
+                        help='port of the server started here')
+    parser.add_argument('--server', default='%s -m flask run --no-reload --with-threads '
+                        '--port {port}' % sys.executable,
+                        help='command that starts the server')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between samples')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-errors', type=float, default=0.01,
+                        help='fraction of failed requests that fails the run')
+    parser.add_argument('--max-checkout-ms', type=float, default=50)
+    parser.add_argument('--max-growth', type=float, default=50, help='MB')
+    parser.add_argument('--output', '-o', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    with app.app_context():
+        ids = pick_ids()
+        pool = db.engine.pool
+        capacity = pool.size() + max(getattr(pool, '_max_overflow', 0), 0)
+
+    server = None
+    url = args.url
+    pid = args.pid
+    if url is None:
+        url = 'http://127.0.0.1:%d' % args.port
+        server = start_server(args.server.format(port=args.port), url)
+        pid = server.pid
+
+    stop = threading.Event()
+    measuring = threading.Event()
+    clients = [Client(url, args.mix, ids, args.seed + i, stop, measuring)
+               for i in range(args.clients)]
+    samples = []
+    try:
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup)
+        measuring.set()
+        started = time.time()
+        while time.time() - started < args.duration:
+            samples.append(sample(url, pid, started))
+            time.sleep(min(args.interval, max(0, args.duration - (time.time() - started))))
+        samples.append(sample(url, pid, started))
+        elapsed = time.time() - started
+        stop.set()
+        for client in clients:
+            client.join()
+    finally:
+        stop.set()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        with app.app_context():
+            removed = remove_created_shows()
+        print('removed %d created shows' % removed, file=sys.stderr)
+
+    results = report(clients, samples, args, elapsed, capacity)
+    results.update({'clients': args.clients, 'duration': elapsed,
+                    'mix': dict(args.mix), 'url': url})
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if results['problems'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
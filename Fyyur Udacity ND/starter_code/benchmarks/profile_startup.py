@@ -0,0 +1,146 @@
+"""Profile the cold start of a worker: import, create_app, first request.
+
+Starts ``--runs`` fresh interpreters, one after the other, each of which
+imports app.py, calls ``create_app()`` and handles one request for
+``--path`` through the test client, the way a web worker started without
+preload does. For each phase it reports the median time in milliseconds
+and the process RSS when the phase ends. ``--command`` times a CLI command
+(``flask <command>``, with FLASK_APP=manage.py) the same way instead.
+
+``--modules`` lists the modules with the largest cumulative import time,
+from ``python -X importtime``, to show where the import time goes. The
+results, with the commit, can be written as JSON with ``--output`` and
+compared between commits.
+
+    python benchmarks/profile_startup.py --runs 5 --modules 15
+    python benchmarks/profile_startup.py --command "counters check"
+"""
+import argparse
+import json
+import os
+import re
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from support import APP_DIR, commit
+
+# run in each fresh interpreter; prints one JSON object
+WORKER = '''
+import json, time
+started = time.perf_counter()
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.0
+
+phases = []
+def phase(name):
+    phases.append((name, (time.perf_counter() - started) * 1000, rss_mb()))
+
+import app
+phase('import')
+application = app.create_app()
+phase('create_app')
+response = application.test_client().get(%(path)r)
+response.get_data()
+phase('first_request')
+print(json.dumps({'phases': phases, 'status': response.status_code}))
+'''
+
+_importtime = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def run_worker(path):
+    output = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', WORKER % {'path': path}],
+        cwd=APP_DIR, stderr=subprocess.DEVNULL)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    phases = {}
+    previous = 0.0
+    for name, at, rss in result['phases']:
+        phases[name] = {'ms': at - previous, 'rss_mb': rss}
+        previous = at
+    phases['total'] = {'ms': previous, 'rss_mb': rss}
+    return phases, result['status']
+
+
+def run_command(command):
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-W', 'ignore', '-m', 'flask'] + shlex.split(command),
+                          cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return {'total': {'ms': (time.perf_counter() - start) * 1000, 'rss_mb': None}}, 0
+
+
+def slowest_modules(count):
+    # (cumulative ms, self ms, module) of the top-level imports of app.py
+    # and the modules they pull in, by cumulative time
+    output = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-X', 'importtime', '-c',
+         'import app; app.create_app()'],
+        cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).stderr.decode()
+    modules = []
+    for line in output.splitlines():
+        match = _importtime.match(line)
+        if match:
+            modules.append((int(match.group(2)) / 1000.0, int(match.group(1)) / 1000.0,
+                            match.group(4)))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/', help='the first request')
+    parser.add_argument('--command', help='time `flask COMMAND` instead')
+    parser.add_argument('--modules', type=int, default=0,
+                        help='list this many of the slowest imports')
+    parser.add_argument('--output', '-o', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('FLASK_APP', 'manage.py' if args.command else 'app.py')
+    runs = [run_command(args.command) if args.command else run_worker(args.path)
+            for _ in range(args.runs)]
+    status = runs[-1][1]
+    if not args.command and status != 200:
+        print('%s returned %d' % (args.path, status), file=sys.stderr)
+
+    results = {
+        'commit': commit(),
+        'created': datetime.now().isoformat(),
+        'runs': args.runs,
+        'target': 'flask %s' % args.command if args.command else 'GET %s' % args.path,
+        'phases': {},
+    }
+    print('%-14s %9s %9s %9s' % ('phase', 'median ms', 'max ms', 'rss MB'))
+    for name in runs[0][0]:
+        times = [phases[name]['ms'] for phases, _ in runs]
+        rss = runs[-1][0][name]['rss_mb']
+        results['phases'][name] = {
+            'median_ms': round(statistics.median(times), 1),
+            'max_ms': round(max(times), 1),
+            'rss_mb': round(rss, 1) if rss is not None else None,
+        }
+        print('%-14s %9.1f %9.1f %9s' % (name, statistics.median(times), max(times),
+                                         '%.1f' % rss if rss is not None else '-'))
+
+    if args.modules:
+        results['modules'] = []
+        print('\n%9s %9s  module' % ('cumul ms', 'self ms'))
+        for cumulative, own, module in slowest_modules(args.modules):
+            results['modules'].append({'module': module, 'cumulative_ms': cumulative,
+                                       'self_ms': own})
+            print('%9.1f %9.1f  %s' % (cumulative, own, module))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
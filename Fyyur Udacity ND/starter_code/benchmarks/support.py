@@ -0,0 +1,79 @@
+"""Helpers shared by the benchmark and check scripts in this directory."""
+import os
+import subprocess
+import sys
+
+# make the app modules importable when a script is run from anywhere
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from sqlalchemy import event  # noqa: E402
+
+
+def commit():
+    """The commit being measured, with a + when the tree has local changes."""
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=APP_DIR,
+                                      stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=APP_DIR,
+                                stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev + ('+' if dirty else '')
+
+
+class StatementCounter(object):
+    """Counts the statements sent to ``engine`` inside a ``with`` block.
+
+    The statements themselves and their parameters are kept in
+    ``statements`` so that they can be explained afterwards.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        self.count = 0
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def explain(session, statement, parameters, analyze=True):
+    """Run EXPLAIN on a captured statement and return its plan as a dict.
+
+    The statement goes through the session's own connection, so rows the
+    session inserted but did not commit are visible to it.
+    """
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute('EXPLAIN (%s) %s' % (options, statement), parameters)
+        return cursor.fetchone()[0][0]
+    finally:
+        cursor.close()
+
+
+def plan_nodes(plan):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan, depth first."""
+    node = plan.get('Plan', plan)
+    yield node
+    for child in node.get('Plans', ()):
+        for descendant in plan_nodes(child):
+            yield descendant
+
+
+def scans(plan):
+    """(node type, relation) for every scan node of a plan."""
+    return [(node['Node Type'], node['Relation Name'])
+            for node in plan_nodes(plan) if 'Relation Name' in node]
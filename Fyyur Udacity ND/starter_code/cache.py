@@ -0,0 +1,308 @@
+import logging
+import pickle
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+#----------------------------------------------------------------------------#
+# Cache.
+#
+# Bounded, TTL-based cache for rendered pages and the view-model dicts they
+# are built from. Keys are tuples naming the entity, e.g. ('venue', 3) or
+# ('venues',). Every entity key has a version; entries are stored under the
+# version current when they were built, and invalidating a key bumps its
+# version, so a write handled by one worker retires the entry for all of
+# them. Entries built from upcoming shows also expire when the next of those
+# shows starts, since it then moves to the past.
+#
+# Where entries live is up to the backend: LocalBackend keeps them in the
+# process, SocketBackend in a cache_server.py process shared by all workers.
+#----------------------------------------------------------------------------#
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend(object):
+    """In-process LRU store with per-entry deadlines and key versions."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # (entry key, version) -> (deadline, value)
+        self.versions = {}             # entity key -> version
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, version_key, key):
+        # returns (version, value); value is None on a miss
+        now = time.time()
+        with self.lock:
+            version = self.versions.get(version_key, 0)
+            entry = self.entries.get((key, version))
+            if entry is None:
+                return version, None
+            if entry[0] <= now:
+                del self.entries[(key, version)]
+                self.expirations += 1
+                return version, None
+            self.entries.move_to_end((key, version))
+            return version, entry[1]
+
+    def store(self, version_key, key, version, value, deadline):
+        with self.lock:
+            if self.versions.get(version_key, 0) != version:
+                # invalidated while the value was being built
+                return
+            self.entries[(key, version)] = (deadline, value)
+            self.entries.move_to_end((key, version))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def version(self, version_key):
+        with self.lock:
+            return self.versions.get(version_key, 0)
+
+    def bump(self, version_keys):
+        # returns the new versions. Entries of older versions are never
+        # looked up again and age out of the LRU.
+        with self.lock:
+            for version_key in version_keys:
+                self.versions[version_key] = self.versions.get(version_key, 0) + 1
+                self.invalidations += 1
+            return [self.versions[version_key] for version_key in version_keys]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+class SocketBackend(object):
+    """Client of a cache_server.py process, over a unix socket or TCP.
+
+    ``address`` is a filesystem path for a unix socket or a (host, port)
+    tuple. When the server cannot be reached, lookups miss and stores are
+    dropped, so the app keeps working without its cache. After a failure the
+    server is not tried again for ``retry_interval`` seconds, so a server
+    that hangs costs one ``timeout``, not one per call. Invalidations lost
+    while it was down clear it when it is back, as it may still hold the
+    entries they retired.
+    """
+
+    def __init__(self, address, timeout=0.5, retry_interval=5):
+        self.address = address
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.local = threading.local()
+        self.down_until = 0
+        self.lost_invalidations = False
+
+    def _connection(self):
+        sock = getattr(self.local, 'sock', None)
+        if sock is None:
+            family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            self.local.sock = sock
+            if self.lost_invalidations:
+                self.lost_invalidations = False
+                send_message(sock, ('clear', ()))
+                recv_message(sock)
+        return sock
+
+    def _call(self, op, *args):
+        if self.down_until > time.time():
+            raise CacheUnavailable('down until the next retry')
+        try:
+            sock = self._connection()
+            send_message(sock, (op, args))
+            return recv_message(sock)
+        except (OSError, EOFError, pickle.PickleError) as e:
+            sock = getattr(self.local, 'sock', None)
+            if sock is not None:
+                sock.close()
+                self.local.sock = None
+            self.down_until = time.time() + self.retry_interval
+            logger.warning('cache server %s unavailable, retrying in %ds: %s',
+                           self.address, self.retry_interval, e)
+            raise CacheUnavailable(e)
+
+    def lookup(self, version_key, key):
+        try:
+            return self._call('lookup', version_key, key)
+        except CacheUnavailable:
+            return None, None
+
+    def store(self, version_key, key, version, value, deadline):
+        if version is None:
+            return
+        try:
+            self._call('store', version_key, key, version, value, deadline)
+        except CacheUnavailable:
+            pass
+
+    def version(self, version_key):
+        # None while the server cannot be reached
+        try:
+            return self._call('version', version_key)
+        except CacheUnavailable:
+            return None
+
+    def bump(self, version_keys):
+        try:
+            return self._call('bump', version_keys)
+        except CacheUnavailable:
+            self.lost_invalidations = True
+            return None
+
+    def clear(self):
+        try:
+            self._call('clear')
+        except CacheUnavailable:
+            pass
+
+    def close(self):
+        # drops this thread's connection, e.g. before the process forks
+        sock = getattr(self.local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self.local.sock = None
+
+    def stats(self):
+        try:
+            return self._call('stats')
+        except CacheUnavailable:
+            return {"unavailable": True}
+
+
+class CacheUnavailable(Exception):
+    pass
+
+
+# messages between SocketBackend and cache_server.py: a 4-byte length, then
+# a pickle. Only ever exchange them with a server you run yourself.
+
+def send_message(sock, message):
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack('!I', len(payload)) + payload)
+
+
+def recv_message(sock):
+    size = struct.unpack('!I', _recv_exactly(sock, 4))[0]
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class Cache(object):
+
+    def __init__(self, name, backend, ttl=300):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        # build() returns (value, expires_at); expires_at is an optional
+        # datetime after which the value is stale even if its ttl has not
+        # run out yet
+        version, value = self.lookup(key)
+        if value is None:
+            value, expires_at = build()
+            self.store(key, version, value, expires_at)
+        return value
+
+    def lookup(self, key):
+        # (version of key, value or None); the version is the one to store
+        # a value built after a miss under
+        version, value = self.backend.lookup(key, (self.name,) + key)
+        if value is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return version, value
+
+    def store(self, key, version, value, expires_at=None):
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, time.time() +
+                           (expires_at - datetime.now()).total_seconds())
+        self.backend.store(key, (self.name,) + key, version, value, deadline)
+
+    def stats(self):
+        # hits and misses are this worker's, the rest is the backend's
+        stats = {"hits": self.hits, "misses": self.misses}
+        stats.update(self.backend.stats())
+        return stats
+
+
+_local = LocalBackend()
+views = Cache('views', _local)
+pages = Cache('pages', _local)
+
+CACHES = {
+    'views': views,
+    'pages': pages,
+}
+
+
+def parse_address(address):
+    # "/path/to.sock" for a unix socket, "host:port" for TCP
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def configure(max_entries, ttl, backend='local', address=None):
+    # backend: 'local' for a store in each process, 'socket' for one
+    # cache_server.py at ``address`` shared by every worker. The caches share
+    # the backend, so invalidating a key covers its page and its view model.
+    if backend == 'socket':
+        shared = SocketBackend(parse_address(address))
+    elif backend == 'local':
+        shared = LocalBackend(max_entries)
+    else:
+        raise ValueError('unknown cache backend %r' % backend)
+    for store in CACHES.values():
+        store.backend = shared
+        store.ttl = ttl
+
+
+def version(key):
+    # current version of an entity key; None when the backend cannot tell
+    return pages.backend.version(key)
+
+
+def invalidate(*keys):
+    # returns the new versions of the keys, or None when the backend is down
+    return pages.backend.bump(keys)
@@ -0,0 +1,106 @@
+"""Shared cache server for multi-worker deployments.
+
+Holds one cache.LocalBackend and serves it to the SocketBackend of every
+worker, over a unix socket or TCP. Run one next to the app server:
+
+    python cache_server.py --address /tmp/fyyur-cache.sock --max-entries 100000
+
+and set CACHE_BACKEND = 'socket' and CACHE_ADDRESS in config.py. The
+protocol uses pickle, so only bind it to a unix socket or a local port.
+"""
+import argparse
+import os
+import socket
+import socketserver
+import threading
+
+from cache import LocalBackend, parse_address, recv_message, send_message
+
+OPERATIONS = ('lookup', 'store', 'version', 'bump', 'clear', 'stats')
+
+
+class CacheRequestHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        with self.server.lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.request)
+
+    def handle(self):
+        # one connection per worker thread, many requests per connection
+        while True:
+            try:
+                op, args = recv_message(self.request)
+            except (EOFError, OSError):
+                return
+            if op not in OPERATIONS:
+                send_message(self.request, None)
+                continue
+            send_message(self.request, getattr(self.server.backend, op)(*args))
+
+
+class ConnectionsMixIn(socketserver.ThreadingMixIn):
+    daemon_threads = True
+
+    def server_close(self):
+        # also end the connections the workers keep open, as a server
+        # process that exits would
+        super().server_close()
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class UnixCacheServer(ConnectionsMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class TCPCacheServer(ConnectionsMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+def make_server(address, max_entries=100000):
+    address = parse_address(address)
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixCacheServer(address, CacheRequestHandler)
+    else:
+        server = TCPCacheServer(address, CacheRequestHandler)
+    server.backend = LocalBackend(max_entries)
+    server.connections = set()
+    server.lock = threading.Lock()
+    return server
+
+
+def serve_in_thread(address, max_entries=100000):
+    """Start a server on a background thread, e.g. as a stand-in in tests
+    and benchmarks. Stop it with server.shutdown(), then server.server_close()
+    to drop the workers' connections."""
+    server = make_server(address, max_entries)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--address', default='/tmp/fyyur-cache.sock',
+                        help='unix socket path or host:port')
+    parser.add_argument('--max-entries', type=int, default=100000)
+    args = parser.parse_args()
+    server = make_server(args.address, args.max_entries)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import time
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from models import db
+import database
+
+
+#----------------------------------------------------------------------------#
+# Counters.
+#
+# Venue and Artist carry upcoming_shows_count, past_shows_count and
+# next_show_at so that listing pages read them instead of counting Show
+# rows. Creating a show adds it to them in the same transaction, deleting
+# one recounts its venue and artist; when a show starts it moves from
+# upcoming to past, which `flask counters rollover` catches up on, from the
+# next_show_at of the rows, and should be run periodically (e.g. every
+# minute from cron). `flask counters check` recomputes every counter and
+# reports drift. Every change to the counters also bumps updated_at, as the
+# pages of the row change with them.
+#----------------------------------------------------------------------------#
+
+# (table, column of Show pointing at it)
+OWNERS = (('Venue', 'venue_id'), ('Artist', 'artist_id'))
+
+APPLY_SHOW = '''
+UPDATE "%(table)s" SET
+    upcoming_shows_count = upcoming_shows_count
+        + CASE WHEN s.start_time >= :now THEN :delta ELSE 0 END,
+    past_shows_count = past_shows_count
+        + CASE WHEN s.start_time < :now THEN :delta ELSE 0 END,
+    updated_at = :now
+FROM "Show" s
+WHERE s.id = :show_id AND "%(table)s".id = s.%(column)s
+'''
+
+ADD_NEXT_SHOW = '''
+UPDATE "%(table)s" SET next_show_at = LEAST(next_show_at, s.start_time)
+FROM "Show" s
+WHERE s.id = :show_id AND "%(table)s".id = s.%(column)s AND s.start_time >= :now
+'''
+
+# live values of the counters, for the owners selected by %(where)s
+ACTUAL = '''
+SELECT o.id,
+       count(s.id) FILTER (WHERE s.start_time >= :now) AS upcoming_shows_count,
+       count(s.id) FILTER (WHERE s.start_time < :now) AS past_shows_count,
+       min(s.start_time) FILTER (WHERE s.start_time >= :now) AS next_show_at
+FROM "%(table)s" o LEFT JOIN "Show" s ON s.%(column)s = o.id
+WHERE %(where)s
+GROUP BY o.id
+'''
+
+RECOMPUTE = '''
+UPDATE "%(table)s" SET
+    upcoming_shows_count = a.upcoming_shows_count,
+    past_shows_count = a.past_shows_count,
+    next_show_at = a.next_show_at,
+    updated_at = :now
+FROM (''' + ACTUAL + ''') a
+WHERE "%(table)s".id = a.id
+'''
+
+
+def record_show(show_id, now=None):
+    # call after the new show is flushed, before the commit
+    params = {'show_id': show_id, 'now': now or datetime.now(), 'delta': 1}
+    for table, column in OWNERS:
+        names = {'table': table, 'column': column}
+        db.session.execute(text(APPLY_SHOW % names), params)
+        db.session.execute(text(ADD_NEXT_SHOW % names), params)
+
+
+def forget_show(venue_id, artist_id, now=None):
+    # call after the delete of the show is flushed, in the same transaction.
+    # A delta would be wrong when a show of the row started since the last
+    # rollover: the row still counts it as upcoming, and its next_show_at is
+    # what tells rollover to recount it. So the two rows are recounted.
+    recount([venue_id], [artist_id], now)
+
+
+def recount(venue_ids=(), artist_ids=(), now=None):
+    # recompute the counters of the given rows from Show, for writes that
+    # bypass record_show (bulk inserts); the caller commits
+    params = {'now': now or datetime.now()}
+    for (table, column), ids in zip(OWNERS, (venue_ids, artist_ids)):
+        if ids:
+            db.session.execute(text(RECOMPUTE % {
+                'table': table, 'column': column, 'where': 'o.id = ANY(:ids)'}),
+                dict(params, ids=list(ids)))
+
+
+def rollover(now=None):
+    # recount the venues and artists whose next show has started since
+    # they were last counted; returns how many rows were updated
+    params = {'now': now or datetime.now()}
+    updated = 0
+    for table, column in OWNERS:
+        result = db.session.execute(text(RECOMPUTE % {
+            'table': table, 'column': column,
+            'where': 'o.next_show_at < :now'}), params)
+        updated += result.rowcount
+    db.session.commit()
+    return updated
+
+
+def check(now=None, repair=False):
+    # returns (table, id, stored, actual) for every row whose counters drifted
+    params = {'now': now or datetime.now()}
+    drift = []
+    for table, column in OWNERS:
+        rows = db.session.execute(text('''
+            SELECT o.id, o.upcoming_shows_count, o.past_shows_count, o.next_show_at,
+                   a.upcoming_shows_count, a.past_shows_count, a.next_show_at
+            FROM "%(table)s" o JOIN (''' % {'table': table} + ACTUAL % {
+                'table': table, 'column': column, 'where': 'true'} + ''') a
+            ON a.id = o.id
+            WHERE (o.upcoming_shows_count, o.past_shows_count, o.next_show_at)
+                  IS DISTINCT FROM
+                  (a.upcoming_shows_count, a.past_shows_count, a.next_show_at)
+            ORDER BY o.id'''), params)
+        ids = []
+        for row in rows:
+            ids.append(row[0])
+            drift.append((table, row[0], tuple(row[1:4]), tuple(row[4:7])))
+        if repair and ids:
+            db.session.execute(text(RECOMPUTE % {
+                'table': table, 'column': column, 'where': 'o.id = ANY(:ids)'}),
+                dict(params, ids=ids))
+    if repair:
+        db.session.commit()
+    return drift
+
+
+cli = AppGroup('counters', help='Maintain the denormalized show counters.')
+
+
+@cli.command('rollover')
+@click.option('--every', type=int, default=0,
+              help='Keep running, rolling over every this many seconds.')
+def rollover_command(every):
+    """Move started shows from the upcoming to the past counters."""
+    database.command_line()
+    while True:
+        click.echo('rolled over %d venues and artists' % rollover())
+        if not every:
+            break
+        time.sleep(every)
+
+
+@cli.command('check')
+@click.option('--repair', is_flag=True, help='Rewrite the counters that drifted.')
+def check_command(repair):
+    """Recompute every counter and report the ones that drifted."""
+    database.command_line()
+    drift = check(repair=repair)
+    for table, entity_id, stored, actual in drift:
+        click.echo('%s %d: stored %r, actual %r' % (table, entity_id, stored, actual))
+    click.echo('%d rows drifted%s' % (len(drift), ', repaired' if repair and drift else ''))
+    if drift and not repair:
+        raise SystemExit(1)
@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+
+from flask import current_app, has_request_context
+from sqlalchemy import event
+
+from models import db
+
+
+#----------------------------------------------------------------------------#
+# Database connections.
+#
+# Every engine (the primary, the replicas, the async engine of asgi.py) gets
+# the pool of DB_POOL_*: a few connections kept open per process, a bounded
+# overflow, and a short wait for a free connection, after which the request
+# fails with a 503 instead of queueing behind the others. Connections are
+# tested on checkout (DB_POOL_PRE_PING) and replaced after DB_POOL_RECYCLE
+# seconds, before a server or firewall idle timeout cuts them.
+#
+# Statements of the web requests are cancelled by Postgres after
+# DB_STATEMENT_TIMEOUT_MS, so that a slow query gives its connection back.
+# The setting goes with the connection, or, behind PgBouncer (DB_PGBOUNCER),
+# with each transaction of a request (SET LOCAL): in transaction pooling
+# mode the server connection is someone else's after the commit, so nothing
+# may be left on it, and no prepared statements may outlive a transaction.
+# The command line runs without a timeout: the app of manage.py and of the
+# bulk scripts (COMMAND_LINE), and the flask commands, which call
+# command_line() as they start, also when FLASK_APP is app.py.
+#
+# Writes go through transaction(), which commits or rolls back and always
+# gives the connection back to the pool when the block ends.
+#----------------------------------------------------------------------------#
+
+
+def engine_options(config, command_line=False):
+    # SQLALCHEMY_ENGINE_OPTIONS for the app's config
+    options = {
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', False),
+        # reuse the most recently returned connection first, so that the
+        # ones a burst opened go idle and are recycled
+        'pool_use_lifo': True,
+    }
+    timeout = 0 if command_line else config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout and not config.get('DB_PGBOUNCER'):
+        # PgBouncer refuses startup options
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % timeout}
+    return options
+
+
+def async_engine_options(config):
+    # create_async_engine() options for async_views.py; the asyncpg
+    # counterparts of engine_options()
+    options = engine_options(config)
+    options.update(pool_size=config.get('ASYNC_POOL_SIZE', 10),
+                   max_overflow=config.get('ASYNC_MAX_OVERFLOW', 10),
+                   connect_args={})
+    timeout = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if config.get('DB_PGBOUNCER'):
+        # no prepared statements kept for later, by asyncpg or by the
+        # dialect; the timeout is kept by the client, which cancels the
+        # statement
+        options['connect_args'].update(statement_cache_size=0,
+                                       prepared_statement_cache_size=0)
+        if timeout:
+            options['connect_args']['command_timeout'] = timeout / 1000.0
+    elif timeout:
+        options['connect_args']['server_settings'] = {'statement_timeout': str(timeout)}
+    return options
+
+
+def command_line():
+    # called by the flask commands as they start: when the app was created
+    # for the web (FLASK_APP=app.py), the connections they open from now on
+    # go without the statement timeout
+    options = current_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    if 'options' not in options.get('connect_args', {}):
+        return
+    engine = db.engine
+    if not event.contains(engine, 'do_connect', _without_timeout):
+        event.listen(engine, 'do_connect', _without_timeout)
+        engine.dispose()
+
+
+def _without_timeout(dialect, connection_record, cargs, cparams):
+    cparams.pop('options', None)
+
+
+@contextmanager
+def transaction():
+    # with transaction(): ... commits the session at the end of the block,
+    # or rolls it back and re-raises when the block fails; either way the
+    # session is closed and its connection back in the pool
+    try:
+        yield db.session
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def init_app(app, *engines):
+    timeout = app.config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if not (timeout and app.config.get('DB_PGBOUNCER')):
+        return
+
+    def set_local_timeout(conn):
+        if has_request_context():
+            # on the DBAPI cursor, so that the request's statement counts
+            # only include its own statements
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute('SET LOCAL statement_timeout = %d' % timeout)
+            finally:
+                cursor.close()
+
+    for engine in engines:
+        event.listen(engine, 'begin', set_local_timeout)
@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from models import db, Venue, Artist, Show
+import database
+
+
+#----------------------------------------------------------------------------#
+# Export.
+#
+# Dumps of Venue, Artist and Show for analytics, as NDJSON or CSV, behind
+# /export/<entity>.<format> and `flask export <entity>`. Rows come from a
+# server-side cursor batch_size at a time and are serialized by generators,
+# so neither the web worker nor the CLI ever holds a whole table.
+#
+# ?since=<id> exports the rows added after that id, in id order;
+# ?since=<ISO timestamp> the rows added or changed after that time, in
+# updated_at order. Deleted rows are not reported.
+#----------------------------------------------------------------------------#
+
+ENTITIES = {
+    'venues': Venue,
+    'artists': Artist,
+    'shows': Show,
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+BATCH_SIZE = 1000
+
+# serialized rows are sent in chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+
+# CSV cells holding several values separate them with this, as the importer
+# expects
+LIST_SEPARATOR = ','
+
+
+def columns(entity):
+    return [column.name for column in ENTITIES[entity].__table__.columns]
+
+
+def parse_since(value):
+    # an id or an ISO timestamp; raises ValueError for anything else
+    if value.isdigit():
+        return int(value)
+    return datetime.fromisoformat(value)
+
+
+def iter_rows(entity, since=None, batch_size=BATCH_SIZE):
+    model = ENTITIES[entity]
+    query = db.session.query(*model.__table__.columns)
+    if isinstance(since, datetime):
+        query = query.filter(model.updated_at > since).order_by(model.updated_at, model.id)
+    else:
+        if since is not None:
+            query = query.filter(model.id > since)
+        query = query.order_by(model.id)
+    return query.yield_per(batch_size)
+
+
+def _json_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return LIST_SEPARATOR.join(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def ndjson_lines(rows, names):
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), default=_json_value) + '\n'
+
+
+def csv_lines(rows, names):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        # one line at a time keeps the buffer small
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    # joins many short lines into fewer, larger writes
+    parts = []
+    length = 0
+    for line in lines:
+        parts.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield ''.join(parts)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(entity, format, since=None, gzip=False, batch_size=BATCH_SIZE):
+    # generator of the encoded dump, ready to be written or streamed
+    names = columns(entity)
+    rows = iter_rows(entity, since, batch_size)
+    lines = ndjson_lines(rows, names) if format == 'ndjson' else csv_lines(rows, names)
+    chunks = (chunk.encode('utf-8') for chunk in chunked(lines))
+    return gzipped(chunks) if gzip else chunks
+
+
+cli = AppGroup('export', help='Export venues, artists and shows.')
+
+
+def _export_command(entity):
+    @cli.command(entity, help='Write every %s row, or those after --since, to --output.' % entity[:-1])
+    @click.option('--format', type=click.Choice(sorted(FORMATS)), default='ndjson',
+                  show_default=True)
+    @click.option('--since', help='Only export rows with a greater id, or changed '
+                  'after this ISO timestamp.')
+    @click.option('--gzip', is_flag=True, help='Compress the output.')
+    @click.option('--output', '-o', type=click.File('wb'), default='-',
+                  help='Where to write the dump. Defaults to stdout.')
+    def command(format, since, gzip, output):
+        database.command_line()
+        try:
+            since = parse_since(since) if since else None
+        except ValueError:
+            raise click.BadParameter('expected an id or an ISO timestamp',
+                                     param_hint='--since')
+        for chunk in export(entity, format, since, gzip):
+            output.write(chunk)
+        output.flush()
+    return command
+
+
+for _entity in ENTITIES:
+    _export_command(_entity)
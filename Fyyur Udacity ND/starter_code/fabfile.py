@@ -5,9 +5,16 @@ from fabric.contrib.console import confirm
 
 
 def test():
+    # query budgets and plans of every route, the show counters and the
+    # routing of reads to replicas; needs a database seeded with
+    # benchmarks/generate_data.py
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python benchmarks/check_query_counts.py && "
+            "python benchmarks/check_query_plans.py && "
+            "python benchmarks/check_counters.py && "
+            "python benchmarks/check_replicas.py && "
+            "python benchmarks/check_shared_cache.py", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
@@ -40,7 +47,7 @@ def heroku():
 
 def heroku_test():
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python benchmarks/check_query_counts.py"
     )
 
 
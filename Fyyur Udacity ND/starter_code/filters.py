@@ -0,0 +1,66 @@
+from datetime import datetime
+from functools import lru_cache
+
+
+#----------------------------------------------------------------------------#
+# Filters.
+#
+# Template filters registered on the app's jinja environment in app.py.
+# Babel, with its locale data, and dateutil are imported the first time a
+# filter needs them, so that processes which never render a page (the CLI
+# commands) do not load them.
+#----------------------------------------------------------------------------#
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+# babel's own named formats; those not overridden above are the locale's
+# date and time formats joined by its datetime format, and are left to babel
+BABEL_FORMATS = ('short', 'medium', 'long', 'full')
+
+LOCALE = 'en_US'
+
+
+@lru_cache(maxsize=None)
+def locale():
+    from babel import Locale
+    return Locale.parse(LOCALE)
+
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format):
+    # named formats of DATETIME_FORMATS and raw babel patterns are each
+    # parsed only once
+    import babel.dates
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+
+def _format_datetime(value, format):
+    if format in BABEL_FORMATS and format not in DATETIME_FORMATS:
+        import babel.dates
+        return babel.dates.format_datetime(value, format, locale=locale())
+    return datetime_pattern(format).apply(value, locale())
+
+
+# show times repeat a lot across list pages (same slot, many venues), so
+# recent results are memoized; configure_datetime_cache(0) turns that off
+_format_datetime_cached = lru_cache(maxsize=4096)(_format_datetime)
+
+
+def configure_datetime_cache(size):
+    global _format_datetime_cached
+    if size:
+        _format_datetime_cached = lru_cache(maxsize=size)(_format_datetime)
+    else:
+        _format_datetime_cached = _format_datetime
+
+
+def format_datetime(value, format='medium'):
+    # accepts datetime objects as well as the date strings older templates
+    # and callers pass in
+    if not isinstance(value, datetime):
+        import dateutil.parser
+        value = dateutil.parser.parse(value)
+    return _format_datetime_cached(value, format)
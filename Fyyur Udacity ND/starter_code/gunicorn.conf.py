@@ -0,0 +1,48 @@
+import gc
+import multiprocessing
+import os
+
+
+#----------------------------------------------------------------------------#
+# Gunicorn.
+#
+# gunicorn -c gunicorn.conf.py wsgi:application
+#
+# Every setting can be overridden from the environment, as named below.
+# kill -HUP <master> starts new workers with the same code and retires the
+# old ones once they finish their requests; since the app is preloaded,
+# deploying new code takes kill -USR2 <master> (a new master) followed by
+# kill -QUIT <old master>.
+#----------------------------------------------------------------------------#
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+
+# processes, and threads per process: a thread waiting on Postgres gives
+# the GIL to the others. Keep threads at or below the DB pool size.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# import the app once in the master and fork the workers from it
+preload_app = True
+
+# recycle a worker after this many requests, give or take the jitter so
+# that they do not all restart at once; bounds the effect of slow leaks
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# seconds: a worker silent for longer is killed; on a reload or a recycle
+# a worker gets graceful_timeout to finish its requests
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+
+def when_ready(server):
+    # runs in the master once the app is loaded: objects that exist now are
+    # left out of garbage collection, which would otherwise write to their
+    # pages and undo the copy-on-write sharing in every worker
+    gc.freeze()
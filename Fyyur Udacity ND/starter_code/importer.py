@@ -0,0 +1,306 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from werkzeug.datastructures import MultiDict
+from wtforms.validators import DataRequired, InputRequired
+
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show
+import autocomplete
+import cache
+import counters
+import database
+
+
+#----------------------------------------------------------------------------#
+# Import.
+#
+# Bulk loading of venues, artists and shows from CSV or NDJSON files:
+#
+#     flask import venues venues.csv --rejects venues.rejects.ndjson
+#
+# Rows are read one at a time, validated with the same forms the create
+# pages use, and written batch_size at a time, each batch in its own
+# transaction, so memory stays bounded whatever the size of the file.
+# Rows that fail validation, lack a required field (which the forms would
+# fill in with its default) or reference a venue or artist that does not
+# exist go to the rejects file instead: one JSON object per line, with the
+# line number, the errors and the row as read. The rejects of a batch are
+# written in line order when the batch is.
+#
+# Each batch invalidates the cached pages it changes and the version of the
+# autocomplete index of its entity, so running web workers reload the index
+# on their next lookup and see the new names.
+#----------------------------------------------------------------------------#
+
+BATCH_SIZE = 5000
+
+# (model, form, columns in the order they are copied); the fields the form
+# requires, and the ids of a show, must be in every row
+ENTITIES = {
+    'venues': (Venue, VenueForm, (
+        'name', 'city', 'state', 'address', 'phone', 'image_link', 'genres',
+        'facebook_link', 'website', 'seeking_talent', 'seeking_description')),
+    'artists': (Artist, ArtistForm, (
+        'name', 'city', 'state', 'phone', 'image_link', 'genres',
+        'facebook_link', 'website', 'seeking_venue', 'seeking_description')),
+    'shows': (Show, ShowForm, ('artist_id', 'venue_id', 'start_time')),
+}
+
+# CSV cells holding several values separate them with this
+LIST_SEPARATOR = ','
+
+# NDJSON values the forms read as an unchecked BooleanField
+FALSE_VALUES = (False, None, 'false', '')
+
+
+def read_rows(path, format=None):
+    # yields (line number, row dict, error); error is set for lines that
+    # could not be parsed at all
+    format = format or ('csv' if path.endswith('.csv') else 'ndjson')
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, line.rstrip('\n'), 'invalid JSON: %s' % e
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, row, 'expected a JSON object'
+                    continue
+                yield line_number, row, None
+
+
+def to_formdata(row, list_fields):
+    # CSV gives strings, NDJSON gives JSON values; the forms want what a
+    # browser would post
+    formdata = MultiDict()
+    for key, value in row.items():
+        if key is None:
+            continue
+        if key in list_fields:
+            if isinstance(value, str):
+                value = [part.strip() for part in value.split(LIST_SEPARATOR)]
+            for part in value or ():
+                if part:
+                    formdata.add(key, str(part))
+        elif isinstance(value, bool) or value is None:
+            if value not in FALSE_VALUES:
+                formdata.add(key, 'y')
+        else:
+            formdata.add(key, str(value))
+    return formdata
+
+
+class Importer(object):
+    """Validates rows of one entity and writes them to the database in batches.
+
+    ``method`` is 'copy' to load each batch with COPY, or 'insert' for a
+    multi-row INSERT.
+    """
+
+    def __init__(self, entity, rejects=None, batch_size=BATCH_SIZE, method='copy'):
+        self.model, form_class, self.columns = ENTITIES[entity]
+        self.entity = entity
+        self.rejects = rejects
+        self.batch_size = batch_size
+        self.method = method
+        # one form, reprocessed for every row, instead of binding all of its
+        # fields again each time
+        self.form = form_class(formdata=None, meta={'csrf': False})
+        self.list_fields = set(name for name, field in self.form._fields.items()
+                               if field.type == 'SelectMultipleField')
+        self.required = [name for name, field in self.form._fields.items()
+                         if any(isinstance(validator, (DataRequired, InputRequired))
+                                for validator in field.validators)]
+        if self.model is Show:
+            self.required = ['artist_id', 'venue_id'] + self.required
+        self.batch = []
+        # (line number, row, errors) of the rows rejected since the last
+        # flush, written with the batch so that the file stays in line order
+        self.pending_rejects = []
+        self.imported = 0
+        self.rejected = 0
+
+    def validate(self, row):
+        # returns (values, None) or (None, errors)
+        self.form.process(to_formdata(row, self.list_fields))
+        missing = dict((name, ['This field is required.']) for name in self.required
+                       if not any(self.form[name].raw_data or ()))
+        if missing:
+            return None, missing
+        if not self.form.validate():
+            return None, self.form.errors
+        data = self.form.data
+        values = dict((column, data[column]) for column in self.columns)
+        if self.model is Show:
+            try:
+                values['artist_id'] = int(values['artist_id'])
+                values['venue_id'] = int(values['venue_id'])
+            except (TypeError, ValueError):
+                return None, {'artist_id': ['Not a valid id.'], 'venue_id': ['Not a valid id.']}
+        return values, None
+
+    def add(self, line_number, row, error=None):
+        if error is None:
+            values, errors = self.validate(row)
+        else:
+            values, errors = None, {'row': [error]}
+        if errors:
+            self.reject(line_number, row, errors)
+        else:
+            self.batch.append((line_number, row, values))
+        if len(self.batch) + len(self.pending_rejects) >= self.batch_size:
+            self.flush()
+
+    def reject(self, line_number, row, errors):
+        self.rejected += 1
+        self.pending_rejects.append((line_number, row, errors))
+
+    def write_rejects(self):
+        rejects, self.pending_rejects = self.pending_rejects, []
+        if self.rejects is not None:
+            for line_number, row, errors in sorted(rejects, key=lambda reject: reject[0]):
+                self.rejects.write(json.dumps({
+                    'line': line_number, 'errors': errors, 'row': row}, default=str) + '\n')
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if batch and self.model is Show:
+            batch = self.check_references(batch)
+        self.write_rejects()
+        if not batch:
+            return
+        rows = [values for line_number, row, values in batch]
+        now = datetime.now()
+        for values in rows:
+            values['updated_at'] = now
+        try:
+            if self.method == 'copy':
+                self.copy(rows)
+            else:
+                db.session.execute(self.model.__table__.insert(), rows)
+            if self.model is Show:
+                venue_ids = set(values['venue_id'] for values in rows)
+                artist_ids = set(values['artist_id'] for values in rows)
+                counters.recount(venue_ids, artist_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.imported += len(rows)
+        if self.model is Show:
+            cache.invalidate(('venues',), *(
+                [('venue', venue_id) for venue_id in venue_ids] +
+                [('artist', artist_id) for artist_id in artist_ids]))
+        else:
+            cache.invalidate((self.entity,), autocomplete.INDEXES[self.entity[:-1]].version_key)
+
+    def check_references(self, batch):
+        # one lookup per batch for the venues and artists the shows point at
+        found = {}
+        for model, column in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+            ids = list(set(values[column] for line_number, row, values in batch))
+            found[column] = set(row[0] for row in db.session.execute(
+                text('SELECT id FROM "%s" WHERE id = ANY(:ids)' % model.__tablename__),
+                {'ids': ids}))
+        valid = []
+        for line_number, row, values in batch:
+            errors = dict((column, ['No such %s.' % column[:-3]])
+                          for column in ('venue_id', 'artist_id')
+                          if values[column] not in found[column])
+            if errors:
+                self.reject(line_number, row, errors)
+            else:
+                valid.append((line_number, row, values))
+        return valid
+
+    def copy(self, rows):
+        columns = self.columns + ('updated_at',)
+        buf = io.StringIO()
+        for values in rows:
+            buf.write('\t'.join(copy_value(values[column]) for column in columns))
+            buf.write('\n')
+        buf.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert('COPY "%s" (%s) FROM STDIN' % (
+            self.model.__tablename__, ', '.join(columns)), buf)
+
+
+def _escape(value):
+    # COPY text format
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return _escape('{%s}' % ','.join(
+            '"%s"' % item.replace('\\', '\\\\').replace('"', '\\"') for item in value))
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(' ')
+    return _escape(str(value))
+
+
+def import_file(entity, path, format=None, rejects=None,
+                batch_size=BATCH_SIZE, method='copy'):
+    importer = Importer(entity, rejects, batch_size, method)
+    for line_number, row, error in read_rows(path, format):
+        importer.add(line_number, row, error)
+    importer.flush()
+    return importer.imported, importer.rejected
+
+
+cli = AppGroup('import', help='Bulk import venues, artists and shows.')
+
+
+def _import_command(entity):
+    @cli.command(entity, help='Import %s from a CSV or NDJSON file.' % entity)
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', type=click.Choice(['csv', 'ndjson']),
+                  help='Defaults to csv for .csv files and ndjson otherwise.')
+    @click.option('--rejects', type=click.Path(dir_okay=False),
+                  help='Where to write the rejected rows. Defaults to PATH with its '
+                  'extension replaced by .rejects.ndjson.')
+    @click.option('--batch-size', type=int, default=BATCH_SIZE, show_default=True,
+                  help='Rows per transaction.')
+    @click.option('--method', type=click.Choice(['copy', 'insert']), default='copy',
+                  show_default=True)
+    def command(path, format, rejects, batch_size, method):
+        database.command_line()
+        rejects = rejects or os.path.splitext(path)[0] + '.rejects.ndjson'
+        start = time.perf_counter()
+        with open(rejects, 'w', encoding='utf-8') as rejects_file:
+            imported, rejected = import_file(entity, path, format, rejects_file,
+                                             batch_size, method)
+        elapsed = time.perf_counter() - start
+        click.echo('imported %d %s, rejected %d in %.1fs (%.0f rows/s)' % (
+            imported, entity, rejected, elapsed,
+            (imported + rejected) / elapsed if elapsed else 0))
+        if rejected:
+            click.echo('rejected rows written to %s' % rejects)
+        else:
+            os.remove(rejects)
+    return command
+
+
+for _entity in ENTITIES:
+    _import_command(_entity)
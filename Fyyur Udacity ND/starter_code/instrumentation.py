@@ -0,0 +1,113 @@
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+#----------------------------------------------------------------------------#
+# SQL instrumentation.
+#
+# With SQL_INSTRUMENTATION on, every statement a request sends is counted
+# and timed through SQLAlchemy engine events, and grouped by fingerprint:
+# the statement with its literals and IN lists replaced by placeholders. A
+# fingerprint repeated SQL_N_PLUS_ONE_THRESHOLD times or more in a single
+# request is the signature of an N+1 (one query per row of an earlier
+# query) and is logged as a warning. Every response gets a Server-Timing
+# header with the statement count and DB time.
+#
+# With it off, nothing is registered, so requests pay nothing for it.
+# Statements sent while a response is being streamed happen after the
+# headers are out; they are missing from Server-Timing but not from the
+# log.
+#----------------------------------------------------------------------------#
+
+_params = re.compile(r'%\(\w+\)s|%s')
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_spaces = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement):
+    # SQLAlchemy sends bound parameters, so most statements already are
+    # their own shape; literals and IN lists cover the rest
+    shape = _params.sub('?', statement)
+    shape = _literals.sub('?', shape)
+    shape = _in_lists.sub('IN (...)', shape)
+    return _spaces.sub(' ', shape).strip()
+
+
+class RequestQueries(object):
+    """Statements sent while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.started = time.perf_counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count >= threshold]
+
+    def server_timing(self):
+        return 'db;dur=%.1f;desc="%d statements", app;dur=%.1f' % (
+            self.duration * 1000, self.count,
+            (time.perf_counter() - self.started) * 1000)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'].pop()
+    if has_request_context():
+        queries = getattr(g, 'sql_queries', None)
+        if queries is not None:
+            queries.record(statement, time.perf_counter() - start)
+
+
+def listen(engine):
+    # count the statements of ``engine`` too; init_app does it for the
+    # engines of Flask-SQLAlchemy
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_app(app, *engines):
+    if not app.config.get('SQL_INSTRUMENTATION'):
+        return
+    threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5)
+    for engine in engines:
+        listen(engine)
+
+    @app.before_request
+    def start_sql_queries():
+        g.sql_queries = RequestQueries()
+
+    @app.after_request
+    def report_sql_queries(response):
+        queries = getattr(g, 'sql_queries', None)
+        if queries is not None:
+            response.headers['Server-Timing'] = queries.server_timing()
+        return response
+
+    @app.teardown_request
+    def log_sql_queries(exc):
+        queries = g.pop('sql_queries', None)
+        if queries is not None:
+            for shape, count in queries.repeated(threshold):
+                app.logger.warning('possible N+1 on %s %s: %d x %s',
+                                   request.method, request.path, count, shape[:200])
+            app.logger.debug('%s %s: %d statements, %.1f ms in the database',
+                             request.method, request.path, queries.count,
+                             queries.duration * 1000)
@@ -0,0 +1,15 @@
+"""The entry point of the flask commands, `flask run` aside.
+
+    export FLASK_APP=manage.py
+    flask db upgrade
+    flask counters rollover
+
+The app it loads has COMMAND_LINE set: its connections run without the
+statement timeout of the web requests. The commands also work with
+FLASK_APP=app.py, which `flask run` takes, like the web entry points wsgi.py
+and asgi.py: `flask db` as is, and the commands of the app lift the timeout
+off their own connections (database.command_line).
+"""
+from app import create_app
+
+app = create_app({'COMMAND_LINE': True})
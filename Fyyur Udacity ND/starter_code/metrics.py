@@ -0,0 +1,308 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+
+import cache
+import filters
+
+
+#----------------------------------------------------------------------------#
+# Metrics.
+#
+# Request latency, requests in flight, DB pool checkouts and connection
+# churn, template render times and cache hit counts, served at /metrics in
+# the Prometheus text
+# format. Every thread records into its own shard of each metric, so the
+# request path never takes a lock; /metrics adds the shards up. The
+# numbers are those of the worker process that answers the scrape.
+#----------------------------------------------------------------------------#
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric(object):
+    """Per-thread shards of {label values: value}, summed when collected."""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def values(self):
+        # label values -> value, over every shard
+        with self.lock:
+            shards = list(self.shards)
+        totals = {}
+        for shard in shards:
+            for key, value in list(shard.items()):
+                totals[key] = self.merge(totals.get(key), value)
+        return totals
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    def label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                                 for name, value in pairs)
+
+    def collect(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for values, value in sorted(self.values().items()):
+            lines.append('%s%s %s' % (self.name, self.label_text(values), _number(value)))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        shard = self.shard()
+        shard[values] = shard.get(values, 0) + amount
+
+
+class Gauge(Counter):
+    # in-flight style gauges: incremented and decremented by the same thread
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, seconds, *values):
+        shard = self.shard()
+        counts = shard.get(values)
+        if counts is None:
+            # one count per bucket, one for +Inf, then the sum
+            counts = shard[values] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def collect(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        for values, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, self.label_text(values, [('le', _number(bound))]),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (self.name, self.label_text(values),
+                                          _number(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, self.label_text(values),
+                                            cumulative))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+request_seconds = Histogram(
+    'fyyur_request_duration_seconds', 'Time spent handling requests.', ('endpoint',))
+requests_total = Counter(
+    'fyyur_requests_total', 'Requests handled.', ('endpoint', 'status'))
+in_flight = Gauge(
+    'fyyur_requests_in_flight', 'Requests being handled.', ('endpoint',))
+checkout_seconds = Histogram(
+    'fyyur_db_pool_checkout_seconds',
+    'Time spent waiting for a connection from the pool.', ('pool',))
+checkout_timeouts = Counter(
+    'fyyur_db_pool_checkout_timeouts_total',
+    'Checkouts that gave up waiting for a connection.', ('pool',))
+connections_opened = Counter(
+    'fyyur_db_connections_opened_total', 'Connections opened by the pool.', ('pool',))
+connections_closed = Counter(
+    'fyyur_db_connections_closed_total',
+    'Connections closed by the pool: recycled, invalidated or beyond its size.', ('pool',))
+connections_invalidated = Counter(
+    'fyyur_db_connections_invalidated_total',
+    'Connections found broken, by a pre-ping or an error.', ('pool',))
+render_seconds = Histogram(
+    'fyyur_template_render_seconds', 'Time spent rendering templates.', ('template',))
+
+METRICS = [request_seconds, requests_total, in_flight, checkout_seconds, checkout_timeouts,
+           connections_opened, connections_closed, connections_invalidated, render_seconds]
+
+# pool name -> engine, for the pool gauges
+ENGINES = {}
+
+
+class TimedTemplate(Template):
+    """Templates that record how long render_template spends on them."""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            render_seconds.observe(time.perf_counter() - start, self.name)
+
+
+def _gauge(name, help, samples):
+    # samples: [(label text, value)]
+    lines = ['# HELP %s %s' % (name, help), '# TYPE %s gauge' % name]
+    lines.extend('%s%s %s' % (name, labels, _number(value)) for labels, value in samples)
+    return lines
+
+
+def _counter(name, help, samples):
+    lines = ['# HELP %s %s' % (name, help), '# TYPE %s counter' % name]
+    lines.extend('%s%s %s' % (name, labels, _number(value)) for labels, value in samples)
+    return lines
+
+
+def collect_pools(engines):
+    # QueuePool only; other pool classes do not keep these numbers
+    connections = []
+    overflow = []
+    limit = []
+    for name, engine in sorted(engines.items()):
+        pool = engine.pool
+        for state, stat in (('checked_out', 'checkedout'), ('idle', 'checkedin')):
+            method = getattr(pool, stat, None)
+            if method is not None:
+                connections.append(('{pool="%s",state="%s"}' % (name, state), method()))
+        if hasattr(pool, 'overflow'):
+            # the pool counts its overflow from -size up
+            overflow.append(('{pool="%s"}' % name, max(0, pool.overflow())))
+            limit.append(('{pool="%s"}' % name, pool.size() + pool._max_overflow))
+    return (_gauge('fyyur_db_pool_connections', 'Open connections of the pool, by state.',
+                   connections) +
+            _gauge('fyyur_db_pool_overflow', 'Connections open beyond the pool size.',
+                   overflow) +
+            _gauge('fyyur_db_pool_max_connections',
+                   'Connections the pool opens at most: its size plus the overflow.', limit))
+
+
+def collect_caches():
+    hits = []
+    misses = []
+    for name, store in sorted(cache.CACHES.items()):
+        hits.append(('{cache="%s"}' % name, store.hits))
+        misses.append(('{cache="%s"}' % name, store.misses))
+    info = getattr(filters._format_datetime_cached, 'cache_info', None)
+    if info is not None:
+        info = info()
+        hits.append(('{cache="datetime_filter"}', info.hits))
+        misses.append(('{cache="datetime_filter"}', info.misses))
+    return (_counter('fyyur_cache_hits_total', 'Cache lookups that hit.', hits) +
+            _counter('fyyur_cache_misses_total', 'Cache lookups that missed.', misses))
+
+
+def collect_replicas(replica_set):
+    healthy = [('{replica="%s"}' % replica.name, int(replica.healthy))
+               for replica in replica_set.replicas]
+    lag = [('{replica="%s"}' % replica.name, replica.lag)
+           for replica in replica_set.replicas if replica.lag is not None]
+    return (_gauge('fyyur_db_replica_healthy',
+                   'Whether the last health check of a replica passed.', healthy) +
+            _gauge('fyyur_db_replica_lag_seconds',
+                   'How far behind the primary a replica was at its last check.', lag))
+
+
+def render(replica_set=None):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    lines.extend(collect_pools(ENGINES))
+    if replica_set is not None:
+        lines.extend(collect_replicas(replica_set))
+    lines.extend(collect_caches())
+    return '\n'.join(lines) + '\n'
+
+
+def time_checkouts(pool, name):
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        except TimeoutError:
+            checkout_timeouts.inc(name)
+            raise
+        finally:
+            checkout_seconds.observe(time.perf_counter() - start, name)
+    pool.connect = timed_connect
+
+
+def watch_pool(engine, name):
+    # checkout times and connection churn of the pool of ``engine``,
+    # reported as ``pool="<name>"``
+    ENGINES[name] = engine
+    time_checkouts(engine.pool, name)
+    # dispose() replaces the pool; its events carry over, the timing not
+    event.listen(engine, 'engine_disposed', lambda engine: time_checkouts(engine.pool, name))
+    event.listen(engine.pool, 'connect', lambda *args: connections_opened.inc(name))
+    event.listen(engine.pool, 'close', lambda *args: connections_closed.inc(name))
+    event.listen(engine.pool, 'close_detached', lambda *args: connections_closed.inc(name))
+    event.listen(engine.pool, 'invalidate', lambda *args: connections_invalidated.inc(name))
+
+
+def init_app(app, engines):
+    # engines: pool name -> engine
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.jinja_env.template_class = TimedTemplate
+    for name, engine in engines.items():
+        watch_pool(engine, name)
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_endpoint = request.endpoint or 'unknown'
+        g.metrics_start = time.perf_counter()
+        in_flight.inc(g.metrics_endpoint)
+
+    @app.after_request
+    def count_response(response):
+        endpoint = getattr(g, 'metrics_endpoint', None)
+        if endpoint is not None:
+            requests_total.inc(endpoint, response.status_code)
+        return response
+
+    @app.teardown_request
+    def finish_metrics(exc):
+        # runs after a streamed response has been sent in full
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            request_seconds.observe(time.perf_counter() - g.pop('metrics_start'), endpoint)
+            in_flight.inc(endpoint, amount=-1)
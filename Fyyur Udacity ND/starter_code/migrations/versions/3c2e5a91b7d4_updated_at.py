@@ -0,0 +1,29 @@
+"""updated_at on venues, artists and shows
+
+Revision ID: 3c2e5a91b7d4
+Revises: 7d915b076fa5
+Create Date: 2026-10-18 15:42:27.180342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c2e5a91b7d4'
+down_revision = '7d915b076fa5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       server_default=sa.text('LOCALTIMESTAMP'), nullable=False))
+        op.create_index('ix_%s_updated_at' % table, table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_index('ix_%s_updated_at' % table, table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,47 @@
+"""denormalized show counters on venues and artists
+
+Revision ID: 7d915b076fa5
+Revises: d974880b4a69
+Create Date: 2026-10-18 14:48:09.553714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d915b076fa5'
+down_revision = 'd974880b4a69'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_at', sa.DateTime(), nullable=True))
+        op.create_index('ix_%s_next_show_at' % table, table, ['next_show_at'], unique=False)
+        # backfill from the existing shows
+        op.execute('''
+            UPDATE "%(table)s" SET
+                upcoming_shows_count = a.upcoming,
+                past_shows_count = a.past,
+                next_show_at = a.next_show_at
+            FROM (
+                SELECT %(column)s AS id,
+                       count(*) FILTER (WHERE start_time >= LOCALTIMESTAMP) AS upcoming,
+                       count(*) FILTER (WHERE start_time < LOCALTIMESTAMP) AS past,
+                       min(start_time) FILTER (WHERE start_time >= LOCALTIMESTAMP) AS next_show_at
+                FROM "Show" GROUP BY %(column)s
+            ) a
+            WHERE "%(table)s".id = a.id
+        ''' % {'table': table, 'column': column})
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index('ix_%s_next_show_at' % table, table_name=table)
+        op.drop_column(table, 'next_show_at')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
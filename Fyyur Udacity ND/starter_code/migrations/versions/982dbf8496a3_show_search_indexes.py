@@ -0,0 +1,26 @@
+"""indexes for show search
+
+Revision ID: 982dbf8496a3
+Revises: 9ba904ccbc28
+Create Date: 2026-10-18 14:02:36.115408
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '982dbf8496a3'
+down_revision = '9ba904ccbc28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_Venue_lower_city', 'Venue', [sa.text('lower(city)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_lower_city', table_name='Venue')
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
@@ -1,24 +1,31 @@
-from flask import Flask
-from flask_migrate import Migrate
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
+from replicas import RoutingSQLAlchemy
+
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# bound to the app by app.create_app; sends the reads of some requests to
+# a replica (replicas.py)
+db = RoutingSQLAlchemy()
 
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        # trigram index behind the name ILIKE '%term%' search
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        # /venues groups venues by state and city
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+        # counters.rollover finds the rows whose next show has started
+        db.Index('ix_Venue_next_show_at', 'next_show_at'),
+        # API validators and incremental exports
+        db.Index('ix_Venue_updated_at', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -37,6 +44,18 @@ class Venue(db.Model):
     seeking_description = db.Column(db.String(500))
     genres = db.Column(db.ARRAY(db.String()), nullable=False)
 
+    # maintained by counters.py
+    upcoming_shows_count = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
+    past_shows_count = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
+    next_show_at = db.Column(db.DateTime)
+
+    # last change to the row or to what its pages show; counters.py bumps
+    # it along with the counters
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.text('LOCALTIMESTAMP'), nullable=False)
+
     def __init__(self, name, genres, address, city, state, phone, website, facebook_link, image_link, seeking_talent, seeking_description):
         self.name = name
         self.genres = genres
@@ -51,8 +70,18 @@ class Venue(db.Model):
         self.seeking_talent = seeking_talent
 
 
+# show search matches the venue city case-insensitively
+db.Index('ix_Venue_lower_city', db.func.lower(Venue.city))
+
+
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_next_show_at', 'next_show_at'),
+        db.Index('ix_Artist_updated_at', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -71,6 +100,18 @@ class Artist(db.Model):
         db.Boolean, default=False, nullable=False)
     seeking_description = db.Column(db.String(500))
 
+    # maintained by counters.py
+    upcoming_shows_count = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
+    past_shows_count = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
+    next_show_at = db.Column(db.DateTime)
+
+    # last change to the row or to what its pages show; counters.py bumps
+    # it along with the counters
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.text('LOCALTIMESTAMP'), nullable=False)
+
     def __init__(self, name, genres, city, state, phone, image_link, website, facebook_link,
                  seeking_venue, seeking_description):
         self.name = name
@@ -90,12 +131,22 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # detail pages page through a venue's or artist's shows by start_time
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        # /shows listing, show search date ranges and their keyset paging
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.Index('ix_Show_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey(
         'Artist.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False,
                            default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.text('LOCALTIMESTAMP'), nullable=False)
 
     def __init__(self, artist_id, venue_id, start_time):
         self.artist_id = artist_id
@@ -0,0 +1,600 @@
+from datetime import datetime
+
+from sqlalchemy import Text, case, cast, func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from models import db, Venue, Artist, Show
+
+
+#----------------------------------------------------------------------------#
+# Queries.
+#
+# Read-side helpers used by the controllers in app.py. Each helper issues a
+# fixed number of statements no matter how many rows it touches and returns
+# plain dicts shaped the way the templates expect them.
+#
+# The pages that also have an async variant (async_views.py) are split in
+# two: *_select builds the statement and *_from shapes the rows it returns,
+# so that both sides send the same SQL and render the same dicts.
+#----------------------------------------------------------------------------#
+
+
+def venue_areas_select(now=None):
+    # one statement over Venue alone: every venue with its number of upcoming
+    # shows, ordered so that venues of the same city/state come out together.
+    # The stored counter is used unless a show has started since the venue
+    # was last counted; only those venues are counted from Show.
+    now = now or datetime.now()
+    live_count = select(func.count(Show.id)).where(
+        Show.venue_id == Venue.id, Show.start_time >= now
+    ).correlate(Venue).scalar_subquery()
+    return select(
+        Venue.id, Venue.name, Venue.city, Venue.state,
+        case([(Venue.next_show_at < now, live_count)],
+             else_=Venue.upcoming_shows_count).label('num_upcoming_shows')
+    ).order_by(
+        Venue.state, Venue.city, Venue.id
+    )
+
+
+def venue_areas(now=None):
+    return venue_areas_from(db.session.execute(venue_areas_select(now)).all())
+
+
+def venue_areas_from(rows):
+    areas = []
+    area = None
+    for row in rows:
+        if area is None or area['city'] != row.city or area['state'] != row.state:
+            area = {
+                "city": row.city,
+                "state": row.state,
+                "venues": []
+            }
+            areas.append(area)
+        area['venues'].append({
+            "id": row.id,
+            "name": row.name,
+            "num_upcoming_shows": row.num_upcoming_shows
+        })
+    return areas
+
+
+def next_show_start_select(now=None):
+    # when the next upcoming show starts, i.e. when upcoming counts change
+    return select(func.min(Show.start_time)).where(
+        Show.start_time >= (now or datetime.now()))
+
+
+def next_show_start(now=None):
+    return db.session.execute(next_show_start_select(now)).scalar()
+
+
+def artist_list_select():
+    # the /artists page shows names only
+    return select(Artist.id, Artist.name)
+
+
+def artist_ids_for_venue(venue_id):
+    return [row[0] for row in db.session.query(Show.artist_id).filter(
+        Show.venue_id == venue_id).distinct()]
+
+
+def venue_ids_for_artist(artist_id):
+    return [row[0] for row in db.session.query(Show.venue_id).filter(
+        Show.artist_id == artist_id).distinct()]
+
+
+# number of shows rendered per section of a detail page; the rest are
+# fetched on demand from the /venues/<id>/shows and /artists/<id>/shows
+# fragment endpoints
+SHOWS_PAGE_SIZE = 12
+
+
+def encode_cursor(start_time, show_id):
+    return '%s,%d' % (start_time.isoformat(), show_id)
+
+
+def decode_cursor(value):
+    # raises ValueError for anything that is not "<iso start_time>,<show id>"
+    start_time, _, show_id = value.rpartition(',')
+    return datetime.fromisoformat(start_time), int(show_id)
+
+
+def show_counts_select(owner_column, owner_id, now):
+    # counts for both sections come from one aggregate over the
+    # (owner_id, start_time) index instead of from the rows themselves
+    return select(
+        func.count(Show.id).filter(Show.start_time >= now),
+        func.count(Show.id).filter(Show.start_time < now)
+    ).where(owner_column == owner_id)
+
+
+def stored_counts(owner, now):
+    # (upcoming, past) from the counters maintained by counters.py, or None
+    # when a show of this owner has started since they were last rolled over
+    if owner.next_show_at is None or owner.next_show_at >= now:
+        return owner.upcoming_shows_count, owner.past_shows_count
+    return None
+
+
+def _stored_counts(owner, owner_column, now):
+    counts = stored_counts(owner, now)
+    if counts is None:
+        row = db.session.execute(show_counts_select(owner_column, owner.id, now)).one()
+        counts = row[0], row[1]
+    return counts
+
+
+def _show_page_select(statement, owner_column, owner_id, when, after, limit, now):
+    # keyset pagination on (start_time, id): upcoming shows run forward from
+    # now, past shows run backwards from now, most recent first. One row
+    # more than the page is selected, to tell whether there is a next page.
+    statement = statement.where(owner_column == owner_id)
+    key = tuple_(Show.start_time, Show.id)
+    if when == 'upcoming':
+        statement = statement.where(Show.start_time >= now)
+        if after is not None:
+            statement = statement.where(key > tuple_(*after))
+        statement = statement.order_by(Show.start_time, Show.id)
+    else:
+        statement = statement.where(Show.start_time < now)
+        if after is not None:
+            statement = statement.where(key < tuple_(*after))
+        statement = statement.order_by(Show.start_time.desc(), Show.id.desc())
+    return statement.limit(limit + 1)
+
+
+def _page_from(rows, limit):
+    # (rows of the page, cursor of the next page or None)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].start_time, rows[-1].id)
+    return rows, next_cursor
+
+
+def venue_shows_select(venue_id, when, after=None, limit=SHOWS_PAGE_SIZE, now=None):
+    # artist columns come from the same joined statement, so reading them
+    # never triggers the lazy Show.artist relationship
+    statement = select(
+        Show.id,
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time
+    ).join(Artist, Artist.id == Show.artist_id)
+    return _show_page_select(statement, Show.venue_id, venue_id, when,
+                             after, limit, now or datetime.now())
+
+
+def venue_shows_page(venue_id, when, after=None, limit=SHOWS_PAGE_SIZE, now=None):
+    rows = db.session.execute(venue_shows_select(venue_id, when, after, limit, now)).all()
+    return venue_shows_from(rows, limit)
+
+
+def venue_shows_from(rows, limit=SHOWS_PAGE_SIZE):
+    rows, next_cursor = _page_from(rows, limit)
+    shows = [{
+        "artist_id": row.artist_id,
+        "artist_name": row.artist_name,
+        "artist_image_link": row.artist_image_link,
+        "start_time": row.start_time
+    } for row in rows]
+    return shows, next_cursor
+
+
+def artist_shows_select(artist_id, when, after=None, limit=SHOWS_PAGE_SIZE, now=None):
+    statement = select(
+        Show.id,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'),
+        Show.start_time
+    ).join(Venue, Venue.id == Show.venue_id)
+    return _show_page_select(statement, Show.artist_id, artist_id, when,
+                             after, limit, now or datetime.now())
+
+
+def artist_shows_page(artist_id, when, after=None, limit=SHOWS_PAGE_SIZE, now=None):
+    rows = db.session.execute(artist_shows_select(artist_id, when, after, limit, now)).all()
+    return artist_shows_from(rows, limit)
+
+
+def artist_shows_from(rows, limit=SHOWS_PAGE_SIZE):
+    rows, next_cursor = _page_from(rows, limit)
+    shows = [{
+        "venue_id": row.venue_id,
+        "venue_name": row.venue_name,
+        "venue_image_link": row.venue_image_link,
+        "start_time": row.start_time
+    } for row in rows]
+    return shows, next_cursor
+
+
+def venue_detail(venue_id, now=None):
+    venue = Venue.query.get(venue_id)
+    if venue is None:
+        return None
+    now = now or datetime.now()
+    counts = _stored_counts(venue, Show.venue_id, now)
+    upcoming = venue_shows_page(venue_id, 'upcoming', now=now)
+    past = venue_shows_page(venue_id, 'past', now=now)
+    return venue_detail_from(venue, counts, upcoming, past)
+
+
+def venue_row_select(venue_id):
+    return select(Venue.__table__).where(Venue.id == venue_id)
+
+
+def venue_detail_from(venue, counts, upcoming, past):
+    # venue: the Venue, or a row of its columns; counts: (upcoming, past);
+    # upcoming and past: (shows, next cursor) pages
+    upcoming_count, past_count = counts
+    upcoming_shows, upcoming_next = upcoming
+    past_shows, past_next = past
+    return {
+        "id": venue.id,
+        "name": venue.name,
+        "genres": venue.genres,
+        "address": venue.address,
+        "city": venue.city,
+        "state": venue.state,
+        "phone": venue.phone,
+        "website": venue.website,
+        "facebook_link": venue.facebook_link,
+        "seeking_talent": venue.seeking_talent,
+        "seeking_description": venue.seeking_description,
+        "image_link": venue.image_link,
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": past_count,
+        "upcoming_shows_count": upcoming_count,
+        "past_shows_next": past_next,
+        "upcoming_shows_next": upcoming_next,
+        "next_show_at": upcoming_shows[0]["start_time"] if upcoming_shows else None
+    }
+
+
+def artist_detail(artist_id, now=None):
+    artist = Artist.query.get(artist_id)
+    if artist is None:
+        return None
+    now = now or datetime.now()
+    counts = _stored_counts(artist, Show.artist_id, now)
+    upcoming = artist_shows_page(artist_id, 'upcoming', now=now)
+    past = artist_shows_page(artist_id, 'past', now=now)
+    return artist_detail_from(artist, counts, upcoming, past)
+
+
+def artist_row_select(artist_id):
+    return select(Artist.__table__).where(Artist.id == artist_id)
+
+
+def artist_detail_from(artist, counts, upcoming, past):
+    upcoming_count, past_count = counts
+    upcoming_shows, upcoming_next = upcoming
+    past_shows, past_next = past
+    return {
+        "id": artist.id,
+        "name": artist.name,
+        "genres": artist.genres,
+        "city": artist.city,
+        "state": artist.state,
+        "phone": artist.phone,
+        "facebook_link": artist.facebook_link,
+        "image_link": artist.image_link,
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": past_count,
+        "upcoming_shows_count": upcoming_count,
+        "past_shows_next": past_next,
+        "upcoming_shows_next": upcoming_next,
+        "next_show_at": upcoming_shows[0]["start_time"] if upcoming_shows else None
+    }
+
+
+def show_list_select(after=None, limit=None):
+    # the /shows listing in (start_time, id) order, plus the row after the
+    # page when it stops at ``limit`` rows
+    statement = select(
+        Show.id,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time
+    ).join(
+        Venue, Venue.id == Show.venue_id
+    ).join(
+        Artist, Artist.id == Show.artist_id
+    ).order_by(
+        Show.start_time, Show.id
+    )
+    if after is not None:
+        statement = statement.where(tuple_(Show.start_time, Show.id) > tuple_(*after))
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    return statement
+
+
+def iter_shows(after=None, limit=None, page=None, batch_size=500):
+    # generator over the /shows listing. Rows are pulled from a server-side
+    # cursor batch_size at a time, so memory stays flat however large Show
+    # grows. When the listing stops at ``limit`` rows, the cursor of the
+    # next page is stored in page['next_cursor'].
+    rows = db.session.execute(show_list_select(after, limit).execution_options(
+        yield_per=batch_size))
+
+    last = None
+    for count, row in enumerate(rows):
+        if limit is not None and count == limit:
+            if page is not None:
+                page['next_cursor'] = encode_cursor(last.start_time, last.id)
+            break
+        last = row
+        yield show_from(row)
+
+
+def show_from(row):
+    return {
+        "id": row.id,
+        "venue_id": row.venue_id,
+        "venue_name": row.venue_name,
+        "artist_id": row.artist_id,
+        "artist_name": row.artist_name,
+        "artist_image_link": row.artist_image_link,
+        "start_time": row.start_time
+    }
+
+
+def show_page_from(rows, limit):
+    # (shows of a page of show_list_select, cursor of the next page or None)
+    rows, next_cursor = _page_from(rows, limit)
+    return [show_from(row) for row in rows], next_cursor
+
+
+# search pages list at most this many results, best matches first; the
+# count shown above them is the total number of matches
+SEARCH_RESULTS_LIMIT = 50
+
+# columns other than the name that a search may also be asked to match
+SEARCH_MATCH_FIELDS = ('city', 'state', 'genres')
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def search_selects(model, term, match=(), limit=SEARCH_RESULTS_LIMIT):
+    # (total count, best matches) statements of a venue or artist search.
+    # name ILIKE '%term%' is served by the pg_trgm GIN index on name, and
+    # results are ranked by trigram similarity to the search term
+    pattern = _like_pattern(term)
+    conditions = [model.name.ilike(pattern)]
+    if 'city' in match:
+        conditions.append(model.city.ilike(pattern))
+    if 'state' in match:
+        conditions.append(model.state.ilike(pattern))
+    if 'genres' in match:
+        conditions.append(func.array_to_string(model.genres, ',').ilike(pattern))
+    where = or_(*conditions)
+
+    total = select(func.count(model.id)).where(where)
+    rows = select(
+        model.id, model.name
+    ).where(
+        where
+    ).order_by(
+        func.similarity(model.name, term).desc(), model.name, model.id
+    ).limit(limit)
+    return total, rows
+
+
+def _search(model, term, match=(), limit=SEARCH_RESULTS_LIMIT):
+    total, rows = search_selects(model, term, match, limit)
+    return search_from(db.session.execute(total).scalar(), db.session.execute(rows).all())
+
+
+def search_from(total, rows):
+    return {
+        "count": total,
+        "data": [{"id": row.id, "name": row.name} for row in rows]
+    }
+
+
+def search_venues(term, match=(), limit=SEARCH_RESULTS_LIMIT):
+    return _search(Venue, term, match, limit)
+
+
+def search_artists(term, match=(), limit=SEARCH_RESULTS_LIMIT):
+    return _search(Artist, term, match, limit)
+
+
+def search_shows_selects(term='', city=None, start=None, end=None, after=None,
+                         limit=SEARCH_RESULTS_LIMIT):
+    # (total count, page) statements of a show search: shows whose artist
+    # or venue name contains ``term``, optionally at a venue in ``city`` and
+    # starting in [start, end), as one joined query each.
+    # Name matches use the trigram indexes, the city the lower(city) index
+    # and the date range and paging the (start_time, id) index.
+    conditions = []
+    if term:
+        pattern = _like_pattern(term)
+        conditions.append(or_(Artist.name.ilike(pattern), Venue.name.ilike(pattern)))
+    if city:
+        conditions.append(func.lower(Venue.city) == city.lower())
+    if start is not None:
+        conditions.append(Show.start_time >= start)
+    if end is not None:
+        conditions.append(Show.start_time < end)
+
+    total = select(
+        func.count(Show.id)
+    ).join(
+        Venue, Venue.id == Show.venue_id
+    ).join(
+        Artist, Artist.id == Show.artist_id
+    ).where(*conditions)
+
+    rows = select(
+        Show.id,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time
+    ).join(
+        Venue, Venue.id == Show.venue_id
+    ).join(
+        Artist, Artist.id == Show.artist_id
+    ).where(*conditions)
+    if after is not None:
+        rows = rows.where(tuple_(Show.start_time, Show.id) > tuple_(*after))
+    return total, rows.order_by(Show.start_time, Show.id).limit(limit + 1)
+
+
+def search_shows(term='', city=None, start=None, end=None, after=None,
+                 limit=SEARCH_RESULTS_LIMIT):
+    total, rows = search_shows_selects(term, city, start, end, after, limit)
+    return search_shows_from(db.session.execute(total).scalar(),
+                             db.session.execute(rows).all(), limit)
+
+
+def search_shows_from(total, rows, limit=SEARCH_RESULTS_LIMIT):
+    rows, next_cursor = _page_from(rows, limit)
+    return {
+        "count": total,
+        "data": [{
+            "venue_id": row.venue_id,
+            "venue_name": row.venue_name,
+            "artist_id": row.artist_id,
+            "artist_name": row.artist_name,
+            "artist_image_link": row.artist_image_link,
+            "start_time": row.start_time
+        } for row in rows],
+        "next_cursor": next_cursor
+    }
+
+
+#----------------------------------------------------------------------------#
+# API.
+#
+# The *_version helpers return (parts, last_modified) for a JSON API
+# resource, where parts changes whenever the resource does; the API builds
+# its ETag and Last-Modified headers from them. They read ids, updated_at
+# and the counters only, so a conditional request answered with a 304
+# never loads the rows themselves.
+#----------------------------------------------------------------------------#
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+VENUE_LIST_FIELDS = (
+    'id', 'name', 'genres', 'address', 'city', 'state', 'phone', 'website',
+    'facebook_link', 'seeking_talent', 'seeking_description', 'image_link',
+    'upcoming_shows_count', 'past_shows_count', 'next_show_at', 'updated_at')
+
+VENUE_DETAIL_FIELDS = (
+    'id', 'name', 'genres', 'address', 'city', 'state', 'phone', 'website',
+    'facebook_link', 'seeking_talent', 'seeking_description', 'image_link',
+    'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count',
+    'past_shows_next', 'upcoming_shows_next', 'next_show_at')
+
+ARTIST_DETAIL_FIELDS = (
+    'id', 'name', 'genres', 'city', 'state', 'phone', 'facebook_link',
+    'image_link', 'past_shows', 'upcoming_shows', 'past_shows_count',
+    'upcoming_shows_count', 'past_shows_next', 'upcoming_shows_next',
+    'next_show_at')
+
+SHOW_FIELDS = ('id', 'venue_id', 'venue_name', 'artist_id', 'artist_name',
+               'artist_image_link', 'start_time')
+
+
+def _detail_version(model, owner_column, entity_id, now=None):
+    # a detail page changes with its row (updated_at, which show writes and
+    # rollovers bump too) and whenever one of its shows starts. While the
+    # stored counters are current the past count says which shows have
+    # started; otherwise it is counted from the (owner_id, start_time) index.
+    now = now or datetime.now()
+    row = db.session.query(
+        model.updated_at, model.past_shows_count, model.next_show_at
+    ).filter(model.id == entity_id).first()
+    if row is None:
+        return None
+    if row.next_show_at is None or row.next_show_at >= now:
+        return (row.updated_at, row.past_shows_count), row.updated_at
+    past_count, last_start = db.session.query(
+        func.count(Show.id), func.max(Show.start_time)
+    ).filter(owner_column == entity_id, Show.start_time < now).one()
+    return (row.updated_at, past_count), max(row.updated_at, last_start or row.updated_at)
+
+
+def venue_version(venue_id, now=None):
+    return _detail_version(Venue, Show.venue_id, venue_id, now)
+
+
+def artist_version(artist_id, now=None):
+    return _detail_version(Artist, Show.artist_id, artist_id, now)
+
+
+def _page_version(page, *updated_at):
+    # ``page`` selects the ids of a page, plus the row after it, and the
+    # updated_at of every row it is built from
+    page = page.subquery()
+    row = db.session.query(
+        func.md5(func.string_agg(cast(page.c.id, Text),
+                                 aggregate_order_by(',', page.c.id))),
+        func.max(func.greatest(*[page.c[name] for name in updated_at]))
+    ).one()
+    return (row[0], row[1]), row[1]
+
+
+def venue_list_version(after=None, limit=API_PAGE_SIZE):
+    query = db.session.query(Venue.id, Venue.updated_at)
+    if after is not None:
+        query = query.filter(Venue.id > after)
+    return _page_version(query.order_by(Venue.id).limit(limit + 1), 'updated_at')
+
+
+def venue_list(fields, after=None, limit=API_PAGE_SIZE):
+    # keyset pages of venues in id order, reading only the selected columns
+    query = db.session.query(Venue.id, *[getattr(Venue, field) for field in fields])
+    if after is not None:
+        query = query.filter(Venue.id > after)
+    rows = query.order_by(Venue.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1].id)
+    return {
+        "data": [dict(zip(fields, row[1:])) for row in rows],
+        "next_cursor": next_cursor
+    }
+
+
+def show_list_version(after=None, limit=API_PAGE_SIZE):
+    # the listing shows venue and artist names, so their rows count too
+    query = db.session.query(
+        Show.id,
+        Show.updated_at.label('show_updated_at'),
+        Venue.updated_at.label('venue_updated_at'),
+        Artist.updated_at.label('artist_updated_at')
+    ).join(
+        Venue, Venue.id == Show.venue_id
+    ).join(
+        Artist, Artist.id == Show.artist_id
+    )
+    if after is not None:
+        query = query.filter(tuple_(Show.start_time, Show.id) > tuple_(*after))
+    query = query.order_by(Show.start_time, Show.id).limit(limit + 1)
+    return _page_version(query, 'show_updated_at', 'venue_updated_at', 'artist_updated_at')
+
+
+def show_list(after=None, limit=API_PAGE_SIZE):
+    page = {'next_cursor': None}
+    shows = list(iter_shows(after, limit, page))
+    return {"data": shows, "next_cursor": page['next_cursor']}
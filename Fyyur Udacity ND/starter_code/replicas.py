@@ -0,0 +1,205 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#
+# Requests for the views marked @reads (the list, detail and search pages,
+# the API and the exports) read from one of the replicas named in
+# REPLICA_BINDS, taken in turn among the healthy ones. Every other request,
+# and every flush, uses the primary, SQLALCHEMY_DATABASE_URI; so do the
+# reads when no replica is healthy.
+#
+# A replica is healthy when its last check, at most REPLICA_CHECK_INTERVAL
+# seconds ago, found it at most REPLICA_MAX_LAG_SECONDS behind the primary.
+# The checks run on a thread of each worker; a replica whose connection
+# drops is taken out at once.
+#
+# Read-your-writes: after a request that may have written (not GET or HEAD,
+# not @reads) the client reads from the primary for READ_YOUR_WRITES_SECONDS,
+# so that the page it is redirected to shows its change. The deadline is in
+# the session cookie, so it holds whichever worker answers. Pages built from
+# a replica are cached for REPLICA_MAX_LAG_SECONDS at most, since the
+# replica may not have seen the write that invalidated them yet.
+#
+# The routing is WSGI-only: the async pages of the ASGI mode
+# (async_views.py) read from the primary, on an engine of their own, and
+# only honour the read-your-writes window by skipping the caches.
+#----------------------------------------------------------------------------#
+
+logger = logging.getLogger(__name__)
+
+# seconds a replica is behind the primary; 0 on a replica that has replayed
+# everything it received, and on a stand-in that is not a replica at all
+LAG = text('''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+          OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END''')
+
+
+class Replica(object):
+    """A replica's engine and what its last check found."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        # out until its first check
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+
+
+class ReplicaSet(object):
+    """Round-robin over the healthy replicas."""
+
+    def __init__(self, replicas, check_interval=5, max_lag=10):
+        self.replicas = replicas
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.turns = itertools.count()
+        self.checker_pid = None
+        self.lock = threading.Lock()
+        for replica in replicas:
+            event.listen(replica.engine, 'handle_error', self._on_error(replica))
+
+    def choose(self):
+        # the next healthy replica, or None
+        self.start_checks()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self.turns) % len(self.replicas)]
+            if replica.healthy:
+                return replica
+        return None
+
+    def start_checks(self):
+        # one checking thread per worker process, started by its first
+        # request: a thread started in the gunicorn master would not
+        # survive the fork
+        if self.checker_pid == os.getpid():
+            return
+        with self.lock:
+            if self.checker_pid != os.getpid():
+                self.checker_pid = os.getpid()
+                threading.Thread(target=self._check_forever, name='replica-checks',
+                                 daemon=True).start()
+
+    def _check_forever(self):
+        while True:
+            for replica in self.replicas:
+                self.check(replica)
+            time.sleep(self.check_interval)
+
+    def check(self, replica):
+        try:
+            with replica.engine.connect() as conn:
+                lag = float(conn.execute(LAG).scalar() or 0)
+        except SQLAlchemyError as e:
+            if replica.healthy:
+                logger.warning('replica %s is down: %s', replica.name, e)
+            replica.healthy = False
+            replica.lag = None
+        else:
+            healthy = lag <= self.max_lag
+            if healthy != replica.healthy:
+                logger.warning('replica %s is %s, %.1f s behind', replica.name,
+                               'back' if healthy else 'lagging', lag)
+            replica.healthy = healthy
+            replica.lag = lag
+        replica.checked_at = datetime.now()
+
+    def _on_error(self, replica):
+        def on_error(context):
+            if context.is_disconnect:
+                replica.healthy = False
+        return on_error
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the statements of @reads requests to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if not self._flushing and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica.engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def reads(view):
+    # marks a view whose requests may read from a replica
+    view.replica_reads = True
+    return view
+
+
+def pinned():
+    # whether this client wrote recently and reads from the primary
+    return session.get('db_primary_until', 0) > time.time()
+
+
+def on_replica():
+    return g.get('db_replica') is not None
+
+
+def bounded(build):
+    # build() for the caches, whose value expires within
+    # REPLICA_MAX_LAG_SECONDS when it was read from a replica
+    def build_bounded():
+        value, expires_at = build()
+        if on_replica():
+            deadline = datetime.now() + timedelta(
+                seconds=current_app.config.get('REPLICA_MAX_LAG_SECONDS', 10))
+            expires_at = deadline if expires_at is None else min(expires_at, deadline)
+        return value, expires_at
+    return build_bounded
+
+
+def init_app(app, db):
+    # returns {bind name: engine} of the replicas, {} when REPLICA_BINDS is
+    # empty
+    binds = app.config.get('REPLICA_BINDS') or []
+    if not binds:
+        return {}
+    with app.app_context():
+        replicas = [Replica(bind, db.get_engine(app, bind)) for bind in binds]
+    replica_set = app.extensions['replicas'] = ReplicaSet(
+        replicas, app.config.get('REPLICA_CHECK_INTERVAL', 5),
+        app.config.get('REPLICA_MAX_LAG_SECONDS', 10))
+    window = app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+
+    @app.before_request
+    def route_reads():
+        view = app.view_functions.get(request.endpoint)
+        if getattr(view, 'replica_reads', False) and not pinned():
+            g.db_replica = replica_set.choose()
+
+    @app.teardown_request
+    def end_reads(exc):
+        # g outlives the request when an app context was pushed around it
+        g.pop('db_replica', None)
+
+    @app.after_request
+    def pin_writers(response):
+        view = app.view_functions.get(request.endpoint)
+        if request.method not in ('GET', 'HEAD') and not getattr(view, 'replica_reads', False):
+            session['db_primary_until'] = time.time() + window
+        return response
+
+    return dict((replica.name, replica.engine) for replica in replicas)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy import event
+
+from instrumentation import fingerprint
+
+
+#----------------------------------------------------------------------------#
+# Slow queries.
+#
+# With SLOW_QUERY_CAPTURE on, SELECT statements that take longer than
+# SLOW_QUERY_THRESHOLD_MS are, for a SLOW_QUERY_SAMPLE_RATE fraction of
+# them, run a second time under EXPLAIN (ANALYZE, BUFFERS), inside a
+# savepoint so that a failure cannot break the request's transaction. The
+# plan is appended to SLOW_QUERY_LOG, one JSON object per line, along with
+# the statement, its parameters, its fingerprint and the route that sent it.
+#
+# `flask slow-queries report` summarizes the log: the statements that cost
+# the most, their routes, and whether their plan changed, within the log or
+# against the log of an earlier run given as --baseline.
+#----------------------------------------------------------------------------#
+
+SAVEPOINT = 'slow_query_explain'
+
+
+def plan_shape(node):
+    # the parts of a plan that make it a different plan: node types, the
+    # tables and indexes they use and how they join, not costs or timings
+    return [node['Node Type'], node.get('Relation Name'), node.get('Index Name'),
+            node.get('Join Type'), [plan_shape(child) for child in node.get('Plans', ())]]
+
+
+def plan_hash(plan):
+    return hashlib.sha1(json.dumps(plan_shape(plan['Plan'])).encode('utf-8')).hexdigest()[:12]
+
+
+def plan_summary(node):
+    # "Limit > Index Scan on Show (ix_Show_venue_id_start_time)"
+    label = node['Node Type']
+    if node.get('Relation Name'):
+        label += ' on %s' % node['Relation Name']
+    if node.get('Index Name'):
+        label += ' (%s)' % node['Index Name']
+    children = [plan_summary(child) for child in node.get('Plans', ())]
+    if len(children) == 1:
+        return '%s > %s' % (label, children[0])
+    if children:
+        return '%s > [%s]' % (label, ' | '.join(children))
+    return label
+
+
+class SlowQueryLog(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def explain(conn, statement, parameters):
+    # EXPLAIN ANALYZE runs the statement again; the savepoint keeps an error
+    # in it from aborting the transaction the statement belongs to
+    cursor = conn.connection.cursor()
+    cursor.execute('SAVEPOINT ' + SAVEPOINT)
+    try:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement, parameters)
+        plan = cursor.fetchone()[0][0]
+    except Exception:
+        cursor.execute('ROLLBACK TO SAVEPOINT ' + SAVEPOINT)
+        return None
+    finally:
+        cursor.execute('RELEASE SAVEPOINT ' + SAVEPOINT)
+        cursor.close()
+    return plan
+
+
+def init_app(app, *engines):
+    if not app.config.get('SLOW_QUERY_CAPTURE'):
+        return
+    threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS', 200) / 1000.0
+    sample_rate = app.config.get('SLOW_QUERY_SAMPLE_RATE', 0.1)
+    log = app.extensions['slow_queries'] = SlowQueryLog(
+        app.config.get('SLOW_QUERY_LOG', 'slow_queries.ndjson'))
+
+    def start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['slow_query_start'].pop()
+        if duration < threshold or executemany or random.random() >= sample_rate:
+            return
+        if not statement.lstrip()[:6].upper() == 'SELECT':
+            # EXPLAIN ANALYZE would run writes a second time
+            return
+        plan = explain(conn, statement, parameters)
+        if plan is None:
+            return
+        route = method = None
+        if has_request_context():
+            route, method = request.endpoint, request.method
+        log.append({
+            'time': datetime.now().isoformat(),
+            'route': route,
+            'method': method,
+            'duration_ms': round(duration * 1000, 3),
+            'fingerprint': fingerprint(statement),
+            'statement': statement,
+            'parameters': parameters,
+            'plan_hash': plan_hash(plan),
+            'plan': plan,
+        })
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', start)
+        event.listen(engine, 'after_cursor_execute', capture)
+
+
+def read_log(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summarize(records):
+    # fingerprint -> totals, routes, and the plan hashes in the order seen
+    statements = {}
+    for record in records:
+        entry = statements.get(record['fingerprint'])
+        if entry is None:
+            entry = statements[record['fingerprint']] = {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'routes': {},
+                'plans': [], 'summaries': {}}
+        entry['count'] += 1
+        entry['total_ms'] += record['duration_ms']
+        entry['max_ms'] = max(entry['max_ms'], record['duration_ms'])
+        route = record['route'] or '-'
+        entry['routes'][route] = entry['routes'].get(route, 0) + 1
+        if not entry['plans'] or entry['plans'][-1] != record['plan_hash']:
+            entry['plans'].append(record['plan_hash'])
+        entry['summaries'][record['plan_hash']] = plan_summary(record['plan']['Plan'])
+    return statements
+
+
+def previous_plan(entry, baseline_plan=None):
+    # the plan hash the statement had before its current one, if it changed
+    if len(entry['plans']) > 1:
+        return entry['plans'][-2]
+    if baseline_plan is not None and baseline_plan != entry['plans'][-1]:
+        return baseline_plan
+    return None
+
+
+cli = AppGroup('slow-queries', help='Report on the captured slow queries.')
+
+
+@cli.command('report')
+@click.option('--log', 'path', type=click.Path(exists=True, dir_okay=False),
+              help='Defaults to SLOW_QUERY_LOG.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Log of an earlier run to compare plans against.')
+@click.option('--top', type=int, default=10, show_default=True)
+@click.option('--fail-on-change', is_flag=True,
+              help='Exit with status 1 when a plan changed.')
+def report_command(path, baseline, top, fail_on_change):
+    """Print the statements that took the most time and flag plan changes."""
+    path = path or current_app.config.get('SLOW_QUERY_LOG', 'slow_queries.ndjson')
+    statements = summarize(read_log(path))
+    baseline_plans = {}
+    summaries = {}
+    if baseline:
+        for shape, entry in summarize(read_log(baseline)).items():
+            baseline_plans[shape] = entry['plans'][-1]
+            summaries.update(entry['summaries'])
+    for entry in statements.values():
+        summaries.update(entry['summaries'])
+
+    changed = sum(1 for shape, entry in statements.items()
+                  if previous_plan(entry, baseline_plans.get(shape)))
+    worst = sorted(statements.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    for rank, (shape, entry) in enumerate(worst[:top], 1):
+        routes = ', '.join('%s (%d)' % route for route in sorted(
+            entry['routes'].items(), key=lambda route: -route[1]))
+        click.echo('%2d. %d captures, %.1f ms total, %.1f ms max, avg %.1f ms  routes: %s' % (
+            rank, entry['count'], entry['total_ms'], entry['max_ms'],
+            entry['total_ms'] / entry['count'], routes))
+        click.echo('    %s' % shape[:160])
+        current = entry['plans'][-1]
+        click.echo('    plan %s: %s' % (current, summaries[current]))
+        previous = previous_plan(entry, baseline_plans.get(shape))
+        if previous is not None:
+            click.echo('    PLAN CHANGED from %s: %s' % (previous, summaries[previous]))
+    click.echo('%d statements, %d with a changed plan' % (len(statements), changed))
+    if fail_on_change and changed:
+        raise SystemExit(1)
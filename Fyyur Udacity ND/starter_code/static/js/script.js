@@ -2,3 +2,50 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// "More shows" buttons on the venue and artist pages fetch the next page of
+// shows as an html fragment and put it in place of the button.
+document.addEventListener("click", function (e) {
+  var button = e.target.closest(".load-more button");
+  if (!button) {
+    return;
+  }
+  button.disabled = true;
+  fetch(button.dataset["next"])
+    .then(function (response) {
+      return response.text();
+    })
+    .then(function (html) {
+      button.parentNode.outerHTML = html;
+    });
+});
+
+// Search boxes with a data-autocomplete attribute get name suggestions from
+// /api/autocomplete in their datalist while the user types.
+document.addEventListener("input", function (e) {
+  var input = e.target;
+  var type = input.dataset && input.dataset["autocomplete"];
+  if (!type) {
+    return;
+  }
+  clearTimeout(input.autocompleteTimer);
+  input.autocompleteTimer = setTimeout(function () {
+    var q = input.value.trim();
+    if (!q) {
+      return;
+    }
+    fetch("/api/autocomplete?type=" + type + "&q=" + encodeURIComponent(q))
+      .then(function (response) {
+        return response.json();
+      })
+      .then(function (data) {
+        var list = document.getElementById(input.getAttribute("list"));
+        list.innerHTML = "";
+        data.results.forEach(function (result) {
+          var option = document.createElement("option");
+          option.value = result.name;
+          list.appendChild(option);
+        });
+      });
+  }, 100);
+});
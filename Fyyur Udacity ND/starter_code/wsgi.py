@@ -0,0 +1,43 @@
+import os
+
+# the production entry point; `flask run` stays in development mode
+os.environ.setdefault('FLASK_ENV', 'production')
+
+from app import create_app, load_autocomplete  # noqa: E402
+from models import db  # noqa: E402
+import cache  # noqa: E402
+import filters  # noqa: E402
+
+
+#----------------------------------------------------------------------------#
+# WSGI.
+#
+# gunicorn -c gunicorn.conf.py wsgi:application
+#
+# With preload_app (gunicorn.conf.py) this module is imported once, in the
+# master, before the workers are forked: they start with the code imported,
+# the autocomplete indexes loaded and the templates compiled, and share those
+# pages with the master copy-on-write, so the first request of each worker
+# does not pay for them (benchmarks/profile_startup.py). The connections used
+# to load the indexes, to the database and to the cache server, are closed
+# before the fork so that no two workers end up talking over the same socket.
+#
+# Each worker then keeps its own copy of the indexes. A name changed through
+# one worker reaches the others through the cache (autocomplete.py): their
+# next lookup sees the index's version moved and reloads it.
+#----------------------------------------------------------------------------#
+
+application = create_app()
+
+with application.app_context():
+    load_autocomplete()
+    db.engine.dispose()
+    cache.pages.backend.close()
+
+# the rest of what the first request would otherwise load: every template,
+# and babel with the locale data and patterns of the datetime filter
+for name in application.jinja_env.list_templates(extensions=['html']):
+    application.jinja_env.get_template(name)
+for format in filters.DATETIME_FORMATS:
+    filters.datetime_pattern(format)
+filters.locale()